@@ -1,6 +1,6 @@
 # api/__init__.py
 import os
-from flask import Flask, jsonify
+from flask import Flask, jsonify, Response, request, g
 from flask_sqlalchemy import SQLAlchemy # Importar
 from flask_cors import CORS  # Importar CORS
 import logging
@@ -50,8 +50,22 @@ def create_app(config_name='default'):
     app.logger.info(f"Blueprint '{fingerprint_bp.name}' registrado.")
 
 
-    # --- Inicialización SDK (Manual a través de endpoint) ---
-    # (Mantenemos la inicialización manual por ahora)
+    # --- Modo del SDK ---
+    # SDK_MODE=matching: servidor sin lector que solo compara plantillas (/verify, /verify/batch, /identify)
+    app.config['SDK_MODE'] = os.getenv('SDK_MODE', sdk_wrapper.SDK_MODE_FULL).lower()
+    if not sdk_wrapper.set_sdk_mode(app.config['SDK_MODE']):
+        raise ValueError(f"SDK_MODE inválido: '{app.config['SDK_MODE']}' (usar 'full' o 'matching').")
+    app.logger.info(f"Modo del SDK: {app.config['SDK_MODE']}.")
+
+    # --- Inicialización SDK (en segundo plano al arrancar, o manual con /initialize) ---
+    # SDK_AUTO_INIT=false vuelve al arranque solo manual
+    from .warmup import sdk_warmup
+    from .match_engine import is_worker_process
+    if os.getenv('SDK_AUTO_INIT', 'true').lower() in ('true', '1', 't') and not _is_reloader_parent() \
+            and not is_worker_process(): # Los workers de matching (spawn) reimportan run.py
+        sdk_warmup.start()
+    else:
+        app.logger.info("Auto-inicialización del SDK desactivada; usar POST /initialize.")
 
 
     # --- Ruta Raíz ---
@@ -66,5 +80,95 @@ def create_app(config_name='default'):
             db_status = "desconectada"
         return jsonify(message="API SecuGen Funcionando", status="ok", database=db_status)
 
+    # --- Sondas para el orquestador ---
+    @app.route('/healthz')
+    def healthz():
+        # Liveness: el proceso responde (no toca SDK ni BD)
+        return jsonify(status="ok")
+
+    @app.route('/readyz')
+    def readyz():
+        # Readiness: listo cuando el SDK terminó de arrancar (lector abierto, o handle de matching)
+        warmup = sdk_warmup.status()
+        return jsonify(ready=warmup["sdk_ready"], warmup=warmup), (200 if warmup["sdk_ready"] else 503)
+
+    # --- Trazas por etapas (log JSON y cabecera Server-Timing) ---
+    _register_tracing(app)
+
+    # --- Métricas Prometheus ---
+    from .sdk_interface.metrics import registry
+    _register_runtime_metrics(registry)
+
+    @app.route('/metrics')
+    def metrics():
+        return Response(registry.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+
+    return app
+
+def _is_reloader_parent():
+    """True en el proceso vigilante del reloader de Flask (modo debug), que no atiende peticiones
+    y no debe abrir el lector."""
+    debug = os.getenv('FLASK_DEBUG', 'False').lower() in ('true', '1', 't')
+    return debug and os.getenv('WERKZEUG_RUN_MAIN') != 'true'
+
+
+def _register_runtime_metrics(registry):
+    """Gauges calculados al exportar /metrics: colas por lector, caché de plantillas y estado del SDK."""
+    from .sdk_interface.device_pool import device_pool
+    from .sdk_interface.scheduler import device_scheduler
+
+    def per_device(key):
+        def collect():
+            values = {(str(d["device_id"]),): d[key] for d in device_pool.status()}
+            if not values: # Sin lectores abiertos el scheduler principal sigue atendiendo matching
+                values[('primary',)] = device_scheduler.queue_depth if key == "queue_depth" else 0
+            return values
+        return collect
+
+    def cache_stat(key):
+        return lambda: {(): sdk_wrapper.get_template_cache_stats()[key]}
+
+    registry.gauge('secugen_device_queue_depth', 'Comandos esperando en la cola del hilo de cada lector.',
+                   ('device_id',)).set_function(per_device("queue_depth"))
+    registry.gauge('secugen_device_in_flight', 'Comandos encolados o en ejecución por lector (DevicePool).',
+                   ('device_id',)).set_function(per_device("in_flight"))
+    registry.gauge('secugen_sdk_ready', '1 si el SDK está listo para el modo configurado (lector abierto o matching).'
+                   ).set_function(lambda: {(): int(sdk_wrapper.is_serving())})
+    registry.gauge('secugen_template_cache_entries', 'Plantillas decodificadas en la caché LRU.'
+                   ).set_function(cache_stat("entries"))
+    registry.gauge('secugen_template_cache_bytes', 'Bytes ocupados por la caché de plantillas.'
+                   ).set_function(cache_stat("bytes"))
+    for key in ("hits", "misses", "evictions"):
+        registry.counter(f'secugen_template_cache_{key}_total', f'Caché de plantillas: {key}.'
+                         ).set_function(cache_stat(key))
+
+
+def _register_tracing(app):
+    """Traza cada petición con TRACE_REQUESTS=true, o solo las que envían 'X-Trace-Timing: 1'.
+    Con TRACE_SERVER_TIMING=true (o esa cabecera) la respuesta incluye Server-Timing por etapa."""
+    from .sdk_interface import tracing
+
+    def timing_requested():
+        return request.headers.get('X-Trace-Timing', '').lower() in ('1', 'true')
+
+    @app.before_request
+    def start_request_trace():
+        if tracing.tracing_enabled() or timing_requested():
+            g.trace_tokens = tracing.start_trace(f"{request.method} {request.path}",
+                                                 http_method=request.method, http_route=request.path)[1]
+
+    @app.after_request
+    def add_server_timing(response):
+        trace = tracing.current_trace()
+        if trace is not None and getattr(g, 'trace_tokens', None) is not None:
+            trace.finish(http_status_code=response.status_code)
+            if timing_requested() or os.getenv('TRACE_SERVER_TIMING', 'false').lower() in ('true', '1', 't'):
+                response.headers['Server-Timing'] = trace.server_timing()
+        return response
 
-    return app
\ No newline at end of file
+    @app.teardown_request
+    def end_request_trace(exc):
+        tokens = g.pop('trace_tokens', None)
+        if tokens is not None:
+            tracing.end_trace(tokens).log()
@@ -0,0 +1,229 @@
+# secugen_api/api/auto_capture.py
+
+"""
+Captura continua (modo kiosco): el lector se sondea sin parar y solo se envía una
+plantilla a los suscriptores (SSE) cuando se detecta un dedo con calidad suficiente.
+
+Cada vuelta es un comando SGFPM_GetImage + GetLastImageQuality en el hilo del
+lector (prioridad de fondo: capturas, matching y control pasan delante). Sin dedo
+la calidad es ~0 y no se llama a CreateTemplate. Tras enviar una plantilla no se
+envía otra hasta que el dedo se retira (lift_polls sondeos seguidos sin dedo), y
+si el mismo dedo se vuelve a apoyar dentro de debounce_seconds se descarta.
+"""
+
+import base64
+import logging
+import queue
+import threading
+import time
+
+from .sdk_interface import wrapper as sdk_wrapper
+from .sdk_interface.device_pool import device_pool, DeviceNotAvailable
+from .sdk_interface.scheduler import CommandCancelled, CommandTimeout, PRIORITY_BACKGROUND, TIMEOUT_CAPTURE
+
+logger = logging.getLogger(__name__)
+
+# Valores por defecto (se pueden cambiar por petición en POST /autocapture/start)
+DEFAULT_PRESENCE_QUALITY = 20 # Calidad mínima para considerar que hay dedo
+DEFAULT_MIN_QUALITY = 50 # Calidad mínima para extraer y enviar la plantilla
+DEFAULT_POLL_INTERVAL = 0.1 # Segundos entre sondeos
+DEFAULT_DEBOUNCE_SECONDS = 3.0 # Ventana en la que el mismo dedo no se vuelve a enviar
+DEFAULT_LIFT_POLLS = 2 # Sondeos seguidos sin dedo para dar el dedo por retirado
+# Eventos pendientes por suscriptor (si no los lee, se descartan los más antiguos)
+SUBSCRIBER_QUEUE_SIZE = 32
+# Espera máxima tras errores seguidos del SDK
+MAX_ERROR_BACKOFF_SECONDS = 2.0
+
+
+class AutoCapture:
+    """Bucle de captura continua de un lector y sus suscriptores."""
+
+    def __init__(self, device_id, presence_quality=DEFAULT_PRESENCE_QUALITY, min_quality=DEFAULT_MIN_QUALITY,
+                 poll_interval=DEFAULT_POLL_INTERVAL, debounce_seconds=DEFAULT_DEBOUNCE_SECONDS,
+                 lift_polls=DEFAULT_LIFT_POLLS, security_level=sdk_wrapper.SL_NORMAL):
+        self.device_id = device_id
+        self.presence_quality = presence_quality
+        self.min_quality = min_quality
+        self.poll_interval = poll_interval
+        self.debounce_seconds = debounce_seconds
+        self.lift_polls = lift_polls
+        self.security_level = security_level
+        self.started_at = None
+        self.stats = {"polls": 0, "low_quality": 0, "debounced": 0, "emitted": 0, "errors": 0}
+        self.error = None
+        self._seq = 0
+        self._subscribers = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        self._stop.clear()
+        self.started_at = time.time()
+        self._thread = threading.Thread(target=self._run, name=f'auto-capture-{self.device_id}', daemon=True)
+        self._thread.start()
+        logger.info(f"Captura continua iniciada en el lector {self.device_id}.")
+
+    def stop(self, reason="Captura continua detenida."):
+        """Detiene el bucle (tras el sondeo en curso) y avisa a los suscriptores."""
+        self._stop.set()
+        self._publish('stopped', {"device_id": self.device_id, "message": reason})
+
+    # --- Suscriptores ---
+
+    def subscribe(self):
+        subscriber = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        with self._lock:
+            self._subscribers.append(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            if subscriber in self._subscribers:
+                self._subscribers.remove(subscriber)
+
+    def _publish(self, event, data):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            while True:
+                try:
+                    subscriber.put_nowait((event, data))
+                    break
+                except queue.Full:
+                    try:
+                        subscriber.get_nowait() # Cliente lento: se descarta el evento más antiguo
+                    except queue.Empty:
+                        pass
+
+    # --- Bucle ---
+
+    def _poll(self, previous_template):
+        _, result = device_pool.call(sdk_wrapper.poll_finger, self.presence_quality, self.min_quality,
+                                     previous_template, self.security_level, device_id=self.device_id,
+                                     priority=PRIORITY_BACKGROUND, timeout=TIMEOUT_CAPTURE)
+        return result
+
+    def _run(self):
+        finger_down = False # Ya se envió la plantilla de la presentación actual
+        absent_polls = 0
+        last_template = None
+        last_emitted_at = 0.0
+        consecutive_errors = 0
+        while not self._stop.is_set():
+            now = time.monotonic()
+            # Solo se compara con la última plantilla dentro de la ventana de debounce
+            previous = last_template if now - last_emitted_at < self.debounce_seconds else None
+            try:
+                result = self._poll(previous)
+            except DeviceNotAvailable as e:
+                self.error = str(e)
+                logger.error(f"Captura continua del lector {self.device_id} detenida: {e}")
+                self.stop(reason=str(e))
+                return
+            except (CommandTimeout, CommandCancelled) as e:
+                result = None
+                logger.warning(f"Sondeo del lector {self.device_id} no completado: {e}")
+            self.stats["polls"] += 1
+
+            if result is None:
+                self.stats["errors"] += 1
+                consecutive_errors += 1
+                self._stop.wait(min(self.poll_interval * 2 ** consecutive_errors, MAX_ERROR_BACKOFF_SECONDS))
+                continue
+            consecutive_errors = 0
+
+            if not result["present"]:
+                absent_polls += 1
+                if absent_polls >= self.lift_polls:
+                    finger_down = False
+            else:
+                absent_polls = 0
+                if not finger_down:
+                    if result["template"] is None:
+                        self.stats["low_quality"] += 1 # Se sigue sondeando: el dedo suele asentarse
+                    elif result["same_as_previous"]:
+                        self.stats["debounced"] += 1
+                        finger_down = True
+                    else:
+                        self._emit(result)
+                        last_template = result["template"]
+                        last_emitted_at = time.monotonic()
+                        finger_down = True
+            self._stop.wait(self.poll_interval)
+        logger.info(f"Captura continua del lector {self.device_id} finalizada.")
+
+    def _emit(self, result):
+        self._seq += 1
+        self.stats["emitted"] += 1
+        self._publish('template', {
+            "seq": self._seq,
+            "device_id": self.device_id,
+            "quality": result["quality"],
+            "template": base64.b64encode(result["template"]).decode('ascii'),
+            "captured_at": time.time(),
+        })
+
+    def status(self):
+        with self._lock:
+            subscribers = len(self._subscribers)
+        return {"device_id": self.device_id, "running": self.running, "started_at": self.started_at,
+                "subscribers": subscribers, "presence_quality": self.presence_quality,
+                "min_quality": self.min_quality, "poll_interval": self.poll_interval,
+                "debounce_seconds": self.debounce_seconds, "lift_polls": self.lift_polls,
+                "stats": dict(self.stats), "error": self.error}
+
+
+class AutoCaptureManager:
+    """Una captura continua como máximo por lector."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._captures = {} # device_id -> AutoCapture
+
+    def start(self, device_id=None, **settings):
+        """Arranca la captura continua en el lector pedido (o el más libre). Devuelve (AutoCapture, creada)."""
+        device_id = device_pool.select(device_id).device_id # DeviceNotAvailable si no existe
+        with self._lock:
+            capture = self._captures.get(device_id)
+            if capture is not None and capture.running:
+                return capture, False
+            capture = self._captures[device_id] = AutoCapture(device_id, **settings)
+            capture.start()
+        return capture, True
+
+    def get(self, device_id=None):
+        """Captura continua de ese lector, o la única en marcha si no se indica. None si no hay."""
+        with self._lock:
+            if device_id is not None:
+                return self._captures.get(device_id)
+            running = [capture for capture in self._captures.values() if capture.running]
+            return running[0] if len(running) == 1 else None
+
+    def stop(self, device_id):
+        """Detiene la captura continua del lector. Devuelve False si no estaba en marcha."""
+        with self._lock:
+            capture = self._captures.get(device_id)
+        if capture is None or not capture.running:
+            return False
+        capture.stop()
+        return True
+
+    def stop_all(self, reason="Captura continua detenida."):
+        with self._lock:
+            captures = list(self._captures.values())
+        for capture in captures:
+            if capture.running:
+                capture.stop(reason=reason)
+
+    def status(self):
+        with self._lock:
+            return [capture.status() for capture in self._captures.values()]
+
+
+# Instancia compartida por las rutas
+auto_capture = AutoCaptureManager()
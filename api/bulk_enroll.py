@@ -0,0 +1,117 @@
+# secugen_api/api/bulk_enroll.py
+
+"""
+Enrolamiento masivo (p.ej. migración desde un sistema legado).
+
+En lugar de tres viajes a la BD por huella (usuario, duplicado, insert+commit),
+cada lote hace una consulta de usuarios y un INSERT multi-fila con
+ON CONFLICT DO NOTHING sobre el índice único (user_id, finger_position)
+(migrations/003_fingerprints_user_finger_unique.sql); RETURNING indica qué filas
+se insertaron y el resto ya existían. Todo va en una transacción por petición.
+"""
+
+import logging
+
+from sqlalchemy.dialects.postgresql import insert
+
+from . import db
+from .models import User, Fingerprint
+from .gallery import gallery
+from .user_templates import user_templates
+from .sdk_interface import wrapper as sdk_wrapper
+from .sdk_interface.tracing import span
+
+logger = logging.getLogger(__name__)
+
+# Máximo de registros por petición y filas por sentencia INSERT
+MAX_BULK_RECORDS = 10000
+INSERT_CHUNK_SIZE = 1000
+
+# Estado de cada registro en la respuesta
+BULK_CREATED = 'created'
+BULK_EXISTS = 'exists'                 # Ya había huella para ese usuario y dedo (o repetido en la petición)
+BULK_USER_NOT_FOUND = 'user_not_found'
+BULK_INVALID = 'invalid'
+
+
+def _parse_record(record):
+    """Devuelve ((user_id, finger_position, bytes_plantilla), None) o (None, mensaje_error)."""
+    if not isinstance(record, dict):
+        return None, "Cada registro debe ser un objeto JSON."
+    user_id = record.get('user_id')
+    finger_position = record.get('finger_position')
+    template = record.get('template')
+    if not isinstance(user_id, int) or not finger_position or not isinstance(finger_position, str) or not template:
+        return None, "Faltan 'user_id' (entero), 'finger_position' o 'template'."
+    template_bytes = sdk_wrapper.template_to_bytes(template)
+    if template_bytes is None:
+        return None, "Plantilla Base64 inválida."
+    return (user_id, finger_position, template_bytes), None
+
+
+def bulk_enroll(records, template_format='SG400'):
+    """Inserta muchas huellas. records: lista de {"user_id", "finger_position", "template" (Base64)}.
+    Devuelve una lista de resultados en el mismo orden: {"status", "fingerprint_id"?, "message"?}.
+    Requiere app context; relanza errores de BD tras rollback (no se inserta nada)."""
+    results = [None] * len(records)
+    pending = {} # (user_id, finger_position) -> (posición, bytes_plantilla)
+    for position, record in enumerate(records):
+        parsed, error_message = _parse_record(record)
+        if error_message:
+            results[position] = {"status": BULK_INVALID, "message": error_message}
+            continue
+        user_id, finger_position, template_bytes = parsed
+        if (user_id, finger_position) in pending:
+            results[position] = {"status": BULK_EXISTS, "message": "Repetido en la misma petición."}
+            continue
+        pending[(user_id, finger_position)] = (position, template_bytes)
+
+    # Una consulta para todos los usuarios referenciados
+    with span("db.user_lookup"):
+        user_ids = {user_id for user_id, _ in pending}
+        existing_users = {user_id for (user_id,) in
+                          User.query.with_entities(User.id).filter(User.id.in_(user_ids))} if user_ids else set()
+    rows = []
+    for (user_id, finger_position), (position, template_bytes) in pending.items():
+        if user_id not in existing_users:
+            results[position] = {"status": BULK_USER_NOT_FOUND, "message": f"Usuario con ID {user_id} no encontrado."}
+            continue
+        rows.append({"user_id": user_id, "finger_position": finger_position,
+                     "template_format": template_format, "template_blob": template_bytes})
+
+    created = [] # (fingerprint_id, user_id, finger_position, bytes_plantilla)
+    try:
+        for start in range(0, len(rows), INSERT_CHUNK_SIZE):
+            chunk = rows[start:start + INSERT_CHUNK_SIZE]
+            statement = insert(Fingerprint.__table__).values(chunk).on_conflict_do_nothing(
+                index_elements=['user_id', 'finger_position']
+            ).returning(Fingerprint.id, Fingerprint.user_id, Fingerprint.finger_position)
+            with span("db.bulk_insert", rows=len(chunk)):
+                inserted = db.session.execute(statement).all()
+            for fp_id, user_id, finger_position in inserted:
+                position, template_bytes = pending[(user_id, finger_position)]
+                results[position] = {"status": BULK_CREATED, "fingerprint_id": fp_id}
+                created.append((fp_id, user_id, finger_position, template_bytes))
+        with span("db.commit"):
+            db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    # Las filas sin RETURNING chocaron con el índice único: ya existían
+    for row in rows:
+        position, _ = pending[(row["user_id"], row["finger_position"])]
+        if results[position] is None:
+            results[position] = {"status": BULK_EXISTS,
+                                 "message": f"Ya existe una huella para el dedo '{row['finger_position']}' de este usuario."}
+
+    for user_id in {user_id for _, user_id, _, _ in created}:
+        user_templates.invalidate(user_id)
+    try:
+        with span("gallery.add", count=len(created)):
+            gallery.add_many(created)
+    except Exception as e:
+        # Las filas ya están guardadas: GALLERY_SYNC (o la próxima carga) las añadirá a la galería
+        logger.error(f"{len(created)} huellas guardadas pero no añadidas a la galería: {e}", exc_info=True)
+    logger.info(f"Enrolamiento masivo: {len(created)} de {len(records)} registros insertados.")
+    return results
@@ -0,0 +1,182 @@
+# secugen_api/api/capture_jobs.py
+
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from .sdk_interface import tracing
+from .sdk_interface.device_pool import device_pool, DeviceNotAvailable
+from .sdk_interface.scheduler import (DeviceScheduler, CommandCancelled, CommandTimeout,
+                                      PRIORITY_CAPTURE, TIMEOUT_CAPTURE)
+
+logger = logging.getLogger(__name__)
+
+# Estados de un trabajo
+JOB_PENDING = 'pending'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+JOB_CANCELLED = 'cancelled'
+
+
+class CaptureJobError(Exception):
+    """Error 'esperado' de un trabajo (captura fallida, conflicto...): se publica su mensaje."""
+
+
+class CaptureJob:
+    """Trabajo de captura/enrolamiento en segundo plano. Los clientes esperan en una Condition."""
+
+    def __init__(self, kind, device_id=None):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.device_id = device_id # Lector pedido (None = el más libre); al capturar, el usado
+        self.status = JOB_PENDING
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self._changed = threading.Condition()
+        self._version = 0 # Se incrementa en cada cambio de estado (para SSE)
+        self._cancel_requested = False
+        self._device_future = None # Comando en curso en el hilo del dispositivo
+
+    @property
+    def finished(self):
+        return self.status in (JOB_DONE, JOB_FAILED, JOB_CANCELLED)
+
+    def _set(self, status, result=None, error=None):
+        with self._changed:
+            self.status = status
+            self.result = result
+            self.error = error
+            if status in (JOB_DONE, JOB_FAILED, JOB_CANCELLED):
+                self.finished_at = time.time()
+            self._version += 1
+            self._changed.notify_all()
+
+    def wait_for_change(self, seen_version, timeout):
+        """Bloquea (sin consumir CPU) hasta que cambie el estado o venza timeout. Devuelve la versión actual."""
+        with self._changed:
+            if self._version == seen_version and not self.finished:
+                self._changed.wait(timeout)
+            return self._version
+
+    def wait(self, timeout):
+        """Espera a que el trabajo termine (long-poll). Devuelve True si terminó."""
+        deadline = time.monotonic() + timeout
+        with self._changed:
+            while not self.finished:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._changed.wait(remaining)
+            return self.finished
+
+    def run_on_device(self, fn, *args, priority=PRIORITY_CAPTURE, timeout=TIMEOUT_CAPTURE):
+        """Ejecuta fn(*args, session=...) en el hilo del lector elegido por el pool.
+
+        Cancelar el trabajo cancela el comando si sigue en cola.
+        """
+        if self._cancel_requested:
+            raise CommandCancelled("Trabajo cancelado.")
+        self.device_id, self._device_future = device_pool.submit(fn, *args, device_id=self.device_id,
+                                                                 priority=priority, timeout=timeout)
+        try:
+            return DeviceScheduler.wait(self._device_future, timeout)
+        except CommandTimeout as e:
+            raise CaptureJobError(str(e))
+        finally:
+            self._device_future = None
+
+    def cancel(self):
+        """Cancela el trabajo si aún no ha empezado a capturar. Devuelve True si se canceló."""
+        with self._changed:
+            if self.finished:
+                return False
+            if self.status == JOB_PENDING:
+                self._cancel_requested = True
+                return True
+            future = self._device_future
+            if future is not None and future.cancel():
+                self._cancel_requested = True
+                return True
+            return False # Ya está esperando el dedo en el lector: no se puede interrumpir
+
+    def to_dict(self):
+        data = {"job_id": self.id, "kind": self.kind, "status": self.status, "device_id": self.device_id}
+        if self.status == JOB_DONE:
+            data["result"] = self.result
+        elif self.status in (JOB_FAILED, JOB_CANCELLED):
+            data["message"] = self.error
+        return data
+
+
+class CaptureJobManager:
+    """Ejecuta trabajos de captura fuera de los workers de Flask y los conserva un tiempo para consulta.
+
+    Los hilos del executor solo orquestan; las llamadas al SDK se serializan en el
+    hilo del dispositivo (DeviceScheduler) mediante CaptureJob.run_on_device.
+    """
+
+    def __init__(self, max_workers=8, retention_seconds=300):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='capture-job')
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self.retention_seconds = retention_seconds
+
+    def submit(self, kind, fn, device_id=None):
+        """Encola fn(job) (devuelve el dict de resultado o lanza CaptureJobError). Devuelve el CaptureJob."""
+        job = CaptureJob(kind, device_id)
+        with self._lock:
+            self._purge_locked()
+            self._jobs[job.id] = job
+        self._executor.submit(self._run, job, fn)
+        logger.info(f"Trabajo {kind} {job.id} encolado.")
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """Cancela un trabajo. Devuelve None si no existe, True/False según se haya podido cancelar."""
+        job = self.get(job_id)
+        if job is None:
+            return None
+        return job.cancel()
+
+    def _run(self, job, fn):
+        with job._changed:
+            if job._cancel_requested:
+                job._set(JOB_CANCELLED, error="Trabajo cancelado.")
+                return
+            job._set(JOB_RUNNING)
+        # Con TRACE_REQUESTS=true cada trabajo tiene su propia traza (la petición que lo creó ya respondió)
+        trace_tokens = tracing.start_trace(f"job.{job.kind}", job_id=job.id)[1] if tracing.tracing_enabled() else None
+        try:
+            job._set(JOB_DONE, result=fn(job))
+            logger.info(f"Trabajo {job.kind} {job.id} completado.")
+        except CommandCancelled:
+            logger.info(f"Trabajo {job.kind} {job.id} cancelado.")
+            job._set(JOB_CANCELLED, error="Trabajo cancelado.")
+        except (CaptureJobError, DeviceNotAvailable) as e:
+            logger.warning(f"Trabajo {job.kind} {job.id} falló: {e}")
+            job._set(JOB_FAILED, error=str(e))
+        except Exception as e:
+            logger.error(f"Excepción en trabajo {job.kind} {job.id}: {e}", exc_info=True)
+            job._set(JOB_FAILED, error="Error interno durante el trabajo de captura.")
+        finally:
+            if trace_tokens is not None:
+                tracing.end_trace(trace_tokens, status=job.status).log()
+
+    def _purge_locked(self):
+        cutoff = time.time() - self.retention_seconds
+        expired = [job_id for job_id, job in self._jobs.items() if job.finished and job.finished_at < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+
+# Instancia compartida por las rutas
+capture_jobs = CaptureJobManager()
@@ -0,0 +1,235 @@
+# secugen_api/api/data_transfer.py
+
+"""
+Exportación / importación en streaming de 'users' y 'fingerprints' como NDJSON.
+
+Una línea JSON por fila, primero los usuarios y después las huellas:
+
+    {"type": "user", "id": 1, "username": "ana", "email": "ana@x.org", "created_at": "..."}
+    {"type": "fingerprint", "id": 7, "user_id": 1, "finger_position": "...",
+     "template_format": "SG400", "template": "<base64>", "created_at": "..."}
+
+La exportación lee con cursor de servidor (yield_per) y emite bloques de unos
+64 KB; la importación lee el cuerpo línea a línea e inserta por lotes con
+ON CONFLICT DO NOTHING, con un commit por lote. En ambos sentidos la memoria
+depende del tamaño de lote, no del de las tablas.
+"""
+
+import base64
+import binascii
+import datetime
+import json
+import logging
+
+from sqlalchemy import select, text
+from sqlalchemy.dialects.postgresql import insert
+
+from . import db
+from .models import User, Fingerprint
+from .gallery import gallery
+from .user_templates import user_templates
+
+logger = logging.getLogger(__name__)
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+# Filas por vuelta del cursor de servidor, bytes por bloque enviado y filas por INSERT
+EXPORT_BATCH_SIZE = 1000
+EXPORT_CHUNK_BYTES = 64 * 1024
+IMPORT_BATCH_SIZE = 1000
+# Línea más larga aceptada en la importación y errores detallados en la respuesta
+MAX_LINE_BYTES = 64 * 1024
+MAX_REPORTED_ERRORS = 100
+
+TRANSFER_TABLES = ('users', 'fingerprints')
+
+
+def _isoformat(value):
+    return value.isoformat() if value is not None else None
+
+
+def _parse_datetime(value):
+    return datetime.datetime.fromisoformat(value) if value else None
+
+
+def _stream_rows(statement):
+    """Filas de 'statement' leídas por lotes con un cursor de servidor."""
+    return db.session.execute(statement.execution_options(yield_per=EXPORT_BATCH_SIZE))
+
+
+def export_lines(tables=TRANSFER_TABLES):
+    """Genera bloques NDJSON (bytes) con las tablas pedidas. Requiere app/request context mientras se consume."""
+    def lines():
+        if 'users' in tables:
+            for user_id, username, email, created_at in _stream_rows(
+                    select(User.id, User.username, User.email, User.created_at).order_by(User.id)):
+                yield {"type": "user", "id": user_id, "username": username, "email": email,
+                       "created_at": _isoformat(created_at)}
+        if 'fingerprints' in tables:
+            for fp_id, user_id, finger_position, template_format, template_blob, template_b64, created_at in _stream_rows(
+                    select(Fingerprint.id, Fingerprint.user_id, Fingerprint.finger_position, Fingerprint.template_format,
+                           Fingerprint.template_blob, Fingerprint.template_data, Fingerprint.created_at)
+                    .order_by(Fingerprint.id)):
+                # Filas no migradas (001) ya tienen el Base64
+                template = base64.b64encode(template_blob).decode('ascii') if template_blob is not None else template_b64
+                yield {"type": "fingerprint", "id": fp_id, "user_id": user_id, "finger_position": finger_position,
+                       "template_format": template_format, "template": template, "created_at": _isoformat(created_at)}
+
+    chunk = []
+    chunk_bytes = 0
+    for record in lines():
+        line = json.dumps(record, ensure_ascii=False, separators=(',', ':')).encode('utf-8') + b'\n'
+        chunk.append(line)
+        chunk_bytes += len(line)
+        if chunk_bytes >= EXPORT_CHUNK_BYTES:
+            yield b''.join(chunk)
+            chunk, chunk_bytes = [], 0
+    if chunk:
+        yield b''.join(chunk)
+
+
+def _read_lines(stream):
+    """Itera (número_de_línea, bytes|None) del cuerpo; None si la línea supera MAX_LINE_BYTES (se descarta)."""
+    number = 0
+    while True:
+        line = stream.readline(MAX_LINE_BYTES + 1)
+        if not line:
+            return
+        number += 1
+        if len(line) > MAX_LINE_BYTES and not line.endswith(b'\n'):
+            while line and not line.endswith(b'\n'): # Consumir el resto de la línea sin guardarla
+                line = stream.readline(MAX_LINE_BYTES)
+            yield number, None
+            continue
+        yield number, line
+
+
+def _user_row(record):
+    if not record.get('username') or not record.get('email'):
+        raise ValueError("Faltan 'username' o 'email'.")
+    row = {"username": record['username'], "email": record['email'],
+           "created_at": _parse_datetime(record.get('created_at')) or datetime.datetime.utcnow()}
+    if record.get('id') is not None:
+        row["id"] = int(record['id'])
+    return row
+
+
+def _fingerprint_row(record):
+    if not isinstance(record.get('user_id'), int) or not record.get('finger_position') or not record.get('template'):
+        raise ValueError("Faltan 'user_id' (entero), 'finger_position' o 'template'.")
+    try:
+        template_bytes = base64.b64decode(record['template'], validate=True)
+    except (TypeError, binascii.Error):
+        raise ValueError("Plantilla Base64 inválida.")
+    row = {"user_id": record['user_id'], "finger_position": record['finger_position'],
+           "template_format": record.get('template_format') or 'SG400', "template_blob": template_bytes,
+           "created_at": _parse_datetime(record.get('created_at')) or datetime.datetime.utcnow()}
+    if record.get('id') is not None:
+        row["id"] = int(record['id'])
+    return row
+
+
+class NdjsonImport:
+    """Importa un cuerpo NDJSON por lotes. Cada lote va en su propia transacción."""
+
+    def __init__(self):
+        self.counts = {"users": {"inserted": 0, "skipped": 0}, "fingerprints": {"inserted": 0, "skipped": 0}}
+        self.error_count = 0
+        self.errors = []
+        self._users = []
+        self._fingerprints = []
+
+    def _error(self, line_number, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"line": line_number, "message": message})
+
+    def run(self, stream):
+        """Lee 'stream' hasta el final. Relanza errores de BD (los lotes ya confirmados se quedan)."""
+        for line_number, line in _read_lines(stream):
+            if line is None:
+                self._error(line_number, f"Línea de más de {MAX_LINE_BYTES} bytes.")
+                continue
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+                if not isinstance(record, dict):
+                    raise ValueError("Cada línea debe ser un objeto JSON.")
+                kind = record.get('type')
+                if kind == 'user':
+                    self._users.append(_user_row(record))
+                elif kind == 'fingerprint':
+                    self._fingerprints.append(_fingerprint_row(record))
+                else:
+                    raise ValueError("'type' debe ser 'user' o 'fingerprint'.")
+            except (ValueError, TypeError) as e: # json.JSONDecodeError es ValueError
+                self._error(line_number, str(e))
+                continue
+            if len(self._users) >= IMPORT_BATCH_SIZE:
+                self._flush_users()
+            if len(self._fingerprints) >= IMPORT_BATCH_SIZE:
+                self._flush_users() # Las huellas pueden referirse a usuarios aún en el lote
+                self._flush_fingerprints()
+        self._flush_users()
+        self._flush_fingerprints()
+        self._sync_sequences()
+        logger.info(f"Importación NDJSON: {self.counts} ({self.error_count} líneas con error).")
+        return self.summary()
+
+    @staticmethod
+    def _insert(table, rows, *returning):
+        """INSERT multi-fila con ON CONFLICT DO NOTHING (sin columnas: cubre cualquier clave única)
+        y commit. Filas con y sin 'id' van en sentencias separadas. Devuelve las filas de RETURNING."""
+        inserted = []
+        try:
+            for group in ([row for row in rows if "id" in row], [row for row in rows if "id" not in row]):
+                if group:
+                    statement = insert(table).values(group).on_conflict_do_nothing().returning(*returning)
+                    inserted.extend(db.session.execute(statement).all())
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        return inserted
+
+    def _flush_users(self):
+        if not self._users:
+            return
+        rows, self._users = self._users, []
+        inserted = self._insert(User.__table__, rows, User.id) # Conflicto en id, username o email: se omite
+        self.counts["users"]["inserted"] += len(inserted)
+        self.counts["users"]["skipped"] += len(rows) - len(inserted)
+
+    def _flush_fingerprints(self):
+        if not self._fingerprints:
+            return
+        rows, self._fingerprints = self._fingerprints, []
+        # Huellas de usuarios inexistentes se omiten (la FK haría fallar el lote entero)
+        user_ids = {row["user_id"] for row in rows}
+        existing_users = set(db.session.execute(select(User.id).where(User.id.in_(user_ids))).scalars())
+        valid_rows = [row for row in rows if row["user_id"] in existing_users]
+        inserted = []
+        if valid_rows:
+            inserted = self._insert(Fingerprint.__table__, valid_rows,
+                                    Fingerprint.id, Fingerprint.user_id, Fingerprint.finger_position)
+        self.counts["fingerprints"]["inserted"] += len(inserted)
+        self.counts["fingerprints"]["skipped"] += len(rows) - len(inserted)
+        if inserted:
+            templates = {}
+            for row in valid_rows: # Repetidos en el lote: se insertó la primera
+                templates.setdefault((row["user_id"], row["finger_position"]), row["template_blob"])
+            gallery.add_many((fp_id, user_id, finger_position, templates[(user_id, finger_position)])
+                             for fp_id, user_id, finger_position in inserted)
+            for user_id in {user_id for _, user_id, _ in inserted}:
+                user_templates.invalidate(user_id)
+
+    def _sync_sequences(self):
+        """Con ids explícitos las secuencias SERIAL no avanzan: se ponen al máximo actual."""
+        for table in TRANSFER_TABLES:
+            db.session.execute(text(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                                    f"COALESCE((SELECT MAX(id) FROM {table}), 0) + 1, false)"))
+        db.session.commit()
+
+    def summary(self):
+        return {"users": self.counts["users"], "fingerprints": self.counts["fingerprints"],
+                "error_count": self.error_count, "errors": self.errors}
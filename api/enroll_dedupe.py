@@ -0,0 +1,94 @@
+# secugen_api/api/enroll_dedupe.py
+
+"""
+Detección de huellas duplicadas al enrolar (el mismo dedo registrado con otro usuario).
+
+Antes de insertar, la plantilla nueva se compara con toda la galería en memoria
+usando la búsqueda con puntuación (SGFPM_GetMatchingScore) sin corte anticipado,
+para obtener todos los registros que coinciden y no solo el primero. Con
+MATCH_WORKERS la búsqueda se reparte entre los procesos del motor paralelo; sin
+ellos va por el handle único en el hilo del lector.
+
+La comprobación tiene un presupuesto de tiempo estricto (ENROLL_DEDUPE_BUDGET) que
+empieza a contar al pedirla, así que incluye la espera en la cola del lector: al
+agotarlo se deja de comparar (o ni se empieza) y el enrolamiento sigue, indicando en
+la respuesta que la comprobación quedó incompleta.
+"""
+
+import logging
+import os
+import time
+from collections import namedtuple
+
+from .gallery import gallery
+from .sdk_interface import wrapper as sdk_wrapper
+from .sdk_interface.scheduler import device_scheduler, CommandTimeout, CommandCancelled, PRIORITY_MATCH
+from .sdk_interface.tracing import span
+
+logger = logging.getLogger(__name__)
+
+# Comprobación activada por defecto (cada petición puede pedirla o no con 'dedupe')
+DEDUPE_BY_DEFAULT = os.getenv('ENROLL_DEDUPE', 'false').lower() in ('true', '1', 't')
+# Presupuesto de tiempo por defecto y máximo que puede pedir un cliente (segundos)
+DEFAULT_DEDUPE_BUDGET = float(os.getenv('ENROLL_DEDUPE_BUDGET', 0.5))
+MAX_DEDUPE_BUDGET = 5.0
+# Registros coincidentes devueltos como máximo
+MAX_REPORTED_DUPLICATES = 20
+# Margen para recoger el resultado: la búsqueda solo mira el reloj cada STOP_CHECK_EVERY comparaciones
+RESULT_GRACE = 0.25
+
+# duplicates: [(GalleryEntry, puntuación)] de mayor a menor; complete: False si se agotó el tiempo
+DedupeResult = namedtuple('DedupeResult', ['duplicates', 'compared', 'gallery_size', 'complete', 'elapsed'])
+
+
+def find_duplicates(template, security_level=sdk_wrapper.SL_NORMAL, time_budget=DEFAULT_DEDUPE_BUDGET):
+    """Busca la plantilla (bytes o Base64) en toda la galería. Devuelve DedupeResult o None (error del SDK).
+    Requiere app context (carga la galería la primera vez; relanza errores de BD)."""
+    started = time.monotonic()
+    deadline = started + time_budget # Cuenta desde aquí: carga de la galería y cola incluidas
+    gallery.ensure_loaded()
+    gallery_size = len(gallery)
+    with span("enroll.dedupe", gallery_size=gallery_size):
+        if gallery.uses_engine:
+            result = _search_until(template, security_level, deadline)
+        else:
+            # Lo que quede del presupuesto es a la vez el tiempo máximo en cola y el de búsqueda
+            future = device_scheduler.submit(_search_until, template, security_level, deadline,
+                                             priority=PRIORITY_MATCH, timeout=_remaining(deadline))
+            try:
+                result = device_scheduler.wait(future, _remaining(deadline) + RESULT_GRACE)
+            except (CommandTimeout, CommandCancelled) as e:
+                logger.warning(f"Comprobación de duplicados sin turno en el lector: {e}")
+                result = sdk_wrapper.SearchResult([], 0, True)
+    elapsed = time.monotonic() - started
+    if result is None:
+        return None
+    complete = result.compared >= gallery_size
+    if not complete:
+        logger.warning(f"Comprobación de duplicados incompleta: {result.compared} de {gallery_size} "
+                       f"plantillas en {elapsed:.3f} s (presupuesto {time_budget} s).")
+    return DedupeResult(result.candidates, result.compared, gallery_size, complete, elapsed)
+
+
+def _remaining(deadline):
+    return max(0.0, deadline - time.monotonic())
+
+
+def _search_until(template, security_level, deadline):
+    """Búsqueda con el presupuesto que quede al empezar (sin nada que comparar si ya se agotó)."""
+    remaining = _remaining(deadline)
+    if not remaining:
+        return sdk_wrapper.SearchResult([], 0, True) # time_budget=0 significaría "sin límite"
+    return gallery.search(template, MAX_REPORTED_DUPLICATES, security_level, 0, remaining)
+
+
+def summary(result):
+    """Datos de la comprobación para la respuesta JSON."""
+    return {"compared": result.compared, "gallery_size": result.gallery_size, "complete": result.complete,
+            "elapsed_ms": round(result.elapsed * 1000, 1)}
+
+
+def duplicates_json(result):
+    return [{"fingerprint_id": entry.fingerprint_id, "user_id": entry.user_id,
+             "finger_position": entry.finger_position, "score": score}
+            for entry, score in result.duplicates]
@@ -1,28 +1,136 @@
 # secugen_api/api/fingerprint_routes.py
 
-from flask import Blueprint, jsonify, request, current_app
+import base64
+import json
+import os
+import queue
+import struct
+
+from flask import Blueprint, Response, jsonify, request, current_app, url_for, stream_with_context
+from sqlalchemy.exc import IntegrityError
 
 # Importar el módulo wrapper con nuestras funciones SDK
 from .sdk_interface import wrapper as sdk_wrapper 
 from . import db 
 from .models import User, Fingerprint # Importar modelos de models.py
+from .gallery import gallery # Galería en memoria para identificación 1:N
+from .gallery_sync import gallery_sync
+from .user_templates import user_templates
+from .bulk_enroll import bulk_enroll, MAX_BULK_RECORDS, BULK_CREATED
+from . import enroll_dedupe
+from .data_transfer import export_lines, NdjsonImport, NDJSON_MIMETYPE, TRANSFER_TABLES
+from .auto_capture import auto_capture
+from .image_encoding import ENCODERS as IMAGE_ENCODERS, IMAGE_MIMETYPES
+from .capture_jobs import capture_jobs, CaptureJobError, JOB_FAILED, JOB_CANCELLED
+from .sdk_interface.device_pool import device_pool, DeviceNotAvailable
+from .sdk_interface.tracing import span
+from .warmup import sdk_warmup, schedule_startup_blink, WARMUP_READY
+from .sdk_interface.scheduler import (device_scheduler, CommandTimeout, CommandCancelled,
+                                      PRIORITY_CONTROL, PRIORITY_MATCH, PRIORITY_CAPTURE,
+                                      TIMEOUT_CONTROL, TIMEOUT_MATCH, TIMEOUT_CAPTURE)
 # Crear el Blueprint para estas rutas
 # Usaremos 'fingerprint_api' como nombre interno para el blueprint
 fingerprint_bp = Blueprint('fingerprint_api', __name__)
 
-# Helper para verificar si el SDK está listo
+# Helper para verificar si el SDK está listo (lector abierto: captura, LED, estado)
 def is_sdk_ready():
-    return sdk_wrapper.sdk_initialized and sdk_wrapper.device_opened
+    return sdk_wrapper.is_ready()
+
+# Comparar plantillas solo necesita el SDK inicializado (también en modo solo matching)
+def is_matcher_ready():
+    return sdk_wrapper.is_matcher_ready()
+
+def sdk_not_ready_message():
+    if sdk_wrapper.is_matching_only():
+        return "Servidor en modo solo matching: no hay lector para capturar."
+    return "SDK no inicializado o dispositivo no abierto."
+
+# Todas las llamadas al SDK pasan por el hilo del dispositivo (device_scheduler)
+@fingerprint_bp.errorhandler(CommandTimeout)
+def handle_command_timeout(e):
+    current_app.logger.warning(f"Timeout de comando en el dispositivo: {e}")
+    return jsonify({"success": False, "message": f"Tiempo de espera agotado en el lector: {e}"}), 504
+
+@fingerprint_bp.errorhandler(DeviceNotAvailable)
+def handle_device_not_available(e):
+    return jsonify({"success": False, "message": str(e)}), 404
+
+@fingerprint_bp.errorhandler(CommandCancelled)
+def handle_command_cancelled(e):
+    return jsonify({"success": False, "message": "Operación cancelada antes de ejecutarse en el lector."}), 409
+
+def requested_device_id(data=None):
+    """Lector pedido por el cliente ('device_id' en el JSON o en la query). None = el más libre."""
+    device_id = data.get('device_id') if data else None
+    if device_id is None:
+        device_id = request.args.get('device_id', type=int)
+    return device_id if isinstance(device_id, int) else None
+
+# --- Modo binario (application/octet-stream) ---
+OCTET_STREAM = 'application/octet-stream'
+
+def wants_octet_stream():
+    """True si el cliente prefiere la plantilla en binario (Accept: application/octet-stream)."""
+    return request.accept_mimetypes.best_match(['application/json', OCTET_STREAM]) == OCTET_STREAM
+
+def is_octet_stream_request():
+    """True si el cuerpo de la petición es binario (Content-Type: application/octet-stream)."""
+    return request.mimetype == OCTET_STREAM
+
+def requested_security_level(data=None):
+    """Nivel de seguridad del matching ('security_level' en el JSON o en la query, 1-9; por defecto 5).
+    Devuelve (nivel|None, mensaje_error)."""
+    security_level = data.get('security_level') if data else None
+    if security_level is None:
+        security_level = request.args.get('security_level', sdk_wrapper.SL_NORMAL, type=int)
+    if isinstance(security_level, bool) or not isinstance(security_level, int) or not sdk_wrapper.SL_LOWEST <= security_level <= sdk_wrapper.SL_HIGHEST:
+        return None, f"'security_level' debe ser un entero entre {sdk_wrapper.SL_LOWEST} y {sdk_wrapper.SL_HIGHEST}."
+    return security_level, None
+
+def requested_probe(data):
+    """Plantilla de búsqueda opcional ('template' en el JSON; sin ella se captura del lector).
+    Devuelve (plantilla|None, mensaje_error)."""
+    if not isinstance(data, dict):
+        return None, "El cuerpo JSON debe ser un objeto."
+    probe = data.get('template')
+    if probe is None or probe == '':
+        return None, None
+    if not _is_template_value(probe):
+        return None, "'template' debe ser una plantilla en Base64."
+    return probe, None
+
+def split_framed_templates(body, count):
+    """Separa 'count' plantillas de un cuerpo binario: cada una va precedida de su longitud
+    como uint32 big-endian. Devuelve lista de bytes o None si el formato no cuadra."""
+    templates = []
+    offset = 0
+    for _ in range(count):
+        if offset + 4 > len(body):
+            return None
+        (length,) = struct.unpack_from('>I', body, offset)
+        offset += 4
+        if length == 0 or offset + length > len(body):
+            return None
+        templates.append(body[offset:offset + length])
+        offset += length
+    return templates if offset == len(body) else None
 
 @fingerprint_bp.route('/initialize', methods=['POST'])
 def initialize():
-    """Inicializa el SDK y abre el dispositivo."""
+    """Inicializa el SDK y abre el dispositivo (si el arranque automático no lo hizo ya)."""
     current_app.logger.info("API Request: /initialize")
-    init_success = sdk_wrapper.initialize_sdk() # Asigna el resultado booleano a UNA variable
+    init_success = device_scheduler.call(device_pool.open_devices, blink=False, # Parpadeo en segundo plano
+                                         priority=PRIORITY_CONTROL, timeout=TIMEOUT_CAPTURE) # Asigna el resultado booleano a UNA variable
 
     if init_success:
+        if sdk_warmup.state != WARMUP_READY:
+            sdk_warmup.mark_ready()
+            schedule_startup_blink()
         # Si la inicialización fue exitosa, creamos un mensaje de éxito
-        message = "SDK inicializado y dispositivo abierto correctamente."
+        if sdk_wrapper.is_matching_only():
+            message = "SDK inicializado en modo solo matching (sin lector)."
+        else:
+            message = "SDK inicializado y dispositivo abierto correctamente."
         return jsonify({"success": True, "message": message}), 200
     else:
         # Si falló, creamos un mensaje de error genérico (los detalles estarán en el log del servidor)
@@ -33,21 +141,35 @@ def initialize():
 def terminate():
     """Cierra el dispositivo y termina el SDK."""
     current_app.logger.info("API Request: /terminate")
-    success, message = sdk_wrapper.terminate_sdk()
+    auto_capture.stop_all(reason="SDK terminado.") # Que no encole más capturas mientras se cierra
+    # Cada lector se cierra en su hilo; el principal (y el SDK) en este
+    success = device_scheduler.call(device_pool.close_devices, priority=PRIORITY_CONTROL, timeout=TIMEOUT_CAPTURE) # Devuelve solo un booleano
+    sdk_warmup.mark_stopped()
+    message = "SDK terminado correctamente." if success else "SDK terminado con errores al cerrar (ver logs del servidor)."
     # Terminate usualmente no debería fallar críticamente
     return jsonify({"success": success, "message": message}), 200
 
 @fingerprint_bp.route('/status', methods=['GET'])
 def get_status():
-    """Obtiene información y estado del lector conectado."""
+    """Obtiene información y estado del lector principal y de cada lector abierto."""
     current_app.logger.info("API Request: /status")
+    if sdk_wrapper.is_matching_only() and is_matcher_ready():
+        # Sin lector: solo estado del matching
+        return jsonify({"success": True, "status": "ok", "mode": sdk_wrapper.get_sdk_mode(), "devices": [],
+                        "template_cache": sdk_wrapper.get_template_cache_stats(),
+                        "gallery_sync": gallery_sync.status(),
+                        "user_cache": user_templates.stats()}), 200
     if not is_sdk_ready():
          current_app.logger.warning("Status request pero SDK no listo.")
-         return jsonify({"success": False, "message": "SDK no inicializado o dispositivo no abierto."}), 503
+         return jsonify({"success": False, "message": sdk_not_ready_message()}), 503
 
-    info = sdk_wrapper.get_device_info()
+    info = device_scheduler.call(sdk_wrapper.get_device_info, priority=PRIORITY_CONTROL, timeout=TIMEOUT_CONTROL)
     if info:
-        return jsonify({"success": True, "status": "ok", "device_info": info}), 200
+        return jsonify({"success": True, "status": "ok", "mode": sdk_wrapper.get_sdk_mode(), "device_info": info,
+                        "devices": device_pool.status(),
+                        "template_cache": sdk_wrapper.get_template_cache_stats(),
+                        "gallery_sync": gallery_sync.status(),
+                        "user_cache": user_templates.stats()}), 200
     else:
         current_app.logger.error("wrapper.get_device_info() devolvió None.")
         return jsonify({"success": False, "message": "Fallo al obtener información del dispositivo desde el wrapper."}), 500
@@ -58,7 +180,7 @@ def control_led():
     current_app.logger.info("API Request: /led")
     if not is_sdk_ready():
          current_app.logger.warning("LED control request pero SDK no listo.")
-         return jsonify({"success": False, "message": "SDK no inicializado o dispositivo no abierto."}), 503
+         return jsonify({"success": False, "message": sdk_not_ready_message()}), 503
 
     if not request.is_json:
         return jsonify({"success": False, "message": "Cuerpo de la solicitud debe ser JSON."}), 400
@@ -70,7 +192,7 @@ def control_led():
         return jsonify({"success": False, "message": "El cuerpo JSON debe contener el campo 'state' con valor true o false."}), 400
 
     current_app.logger.info(f"Solicitud para poner LED en: {'ON' if led_state else 'OFF'}")
-    success = sdk_wrapper.set_led(led_state)
+    success = device_scheduler.call(sdk_wrapper.set_led, led_state, priority=PRIORITY_CONTROL, timeout=TIMEOUT_CONTROL)
 
     if success:
         return jsonify({"success": True, "message": f"Comando para poner LED en {'ON' if led_state else 'OFF'} enviado."}), 200
@@ -81,46 +203,134 @@ def control_led():
 
 @fingerprint_bp.route('/capture', methods=['POST'])
 def capture():
-    """Captura una huella y devuelve la plantilla extraída en Base64."""
+    """Captura una huella y devuelve la plantilla extraída en Base64 (o binaria con Accept: application/octet-stream).
+    Usa el lector más libre, o el indicado con 'device_id' (JSON o query)."""
     current_app.logger.info("API Request: /capture")
     if not is_sdk_ready():
          current_app.logger.warning("Capture request pero SDK no listo.")
-         return jsonify({"success": False, "message": "SDK no inicializado o dispositivo no abierto."}), 503
+         return jsonify({"success": False, "message": sdk_not_ready_message()}), 503
 
     # Añadir un pequeño delay antes de capturar, puede ayudar
     # time.sleep(0.1)
 
-    template_b64 = sdk_wrapper.capture_template()
-
-    if template_b64:
-        return jsonify({"success": True, "template": template_b64}), 200
+    data = request.get_json(silent=True)
+    policy, error_message = requested_capture_policy(data)
+    if error_message:
+        return jsonify({"success": False, "message": error_message}), 400
+    device_id, result = device_pool.call(sdk_wrapper.capture_template_quality, policy,
+                                         device_id=requested_device_id(data),
+                                         priority=PRIORITY_CAPTURE, timeout=TIMEOUT_CAPTURE)
+
+    if result:
+        if wants_octet_stream():
+            return Response(result.template, status=200, mimetype=OCTET_STREAM,
+                            headers={'X-Device-Id': str(device_id), 'X-Image-Quality': str(result.quality)})
+        with span("encode.base64"):
+            template_b64 = base64.b64encode(result.template).decode('ascii')
+        response = {"success": True, "template": template_b64, "device_id": device_id,
+                    "quality": result.quality, "attempts": result.attempts}
+        if result.analysis is not None: # Análisis previo de la imagen (solo con NumPy)
+            response["analysis"] = {"coverage": result.analysis.coverage, "contrast": result.analysis.contrast,
+                                    "roi": result.analysis.roi}
+        return jsonify(response), 200
     else:
-        current_app.logger.error("wrapper.capture_template() devolvió None.")
+        current_app.logger.error("wrapper.capture_template_quality() devolvió None.")
         # Podría ser error de captura (dedo mal puesto, etc) o error de extracción
         return jsonify({"success": False, "message": "Fallo durante la captura o extracción de plantilla."}), 500
 
+# Tiempo máximo por captura que puede pedir un cliente (por debajo de TIMEOUT_CAPTURE) e imágenes como máximo
+MAX_CAPTURE_TIME_BUDGET = 30.0
+MAX_CAPTURE_ATTEMPTS = int(os.getenv('MAX_CAPTURE_ATTEMPTS', 20))
+
+def requested_capture_policy(data):
+    """Política de captura de la petición ('min_quality', 'max_attempts', 'time_budget' en el JSON;
+    lo que falte sale de la política por defecto). Una política pedida por el cliente siempre tiene
+    límite de intentos y de tiempo (como mucho MAX_CAPTURE_TIME_BUDGET), para no retener el lector
+    más allá de TIMEOUT_CAPTURE. Devuelve (CapturePolicy|None, mensaje_error)."""
+    if not data or not any(key in data for key in ('min_quality', 'max_attempts', 'time_budget')):
+        return None, None
+    default = sdk_wrapper.default_capture_policy
+    min_quality = data.get('min_quality', default.min_quality)
+    # Lo que no indique el cliente sale de la política por defecto, acotado a los mismos máximos
+    max_attempts = data.get('max_attempts', min(default.max_attempts, MAX_CAPTURE_ATTEMPTS))
+    time_budget = data.get('time_budget', min(default.time_budget or MAX_CAPTURE_TIME_BUDGET, MAX_CAPTURE_TIME_BUDGET))
+    if isinstance(min_quality, bool) or not isinstance(min_quality, int) or not 0 <= min_quality <= 100:
+        return None, "'min_quality' debe ser un entero entre 0 y 100."
+    if isinstance(max_attempts, bool) or not isinstance(max_attempts, int) or not 1 <= max_attempts <= MAX_CAPTURE_ATTEMPTS:
+        return None, f"'max_attempts' debe ser un entero entre 1 y {MAX_CAPTURE_ATTEMPTS}."
+    if isinstance(time_budget, bool) or not isinstance(time_budget, (int, float)) or not 0 < time_budget <= MAX_CAPTURE_TIME_BUDGET:
+        return None, f"'time_budget' debe ser un número de segundos entre 0 y {MAX_CAPTURE_TIME_BUDGET}."
+    return sdk_wrapper.CapturePolicy(min_quality, max_attempts, time_budget), None
+
+@fingerprint_bp.route('/capture/image', methods=['POST'])
+def capture_image():
+    """Captura una imagen (sin extraer plantilla) y la devuelve en binario según Accept:
+    image/png, application/gzip (píxeles comprimidos) o application/octet-stream (píxeles en bruto).
+    Acepta 'device_id' y la misma política de captura que /capture."""
+    current_app.logger.info("API Request: /capture/image")
+    # Sin cabecera Accept se envía PNG
+    mimetype = request.accept_mimetypes.best_match(IMAGE_MIMETYPES) if request.accept_mimetypes else IMAGE_MIMETYPES[0]
+    if mimetype is None:
+        return jsonify({"success": False, "message": f"Formatos disponibles: {', '.join(IMAGE_MIMETYPES)}."}), 406
+    if not is_sdk_ready():
+         return jsonify({"success": False, "message": sdk_not_ready_message()}), 503
+
+    data = request.get_json(silent=True)
+    policy, error_message = requested_capture_policy(data)
+    if error_message:
+        return jsonify({"success": False, "message": error_message}), 400
+    device_id, result = device_pool.call(sdk_wrapper.capture_image, policy,
+                                         device_id=requested_device_id(data),
+                                         priority=PRIORITY_CAPTURE, timeout=TIMEOUT_CAPTURE)
+    if not result:
+        current_app.logger.error("wrapper.capture_image() devolvió None.")
+        return jsonify({"success": False, "message": "Fallo durante la captura de la imagen."}), 500
+
+    headers = {'X-Device-Id': str(device_id), 'X-Image-Quality': str(result.quality),
+               'X-Image-Width': str(result.width), 'X-Image-Height': str(result.height),
+               'X-Capture-Attempts': str(result.attempts)}
+    if mimetype == OCTET_STREAM:
+        return Response(result.image, status=200, mimetype=OCTET_STREAM, headers=headers)
+    # PNG/gzip se codifican mientras se envían (el hilo del lector ya quedó libre)
+    body = IMAGE_ENCODERS[mimetype](result.image, result.width, result.height)
+    return Response(body, status=200, mimetype=mimetype, headers=headers)
+
 @fingerprint_bp.route('/verify', methods=['POST'])
 def verify():
-    """Compara/Verifica dos plantillas enviadas en formato Base64."""
+    """Compara/Verifica dos plantillas enviadas en Base64 (JSON) o en binario (application/octet-stream)."""
     current_app.logger.info("API Request: /verify")
-    if not is_sdk_ready():
+    if not is_matcher_ready():
          current_app.logger.warning("Verify request pero SDK no listo.")
-         return jsonify({"success": False, "message": "SDK no inicializado o dispositivo no abierto."}), 503
-
-    if not request.is_json:
-        return jsonify({"success": False, "message": "Cuerpo de la solicitud debe ser JSON."}), 400
-
-    data = request.get_json()
-    template1 = data.get('template1')
-    template2 = data.get('template2')
-    # Podrías añadir un nivel de seguridad opcional:
-    # security_level = data.get('security_level', sdk_wrapper.SL_NORMAL)
+         return jsonify({"success": False, "message": "SDK no inicializado."}), 503
+
+    if is_octet_stream_request():
+        templates = split_framed_templates(request.get_data(), 2)
+        if templates is None:
+            return jsonify({"success": False, "message": "Cuerpo binario inválido: se esperan 2 plantillas precedidas de su longitud (uint32 big-endian)."}), 400
+        template1, template2 = templates
+        data = None # Nivel de seguridad en la query (?security_level=N)
+    elif request.is_json:
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({"success": False, "message": "El cuerpo JSON debe ser un objeto."}), 400
+        template1 = data.get('template1')
+        template2 = data.get('template2')
+
+        if not _is_template_value(template1) or not _is_template_value(template2):
+            return jsonify({"success": False, "message": "El cuerpo JSON debe contener 'template1' y 'template2' en Base64."}), 400
+    else:
+        return jsonify({"success": False, "message": "Cuerpo de la solicitud debe ser JSON o application/octet-stream."}), 400
+    # Plantillas que no decodifican: error del cliente (los buffers quedan en la caché para la comparación)
+    if sdk_wrapper.get_template_buffer(template1) is None or sdk_wrapper.get_template_buffer(template2) is None:
+        return jsonify({"success": False, "message": "Plantilla inválida (Base64 incorrecto o vacía)."}), 400
 
-    if not template1 or not template2:
-        return jsonify({"success": False, "message": "El cuerpo JSON debe contener 'template1' y 'template2'."}), 400
+    security_level, error_message = requested_security_level(data)
+    if error_message:
+        return jsonify({"success": False, "message": error_message}), 400
 
     current_app.logger.info("Verificando plantillas...")
-    match_result = sdk_wrapper.verify_templates(template1, template2) # Podrías pasar security_level aquí
+    match_result = device_scheduler.call(sdk_wrapper.verify_templates, template1, template2, security_level,
+                                         priority=PRIORITY_MATCH, timeout=TIMEOUT_MATCH)
 
     if match_result is None:
         current_app.logger.error("wrapper.verify_templates() devolvió None.")
@@ -129,67 +339,656 @@ def verify():
         # verify_templates devuelve True si coinciden, False si no.
         return jsonify({"success": True, "match": match_result}), 200
     
+# Límite de comparaciones por petición en /verify/batch
+MAX_BATCH_PAIRS = 50000
+
+def _is_template_value(value):
+    """Plantilla utilizable como clave: Base64 (str) o binario, no vacía."""
+    return isinstance(value, (str, bytes)) and bool(value)
+
+def _parse_batch_pairs(data):
+    """Extrae los pares de /verify/batch. Devuelve (lista_de_pares, mensaje_error)."""
+    if 'probe' in data:
+        probe = data.get('probe')
+        candidates = data.get('candidates')
+        if not _is_template_value(probe) or not isinstance(candidates, list):
+            return None, "Con 'probe' (Base64) se requiere una lista 'candidates'."
+        if not all(_is_template_value(candidate) for candidate in candidates):
+            return None, "Cada elemento de 'candidates' debe ser una plantilla Base64."
+        return [(probe, candidate) for candidate in candidates], None
+
+    pairs = data.get('pairs')
+    if not isinstance(pairs, list):
+        return None, "El cuerpo JSON debe contener 'probe' + 'candidates' o una lista 'pairs'."
+    parsed = []
+    for pair in pairs:
+        if isinstance(pair, dict):
+            pair = (pair.get('template1'), pair.get('template2'))
+        if (not isinstance(pair, (list, tuple)) or len(pair) != 2
+                or not _is_template_value(pair[0]) or not _is_template_value(pair[1])):
+            return None, "Cada elemento de 'pairs' debe ser [template1, template2] o {template1, template2} en Base64."
+        parsed.append((pair[0], pair[1]))
+    return parsed, None
+
+@fingerprint_bp.route('/verify/batch', methods=['POST'])
+def verify_batch():
+    """
+    Verificación por lote en una sola petición.
+    JSON: {"probe": "b64", "candidates": ["b64", ...]} o {"pairs": [["b64", "b64"], ...]}
+    """
+    current_app.logger.info("API Request: /verify/batch")
+    if not is_matcher_ready():
+         current_app.logger.warning("Verify batch request pero SDK no listo.")
+         return jsonify({"success": False, "message": "SDK no inicializado."}), 503
+
+    if not request.is_json:
+        return jsonify({"success": False, "message": "Cuerpo de la solicitud debe ser JSON."}), 400
+
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"success": False, "message": "El cuerpo JSON debe ser un objeto."}), 400
+    pairs, error_message = _parse_batch_pairs(data)
+    if error_message:
+        return jsonify({"success": False, "message": error_message}), 400
+    if len(pairs) > MAX_BATCH_PAIRS:
+        return jsonify({"success": False, "message": f"Máximo {MAX_BATCH_PAIRS} comparaciones por petición."}), 413
+
+    security_level, error_message = requested_security_level(data)
+    if error_message:
+        return jsonify({"success": False, "message": error_message}), 400
+
+    results = device_scheduler.call(sdk_wrapper.verify_batch, pairs, security_level, priority=PRIORITY_MATCH, timeout=TIMEOUT_MATCH)
+    if results is None:
+        current_app.logger.error("wrapper.verify_batch() devolvió None.")
+        return jsonify({"success": False, "message": "Error durante el proceso de verificación."}), 500
+    # Cada resultado es true/false, o null si ese par tenía una plantilla inválida
+    return jsonify({"success": True, "count": len(results), "results": results}), 200
+
+@fingerprint_bp.route('/verify/user/<int:user_id>', methods=['POST'])
+def verify_user(user_id):
+    """
+    Verificación 1:pocos ("¿es este el usuario X?"): compara la huella con todas las huellas
+    registradas del usuario en una sola pasada. JSON opcional {"template": "base64...", "security_level": 5}
+    (sin 'template' se captura del lector), o la plantilla binaria como cuerpo application/octet-stream.
+    """
+    current_app.logger.info(f"API Request: /verify/user/{user_id}")
+    data = None
+    if is_octet_stream_request():
+        probe = request.get_data()
+        if not probe:
+            return jsonify({"success": False, "message": "El cuerpo binario debe contener la plantilla."}), 400
+    else:
+        data = request.get_json(silent=True) or {}
+        probe, error_message = requested_probe(data)
+        if error_message:
+            return jsonify({"success": False, "message": error_message}), 400
+    # Con plantilla basta el SDK de matching; sin ella hay que capturar del lector
+    if not probe and not is_sdk_ready():
+         return jsonify({"success": False, "message": sdk_not_ready_message()}), 503
+    if not is_matcher_ready():
+         return jsonify({"success": False, "message": "SDK no inicializado."}), 503
+    security_level, error_message = requested_security_level(data)
+    if error_message:
+        return jsonify({"success": False, "message": error_message}), 400
+    policy, error_message = requested_capture_policy(data)
+    if error_message:
+        return jsonify({"success": False, "message": error_message}), 400
+
+    # Huellas del usuario (caché por usuario; antes de capturar para no pedir el dedo en balde)
+    try:
+        with span("user_templates.get"):
+            templates = user_templates.get(user_id)
+        if not templates:
+            if not User.query.get(user_id):
+                return jsonify({"success": False, "message": f"Usuario con ID {user_id} no encontrado."}), 404
+            return jsonify({"success": False, "message": f"El usuario {user_id} no tiene huellas registradas."}), 404
+    except Exception as e:
+        current_app.logger.error(f"Error leyendo las huellas de user_id {user_id}: {e}")
+        return jsonify({"success": False, "message": "Error interno al leer las huellas del usuario."}), 500
+
+    quality = None
+    if not probe:
+        _, result = device_pool.call(sdk_wrapper.capture_template_quality, policy, device_id=requested_device_id(data),
+                                     priority=PRIORITY_CAPTURE, timeout=TIMEOUT_CAPTURE)
+        if not result:
+            current_app.logger.error("wrapper.capture_template_quality() devolvió None durante la verificación por usuario.")
+            return jsonify({"success": False, "message": "Fallo durante la captura o extracción de plantilla."}), 500
+        probe, quality = result.template, result.quality
+
+    matches = device_scheduler.call(sdk_wrapper.identify_template, probe,
+                                    [(template, template.buffer) for template in templates], security_level,
+                                    priority=PRIORITY_MATCH, timeout=TIMEOUT_MATCH)
+    if matches is None:
+        current_app.logger.error("wrapper.identify_template() devolvió None durante la verificación por usuario.")
+        return jsonify({"success": False, "message": "Error durante el proceso de verificación."}), 500
+    response = {"success": True, "match": bool(matches), "user_id": user_id, "fingers": len(templates),
+                "quality": quality} # Calidad de la imagen capturada (null si la plantilla vino en la petición)
+    if matches:
+        response["fingerprint_id"] = matches[0].fingerprint_id
+        response["finger_position"] = matches[0].finger_position
+    return jsonify(response), 200
+
+def _identify_probe(data):
+    """Comprueba el SDK, obtiene la plantilla de búsqueda ('template' o captura del lector) y carga
+    la galería. Devuelve (plantilla, nivel_de_seguridad, None) o (None, None, respuesta_de_error)."""
+    probe_b64, error_message = requested_probe(data)
+    if error_message:
+        return None, None, (jsonify({"success": False, "message": error_message}), 400)
+    # Con plantilla basta el SDK de matching; sin ella hay que capturar del lector
+    if not probe_b64 and not is_sdk_ready():
+         current_app.logger.warning("Identify request con captura pero SDK no listo.")
+         return None, None, (jsonify({"success": False, "message": sdk_not_ready_message()}), 503)
+    if not is_matcher_ready():
+         current_app.logger.warning("Identify request pero SDK no listo.")
+         return None, None, (jsonify({"success": False, "message": "SDK no inicializado."}), 503)
+    security_level, error_message = requested_security_level(data)
+    if error_message:
+        return None, None, (jsonify({"success": False, "message": error_message}), 400)
+
+    if not probe_b64:
+        _, probe_b64 = device_pool.call(sdk_wrapper.capture_template, device_id=requested_device_id(data),
+                                        priority=PRIORITY_CAPTURE, timeout=TIMEOUT_CAPTURE)
+        if not probe_b64:
+            current_app.logger.error("wrapper.capture_template() devolvió None durante la identificación.")
+            return None, None, (jsonify({"success": False, "message": "Fallo durante la captura o extracción de plantilla."}), 500)
+
+    try:
+        gallery.ensure_loaded()
+    except Exception as e:
+        current_app.logger.error(f"Error cargando la galería desde la BD: {e}")
+        return None, None, (jsonify({"success": False, "message": "Error interno al cargar la galería de huellas."}), 500)
+    return probe_b64, security_level, None
+
+@fingerprint_bp.route('/identify', methods=['POST'])
+def identify():
+    """
+    Identificación 1:N contra la galería en memoria de huellas enroladas.
+    JSON opcional: {"template": "base64...", "security_level": 5}. Sin 'template' se captura del lector.
+    """
+    current_app.logger.info("API Request: /identify")
+    data = request.get_json(silent=True) or {}
+    probe_b64, security_level, error_response = _identify_probe(data)
+    if error_response:
+        return error_response
+
+    if gallery.uses_engine:
+        # Motor paralelo: cada worker tiene su propio handle, no ocupa el hilo del lector
+        entry = gallery.identify(probe_b64, security_level)
+    else:
+        entry = device_scheduler.call(gallery.identify, probe_b64, security_level, priority=PRIORITY_MATCH, timeout=TIMEOUT_MATCH)
+    if entry is None:
+        current_app.logger.error("gallery.identify() devolvió None.")
+        return jsonify({"success": False, "message": "Error durante el proceso de identificación."}), 500
+    if entry is False:
+        return jsonify({"success": True, "match": False, "gallery_size": len(gallery)}), 200
+    return jsonify({
+        "success": True,
+        "match": True,
+        "fingerprint_id": entry.fingerprint_id,
+        "user_id": entry.user_id,
+        "finger_position": entry.finger_position,
+        "gallery_size": len(gallery)
+        }), 200
+
+# Máximo de candidatos por búsqueda top-k
+MAX_TOP_K = 100
+
+@fingerprint_bp.route('/identify/top', methods=['POST'])
+def identify_top():
+    """
+    Búsqueda 1:N con puntuación: devuelve los 'k' candidatos con mayor SGFPM_GetMatchingScore que
+    superan el umbral del nivel de seguridad, de mayor a menor. Corta en cuanto uno llega a
+    'stop_score' (0 = recorrer toda la galería).
+    JSON opcional: {"template": "base64...", "k": 5, "security_level": 5, "stop_score": 150}.
+    """
+    current_app.logger.info("API Request: /identify/top")
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        return jsonify({"success": False, "message": "El cuerpo JSON debe ser un objeto."}), 400
+    k = data.get('k', sdk_wrapper.DEFAULT_TOP_K)
+    stop_score = data.get('stop_score', sdk_wrapper.DEFAULT_STOP_SCORE)
+    if isinstance(k, bool) or not isinstance(k, int) or not 1 <= k <= MAX_TOP_K:
+        return jsonify({"success": False, "message": f"'k' debe ser un entero entre 1 y {MAX_TOP_K}."}), 400
+    if isinstance(stop_score, bool) or not isinstance(stop_score, int) or stop_score < 0:
+        return jsonify({"success": False, "message": "'stop_score' debe ser un entero >= 0."}), 400
+    probe_b64, security_level, error_response = _identify_probe(data)
+    if error_response:
+        return error_response
+
+    if gallery.uses_engine:
+        result = gallery.search(probe_b64, k, security_level, stop_score)
+    else:
+        result = device_scheduler.call(gallery.search, probe_b64, k, security_level, stop_score,
+                                       priority=PRIORITY_MATCH, timeout=TIMEOUT_MATCH)
+    if result is None:
+        current_app.logger.error("gallery.search() devolvió None.")
+        return jsonify({"success": False, "message": "Error durante la búsqueda (¿SGFPM_GetMatchingScore disponible?)."}), 500
+    return jsonify({
+        "success": True,
+        "match": bool(result.candidates),
+        "candidates": [{"fingerprint_id": entry.fingerprint_id, "user_id": entry.user_id,
+                        "finger_position": entry.finger_position, "score": score}
+                       for entry, score in result.candidates],
+        "min_score": sdk_wrapper.score_threshold(security_level),
+        "compared": result.compared,
+        "early_exit": result.early_exit,
+        "gallery_size": len(gallery)
+        }), 200
+
 @fingerprint_bp.route('/enroll', methods=['POST'])
 def enroll_fingerprint():
     """
     Endpoint para enrolar/registrar una nueva huella para un usuario.
-    Espera JSON: {"user_id": <id>, "finger_position": "nombre_dedo"}
+    Espera JSON: {"user_id": <id>, "finger_position": "nombre_dedo"} y captura del lector,
+    o un cuerpo application/octet-stream con la plantilla binaria y
+    ?user_id=<id>&finger_position=<dedo> en la query (sin captura).
     """
     current_app.logger.info("API Request: /enroll")
-    if not is_sdk_ready(): # Usar la función helper si la tienes
-         current_app.logger.warning("Enroll request pero SDK no listo.")
-         return jsonify({"success": False, "message": "SDK no inicializado o dispositivo no abierto."}), 503
-
-    # 1. Validar Input JSON
-    if not request.is_json:
-        return jsonify({"success": False, "message": "Cuerpo de la solicitud debe ser JSON."}), 400
 
-    data = request.get_json()
-    user_id = data.get('user_id')
-    finger_position = data.get('finger_position')
+    # 1. Validar Input (JSON, o binario con metadatos en la query)
+    template_bytes = None
+    data = None
+    if is_octet_stream_request():
+        user_id = request.args.get('user_id', type=int)
+        finger_position = request.args.get('finger_position')
+        template_bytes = request.get_data()
+        if not template_bytes:
+            return jsonify({"success": False, "message": "El cuerpo binario debe contener la plantilla."}), 400
+    elif request.is_json:
+        data = request.get_json()
+        user_id = data.get('user_id')
+        finger_position = data.get('finger_position')
+    else:
+        return jsonify({"success": False, "message": "Cuerpo de la solicitud debe ser JSON o application/octet-stream."}), 400
 
     if not user_id or not finger_position:
         return jsonify({"success": False, "message": "Faltan 'user_id' o 'finger_position' en el cuerpo JSON."}), 400
+    policy, error_message = requested_capture_policy(data)
+    if error_message:
+        return jsonify({"success": False, "message": error_message}), 400
+    dedupe, dedupe_budget, error_message = requested_dedupe(data)
+    if error_message:
+        return jsonify({"success": False, "message": error_message}), 400
+    security_level, error_message = requested_security_level(data)
+    if error_message:
+        return jsonify({"success": False, "message": error_message}), 400
+
+    # Capturar requiere el lector; la plantilla binaria solo el SDK (también en modo solo matching)
+    if template_bytes is None and not is_sdk_ready():
+         current_app.logger.warning("Enroll request con captura pero SDK no listo.")
+         return jsonify({"success": False, "message": sdk_not_ready_message()}), 503
+    if not is_matcher_ready():
+         current_app.logger.warning("Enroll request pero SDK no listo.")
+         return jsonify({"success": False, "message": "SDK no inicializado."}), 503
+
+    # 2-3. Verificar que el usuario exista y que el dedo no esté ya registrado
+    error = _check_enroll_target(user_id, finger_position)
+    if error:
+        message, status = error
+        return jsonify({"success": False, "message": message}), status
+
+    # 4. Capturar la plantilla de la huella (salvo que venga en el cuerpo binario)
+    quality = None
+    if template_bytes is None:
+        current_app.logger.info(f"Iniciando captura para user_id={user_id}, finger='{finger_position}'. Pide al usuario colocar el dedo.")
+        with span("enroll.capture"):
+            _, result = device_pool.call(sdk_wrapper.capture_template_quality, policy, device_id=requested_device_id(data),
+                                         priority=PRIORITY_CAPTURE, timeout=TIMEOUT_CAPTURE)
+
+        if not result:
+            current_app.logger.error("wrapper.capture_template_quality() falló durante el enrolamiento.")
+            return jsonify({"success": False, "message": "Fallo durante la captura o extracción de plantilla desde el lector."}), 500
+        template_bytes, quality = result.template, result.quality
+
+    # 4b. (Opcional) Comprobar que el mismo dedo no esté ya registrado, con este u otro usuario
+    dedupe_result = None
+    if dedupe:
+        try:
+            dedupe_result = enroll_dedupe.find_duplicates(template_bytes, security_level, dedupe_budget)
+        except Exception as e:
+            current_app.logger.error(f"Error cargando la galería desde la BD: {e}")
+            return jsonify({"success": False, "message": "Error interno al cargar la galería de huellas."}), 500
+        if dedupe_result is None:
+            current_app.logger.error("enroll_dedupe.find_duplicates() devolvió None.")
+            return jsonify({"success": False, "message": "Error durante la comprobación de duplicados."}), 500
+        if dedupe_result.duplicates:
+            current_app.logger.warning(f"Enrolamiento rechazado para user_id {user_id}: la huella coincide con "
+                                       f"{[entry.fingerprint_id for entry, _ in dedupe_result.duplicates]}.")
+            return jsonify({"success": False, "message": "La huella ya está registrada.",
+                            "duplicates": enroll_dedupe.duplicates_json(dedupe_result),
+                            "dedupe": enroll_dedupe.summary(dedupe_result)}), 409
 
-    # 2. Verificar que el usuario exista
-    user = User.query.get(user_id) # Busca usuario por ID
+    # 5. Crear y guardar el registro en la BD
+    try:
+        new_fingerprint = _save_fingerprint(user_id, finger_position, template_bytes)
+        # Devolvemos el ID del registro creado y un mensaje
+        response = {
+            "success": True,
+            "message": "Huella registrada exitosamente.",
+            "fingerprint_id": new_fingerprint.id,
+            "quality": quality # Calidad de la imagen capturada (null si la plantilla vino en el cuerpo)
+            }
+        if dedupe_result is not None:
+            response["dedupe"] = enroll_dedupe.summary(dedupe_result)
+        return jsonify(response), 201 # 201 Created
+    except IntegrityError:
+        # Otra petición registró el mismo dedo entre la comprobación y el insert (índice único)
+        current_app.logger.warning(f"Dedo '{finger_position}' registrado en paralelo para user_id {user_id}.")
+        return jsonify({"success": False, "message": f"Ya existe una huella registrada para el dedo '{finger_position}' de este usuario."}), 409
+    except Exception as e:
+        current_app.logger.error(f"Error al guardar huella en BD para user_id {user_id}: {e}")
+        return jsonify({"success": False, "message": "Error interno al guardar la huella en la base de datos."}), 500
+
+@fingerprint_bp.route('/enroll/bulk', methods=['POST'])
+def enroll_bulk():
+    """
+    Enrolamiento masivo sin captura (migraciones). Espera JSON:
+    {"records": [{"user_id": <id>, "finger_position": "dedo", "template": "b64"}, ...]}
+    Devuelve un resultado por registro, en el mismo orden.
+    """
+    current_app.logger.info("API Request: /enroll/bulk")
+    if not request.is_json:
+        return jsonify({"success": False, "message": "Cuerpo de la solicitud debe ser JSON."}), 400
+    data = request.get_json(silent=True)
+    records = data.get('records') if isinstance(data, dict) else None
+    if not isinstance(records, list) or not records:
+        return jsonify({"success": False, "message": "El cuerpo JSON debe contener una lista 'records'."}), 400
+    if len(records) > MAX_BULK_RECORDS:
+        return jsonify({"success": False, "message": f"Máximo {MAX_BULK_RECORDS} registros por petición."}), 413
+
+    try:
+        results = bulk_enroll(records)
+    except Exception as e:
+        current_app.logger.error(f"Error en el enrolamiento masivo: {e}")
+        return jsonify({"success": False, "message": "Error interno al guardar las huellas en la base de datos."}), 500
+    created = sum(1 for result in results if result["status"] == BULK_CREATED)
+    return jsonify({"success": True, "count": len(results), "created": created, "results": results}), 200
+
+def requested_dedupe(data):
+    """Comprobación de duplicados de /enroll: 'dedupe' (bool) y 'dedupe_budget' (segundos) en el JSON,
+    o en la query con cuerpo binario. Devuelve (activada, presupuesto, mensaje_error)."""
+    if data is not None:
+        dedupe = data.get('dedupe', enroll_dedupe.DEDUPE_BY_DEFAULT)
+        budget = data.get('dedupe_budget', enroll_dedupe.DEFAULT_DEDUPE_BUDGET)
+    else:
+        dedupe = request.args.get('dedupe', str(enroll_dedupe.DEDUPE_BY_DEFAULT)).lower() in ('true', '1', 't')
+        budget = request.args.get('dedupe_budget', enroll_dedupe.DEFAULT_DEDUPE_BUDGET, type=float)
+    if not isinstance(dedupe, bool):
+        return None, None, "'dedupe' debe ser true o false."
+    if isinstance(budget, bool) or not isinstance(budget, (int, float)) or not 0 < budget <= enroll_dedupe.MAX_DEDUPE_BUDGET:
+        return None, None, f"'dedupe_budget' debe ser un número de segundos entre 0 y {enroll_dedupe.MAX_DEDUPE_BUDGET}."
+    return dedupe, budget, None
+
+def _check_enroll_target(user_id, finger_position):
+    """Valida usuario y dedo antes de capturar. Devuelve (mensaje, status_http) o None si todo OK."""
+    with span("db.user_lookup"):
+        user = User.query.get(user_id) # Busca usuario por ID
     if not user:
         current_app.logger.warning(f"Intento de enrolar para user_id {user_id} no existente.")
-        return jsonify({"success": False, "message": f"Usuario con ID {user_id} no encontrado."}), 404
+        return f"Usuario con ID {user_id} no encontrado.", 404
 
-    # 3. (Opcional) Verificar si ya existe huella para ese dedo y usuario
-    existing_fp = Fingerprint.query.filter_by(user_id=user_id, finger_position=finger_position).first()
+    # (Opcional) Verificar si ya existe huella para ese dedo y usuario
+    with span("db.duplicate_check"):
+        existing_fp = Fingerprint.query.filter_by(user_id=user_id, finger_position=finger_position).first()
     if existing_fp:
         # Podrías permitir sobreescribir o devolver error. Devolvemos error por ahora.
         current_app.logger.warning(f"Intento de enrolar dedo '{finger_position}' que ya existe para user_id {user_id}.")
-        return jsonify({"success": False, "message": f"Ya existe una huella registrada para el dedo '{finger_position}' de este usuario."}), 409 # 409 Conflict
+        return f"Ya existe una huella registrada para el dedo '{finger_position}' de este usuario.", 409 # 409 Conflict
+    return None
 
-    # 4. Capturar la plantilla de la huella
-    current_app.logger.info(f"Iniciando captura para user_id={user_id}, finger='{finger_position}'. Pide al usuario colocar el dedo.")
-    template_b64 = sdk_wrapper.capture_template()
-
-    if not template_b64:
-        current_app.logger.error("wrapper.capture_template() falló durante el enrolamiento.")
-        return jsonify({"success": False, "message": "Fallo durante la captura o extracción de plantilla desde el lector."}), 500
-
-    # 5. Crear y guardar el registro en la BD
+def _save_fingerprint(user_id, finger_position, template_bytes):
+    """Inserta la huella y la añade a la galería. Devuelve el Fingerprint; relanza errores de BD tras rollback."""
     try:
         new_fingerprint = Fingerprint(
             user_id=user_id,
             finger_position=finger_position,
-            template_data=template_b64,
+            template_blob=template_bytes,
             template_format='SG400' # Asumiendo SG400 por defecto
         )
         db.session.add(new_fingerprint)
-        db.session.commit()
-        current_app.logger.info(f"Huella enrolada exitosamente con ID: {new_fingerprint.id} para user_id: {user_id}")
-        # Devolvemos el ID del registro creado y un mensaje
-        return jsonify({
-            "success": True,
-            "message": "Huella registrada exitosamente.",
-            "fingerprint_id": new_fingerprint.id
-            }), 201 # 201 Created
-    except Exception as e:
+        with span("db.commit"):
+            db.session.commit()
+    except Exception:
         db.session.rollback() # Revertir cambios en caso de error de BD
-        current_app.logger.error(f"Error al guardar huella en BD para user_id {user_id}: {e}")
-        return jsonify({"success": False, "message": "Error interno al guardar la huella en la base de datos."}), 500
+        raise
+    current_app.logger.info(f"Huella enrolada exitosamente con ID: {new_fingerprint.id} para user_id: {user_id}")
+    user_templates.invalidate(user_id)
+    try:
+        with span("gallery.add"):
+            gallery.add(new_fingerprint.id, user_id, finger_position, template_bytes)
+    except Exception as e:
+        # La fila ya está guardada: no se falla la petición; GALLERY_SYNC (o la próxima carga) la añadirá
+        current_app.logger.error(f"Huella {new_fingerprint.id} guardada pero no añadida a la galería: {e}", exc_info=True)
+    return new_fingerprint
+
+# --- Exportación / importación NDJSON (copias de seguridad, nuevos nodos) ---
+
+@fingerprint_bp.route('/export', methods=['GET'])
+def export_data():
+    """Descarga 'users' y 'fingerprints' como NDJSON en streaming. ?tables=users,fingerprints (por defecto ambas)."""
+    current_app.logger.info("API Request: /export")
+    tables = tuple(t.strip() for t in request.args.get('tables', ','.join(TRANSFER_TABLES)).split(',') if t.strip())
+    if not tables or any(table not in TRANSFER_TABLES for table in tables):
+        return jsonify({"success": False, "message": f"'tables' admite: {', '.join(TRANSFER_TABLES)}."}), 400
+    # stream_with_context: la sesión de BD sigue viva mientras se envían los bloques
+    return Response(stream_with_context(export_lines(tables)), mimetype=NDJSON_MIMETYPE,
+                    headers={'Content-Disposition': 'attachment; filename="secugen_export.ndjson"'})
+
+@fingerprint_bp.route('/import', methods=['POST'])
+def import_data():
+    """Importa un cuerpo NDJSON (formato de /export) leyéndolo por líneas e insertando por lotes."""
+    current_app.logger.info("API Request: /import")
+    importer = NdjsonImport()
+    try:
+        summary = importer.run(request.stream)
+    except Exception as e:
+        current_app.logger.error(f"Error en la importación NDJSON: {e}")
+        # Los lotes anteriores ya están confirmados: se informa de lo importado hasta el fallo
+        return jsonify({"success": False, "message": "Error interno al importar en la base de datos.",
+                        **importer.summary()}), 500
+    return jsonify({"success": True, **summary}), 200
+
+# --- Trabajos de captura asíncronos (long-poll / SSE) ---
+
+# Espera máxima de un long-poll y período del keep-alive SSE (segundos)
+MAX_LONG_POLL_SECONDS = 30
+SSE_KEEPALIVE_SECONDS = 15
+
+def _job_status_url(job):
+    return url_for('fingerprint_api.get_job', job_id=job.id)
+
+@fingerprint_bp.route('/capture/jobs', methods=['POST'])
+def create_capture_job():
+    """Encola una captura y devuelve el id del trabajo sin bloquear el worker."""
+    current_app.logger.info("API Request: POST /capture/jobs")
+    if not is_sdk_ready():
+         current_app.logger.warning("Capture job request pero SDK no listo.")
+         return jsonify({"success": False, "message": sdk_not_ready_message()}), 503
+
+    data = request.get_json(silent=True)
+    policy, error_message = requested_capture_policy(data)
+    if error_message:
+        return jsonify({"success": False, "message": error_message}), 400
+
+    def run_capture(job):
+        result = job.run_on_device(sdk_wrapper.capture_template_quality, policy)
+        if not result:
+            raise CaptureJobError("Fallo durante la captura o extracción de plantilla.")
+        return {"template": base64.b64encode(result.template).decode('ascii'), "quality": result.quality,
+                "attempts": result.attempts}
+
+    device_id = requested_device_id(data)
+    if device_id is not None:
+        device_pool.select(device_id) # Lanza DeviceNotAvailable (404) si no existe
+    job = capture_jobs.submit('capture', run_capture, device_id=device_id)
+    return jsonify({"success": True, "job_id": job.id, "status_url": _job_status_url(job)}), 202
+
+@fingerprint_bp.route('/enroll/jobs', methods=['POST'])
+def create_enroll_job():
+    """
+    Encola captura + registro en BD. Espera JSON: {"user_id": <id>, "finger_position": "nombre_dedo"}
+    Las validaciones de usuario/dedo se hacen antes de encolar.
+    """
+    current_app.logger.info("API Request: POST /enroll/jobs")
+    if not is_sdk_ready():
+         current_app.logger.warning("Enroll job request pero SDK no listo.")
+         return jsonify({"success": False, "message": sdk_not_ready_message()}), 503
+
+    if not request.is_json:
+        return jsonify({"success": False, "message": "Cuerpo de la solicitud debe ser JSON."}), 400
+    data = request.get_json()
+    user_id = data.get('user_id')
+    finger_position = data.get('finger_position')
+    if not user_id or not finger_position:
+        return jsonify({"success": False, "message": "Faltan 'user_id' o 'finger_position' en el cuerpo JSON."}), 400
+
+    error = _check_enroll_target(user_id, finger_position)
+    if error:
+        message, status = error
+        return jsonify({"success": False, "message": message}), status
+
+    app = current_app._get_current_object()
+
+    policy, error_message = requested_capture_policy(data)
+    if error_message:
+        return jsonify({"success": False, "message": error_message}), 400
+
+    def run_enroll(job):
+        result = job.run_on_device(sdk_wrapper.capture_template_quality, policy)
+        if not result:
+            raise CaptureJobError("Fallo durante la captura o extracción de plantilla desde el lector.")
+        with app.app_context():
+            try:
+                new_fingerprint = _save_fingerprint(user_id, finger_position, result.template)
+            except Exception as e:
+                app.logger.error(f"Error al guardar huella en BD para user_id {user_id}: {e}")
+                raise CaptureJobError("Error interno al guardar la huella en la base de datos.")
+            return {"fingerprint_id": new_fingerprint.id, "quality": result.quality}
+
+    device_id = requested_device_id(data)
+    if device_id is not None:
+        device_pool.select(device_id) # Lanza DeviceNotAvailable (404) si no existe
+    job = capture_jobs.submit('enroll', run_enroll, device_id=device_id)
+    return jsonify({"success": True, "job_id": job.id, "status_url": _job_status_url(job)}), 202
+
+@fingerprint_bp.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Estado/resultado de un trabajo. Con ?wait=<segundos> hace long-poll hasta que termine."""
+    job = capture_jobs.get(job_id)
+    if not job:
+        return jsonify({"success": False, "message": f"Trabajo {job_id} no encontrado."}), 404
+
+    wait_seconds = request.args.get('wait', default=0, type=float)
+    if wait_seconds > 0 and not job.finished:
+        job.wait(min(wait_seconds, MAX_LONG_POLL_SECONDS))
+    return jsonify({"success": job.status not in (JOB_FAILED, JOB_CANCELLED), **job.to_dict()}), 200
+
+@fingerprint_bp.route('/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    """Cancela un trabajo que aún no ha empezado a capturar."""
+    cancelled = capture_jobs.cancel(job_id)
+    if cancelled is None:
+        return jsonify({"success": False, "message": f"Trabajo {job_id} no encontrado."}), 404
+    if not cancelled:
+        return jsonify({"success": False, "message": "El trabajo ya terminó o está capturando y no puede cancelarse."}), 409
+    return jsonify({"success": True, "message": "Trabajo cancelado."}), 200
+
+@fingerprint_bp.route('/jobs/<job_id>/events', methods=['GET'])
+def stream_job_events(job_id):
+    """Server-Sent Events: un evento 'status' por cambio de estado y 'result' al terminar."""
+    job = capture_jobs.get(job_id)
+    if not job:
+        return jsonify({"success": False, "message": f"Trabajo {job_id} no encontrado."}), 404
+
+    def events():
+        seen_version = -1
+        while True:
+            version = job.wait_for_change(seen_version, SSE_KEEPALIVE_SECONDS)
+            if version == seen_version:
+                yield ": keep-alive\n\n"
+                continue
+            seen_version = version
+            event = 'result' if job.finished else 'status'
+            yield f"event: {event}\ndata: {json.dumps(job.to_dict())}\n\n"
+            if job.finished:
+                return
+
+    return Response(events(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+# --- Captura continua (kiosco): plantillas por SSE al detectar un dedo ---
+
+# Ajustes de POST /autocapture/start -> (tipo, mínimo)
+AUTOCAPTURE_SETTINGS = {
+    "presence_quality": (int, 0),
+    "min_quality": (int, 0),
+    "poll_interval": ((int, float), 0.01),
+    "debounce_seconds": ((int, float), 0),
+    "lift_polls": (int, 1),
+} # 'security_level' se valida aparte (1-9, ver requested_security_level)
+
+@fingerprint_bp.route('/autocapture/start', methods=['POST'])
+def start_autocapture():
+    """Arranca la captura continua en un lector. JSON opcional: device_id y ajustes (ver AUTOCAPTURE_SETTINGS)."""
+    current_app.logger.info("API Request: POST /autocapture/start")
+    if not is_sdk_ready():
+         current_app.logger.warning("Autocapture request pero SDK no listo.")
+         return jsonify({"success": False, "message": sdk_not_ready_message()}), 503
+    data = request.get_json(silent=True) or {}
+    settings = {}
+    for name, (kind, minimum) in AUTOCAPTURE_SETTINGS.items():
+        if name in data:
+            value = data[name]
+            if isinstance(value, bool) or not isinstance(value, kind) or value < minimum:
+                return jsonify({"success": False, "message": f"'{name}' debe ser un número >= {minimum}."}), 400
+            settings[name] = value
+    if 'security_level' in data:
+        settings['security_level'], error_message = requested_security_level(data)
+        if error_message:
+            return jsonify({"success": False, "message": error_message}), 400
+    capture, created = auto_capture.start(requested_device_id(data), **settings)
+    if not created:
+        return jsonify({"success": False, "message": f"La captura continua ya está en marcha en el lector {capture.device_id}.",
+                        **capture.status()}), 409
+    return jsonify({"success": True, "events_url": url_for('fingerprint_api.stream_autocapture_events',
+                                                           device_id=capture.device_id),
+                    **capture.status()}), 200
+
+@fingerprint_bp.route('/autocapture/stop', methods=['POST'])
+def stop_autocapture():
+    """Detiene la captura continua ('device_id' en el JSON o la query; sin él, la única en marcha)."""
+    current_app.logger.info("API Request: POST /autocapture/stop")
+    capture = auto_capture.get(requested_device_id(request.get_json(silent=True)))
+    if capture is None or not auto_capture.stop(capture.device_id):
+        return jsonify({"success": False, "message": "No hay captura continua en marcha en ese lector."}), 404
+    return jsonify({"success": True, "message": "Captura continua detenida.", "device_id": capture.device_id}), 200
+
+@fingerprint_bp.route('/autocapture', methods=['GET'])
+def get_autocapture_status():
+    """Estado y contadores de las capturas continuas."""
+    return jsonify({"success": True, "captures": auto_capture.status()}), 200
+
+@fingerprint_bp.route('/autocapture/events', methods=['GET'])
+def stream_autocapture_events():
+    """Server-Sent Events: un evento 'template' por cada dedo detectado; 'stopped' al detenerse."""
+    capture = auto_capture.get(requested_device_id())
+    if capture is None or not capture.running:
+        return jsonify({"success": False, "message": "No hay captura continua en marcha en ese lector."}), 404
+    subscriber = capture.subscribe()
+
+    def events():
+        try:
+            while True:
+                try:
+                    event, data = subscriber.get(timeout=SSE_KEEPALIVE_SECONDS)
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+                if event == 'stopped':
+                    return
+        finally:
+            capture.unsubscribe(subscriber) # También cuando el cliente se desconecta
+
+    return Response(events(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
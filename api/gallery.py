@@ -0,0 +1,306 @@
+# secugen_api/api/gallery.py
+
+import logging
+import os
+import threading
+from collections import namedtuple
+
+from flask import current_app
+from sqlalchemy import or_
+
+from .sdk_interface import wrapper as sdk_wrapper
+from .match_engine import ParallelMatchEngine, MatchEngineError, configured_workers
+from .snapshot import GallerySnapshot, SnapshotError
+from .gallery_sync import gallery_sync, sync_enabled, changed_since
+
+logger = logging.getLogger(__name__)
+
+# Entrada de la galería: metadatos del registro + buffer ctypes ya decodificado
+# (buffer None si las plantillas viven en los workers del motor paralelo)
+GalleryEntry = namedtuple('GalleryEntry', ['fingerprint_id', 'user_id', 'finger_position', 'buffer'])
+
+
+class TemplateGallery:
+    """Galería en memoria con las plantillas de la tabla 'fingerprints' pre-decodificadas.
+
+    Las búsquedas 1:N recorren una tupla inmutable (copy-on-write), así que no
+    necesitan lock; solo las modificaciones lo toman.
+
+    Con MATCH_WORKERS > 0 las plantillas se reparten entre procesos worker
+    (ParallelMatchEngine) y aquí solo quedan los metadatos.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._entries = ()
+        self._by_id = {} # fingerprint_id -> GalleryEntry (respuestas del motor paralelo)
+        self._loaded = False
+        self._snapshot = None # GallerySnapshot mapeada (si se cargó de una instantánea)
+        self.engine = None
+
+    @property
+    def uses_engine(self):
+        """True si las búsquedas van al motor paralelo (no necesitan el hilo del lector)."""
+        return self.engine is not None and self.engine.started
+
+    def _start_engine(self):
+        workers = configured_workers()
+        if not workers or self.engine is not None:
+            return
+        engine = ParallelMatchEngine(workers)
+        if engine.start():
+            self.engine = engine
+        else:
+            logger.error("Motor de matching paralelo no disponible; se usa el handle único.")
+
+    @property
+    def loaded(self):
+        return self._loaded
+
+    def __len__(self):
+        return len(self._entries)
+
+    def entries(self):
+        """Devuelve una instantánea (tupla) de las entradas actuales."""
+        return self._entries
+
+    def load_from_db(self):
+        """Carga (o recarga) toda la tabla 'fingerprints'. Requiere app context."""
+        entries, engine_items = self._decode_rows(self._query_rows())
+        if self.uses_engine:
+            self.engine.load(engine_items)
+        self._replace(entries)
+        self._snapshot = None
+        logger.info(f"Galería cargada con {len(entries)} plantillas.")
+        return len(entries)
+
+    def load_from_snapshot(self, path):
+        """Carga la galería de una instantánea mapeada en memoria (api/snapshot.py) y la pone al día con
+        la BD: descarta las huellas borradas o modificadas después de exportarla y lee de la BD las
+        modificadas y las enroladas después. Requiere app context para esa parte."""
+        snapshot = GallerySnapshot(path)
+        max_id = snapshot.max_fingerprint_id()
+        try:
+            stale_ids, reread_ids = self._stale_snapshot_ids(snapshot, max_id)
+            recent, engine_items = self._decode_rows(self._query_rows(after_id=max_id, ids=reread_ids))
+        except Exception as e:
+            # Sin BD se sirve la instantánea tal cual (sin cambios posteriores a la exportación)
+            logger.warning(f"No se pudo poner al día con la BD la instantánea {path}: {e}")
+            stale_ids, recent, engine_items = set(), [], []
+        if self.uses_engine:
+            self.engine.load_snapshot(path) # Cada worker mapea el archivo por su cuenta
+            for fp_id in stale_ids:
+                self.engine.remove(fp_id)
+            entries = [GalleryEntry(fp_id, user_id, finger_position, None)
+                       for _, fp_id, user_id, finger_position, _ in snapshot.index() if fp_id not in stale_ids]
+        else:
+            entries = [GalleryEntry(fp_id, user_id, finger_position, snapshot.template_buffer(position))
+                       for position, fp_id, user_id, finger_position, _ in snapshot.index() if fp_id not in stale_ids]
+        for (fp_id, template_bytes) in engine_items:
+            self.engine.add(fp_id, template_bytes)
+        self._snapshot = snapshot # Mantiene vivo el mapeo mientras haya buffers apuntando a él
+        self._replace(entries + recent)
+        logger.info(f"Galería cargada de {path}: {len(entries)} plantillas ({len(stale_ids)} descartadas por "
+                    f"cambios posteriores) + {len(recent)} de la BD.")
+        return len(entries) + len(recent)
+
+    @staticmethod
+    def _stale_snapshot_ids(snapshot, max_id):
+        """Compara la instantánea con la BD. Devuelve (ids de la instantánea que ya no valen,
+        ids <= max_id que hay que releer de la BD). Requiere app context."""
+        from . import db
+        from .models import Fingerprint
+        snapshot_ids = {fp_id for _, fp_id, _, _, _ in snapshot.index()}
+        existing_ids = set(db.session.execute(
+            db.select(Fingerprint.id).where(Fingerprint.id <= max_id)).scalars())
+        changed_ids = changed_since(snapshot.change_seq) if snapshot.change_seq is not None else None
+        if changed_ids is None:
+            # Sin registro de cambios solo se detectan los borrados
+            logger.warning(f"Instantánea {snapshot.path} sin seq de cambios utilizable: no se detectan "
+                           f"las huellas modificadas después de exportarla.")
+            changed_ids = set()
+        stale_ids = (snapshot_ids - existing_ids) | (changed_ids & snapshot_ids)
+        reread_ids = {fp_id for fp_id in changed_ids & existing_ids if fp_id <= max_id}
+        return stale_ids, reread_ids
+
+    @staticmethod
+    def _query_rows(after_id=None, ids=None):
+        """Filas de 'fingerprints' (todas, o con id > after_id más las de 'ids')."""
+        from .models import Fingerprint  # Import diferido: models depende de db
+        query = Fingerprint.query.with_entities(
+            Fingerprint.id, Fingerprint.user_id, Fingerprint.finger_position,
+            Fingerprint.template_blob, Fingerprint.template_data
+        )
+        if after_id is not None:
+            condition = Fingerprint.id > after_id
+            if ids:
+                condition = or_(condition, Fingerprint.id.in_(ids))
+            query = query.filter(condition)
+        return query.all()
+
+    def _decode_rows(self, rows):
+        """Convierte filas de la BD en entradas (y en pares (id, bytes) para el motor paralelo)."""
+        entries = []
+        engine_items = []
+        for fp_id, user_id, finger_position, template_blob, template_b64 in rows:
+            # Binario si la fila está migrada; Base64 legado si no
+            template = template_blob if template_blob is not None else template_b64
+            if self.uses_engine:
+                template_bytes = sdk_wrapper.template_to_bytes(template)
+                buffer = None
+                valid = template_bytes is not None
+                if valid:
+                    engine_items.append((fp_id, template_bytes))
+            else:
+                buffer = sdk_wrapper.decode_template(template)
+                valid = buffer is not None
+            if not valid:
+                logger.warning(f"Plantilla de fingerprint {fp_id} inválida, se omite de la galería.")
+                continue
+            entries.append(GalleryEntry(fp_id, user_id, finger_position, buffer))
+        return entries, engine_items
+
+    def _replace(self, entries):
+        with self._lock:
+            self._entries = tuple(entries)
+            self._by_id = {entry.fingerprint_id: entry for entry in entries}
+            self._loaded = True
+
+    def ensure_loaded(self):
+        """Carga la galería la primera vez que se necesita."""
+        if self._loaded:
+            return
+        with self._load_lock:
+            if not self._loaded:
+                self._start_engine()
+                # GALLERY_SYNC=true: los cambios posteriores llegan por LISTEN/NOTIFY (watermark leído antes de cargar)
+                watermark = gallery_sync.current_watermark() if sync_enabled() else None
+                self._load()
+                if watermark is not None:
+                    if self._snapshot is not None and self._snapshot.change_seq is not None:
+                        # Cargada de instantánea: se reaplica todo lo posterior a su exportación (idempotente)
+                        watermark = min(watermark, self._snapshot.change_seq)
+                    gallery_sync.start(self, current_app.config['SQLALCHEMY_DATABASE_URI'], watermark)
+
+    def _load(self):
+        # GALLERY_SNAPSHOT=<ruta>: arranque desde la instantánea binaria en lugar de leer toda la tabla
+        snapshot_path = os.getenv('GALLERY_SNAPSHOT')
+        if snapshot_path and os.path.exists(snapshot_path):
+            try:
+                self.load_from_snapshot(snapshot_path)
+                return
+            except (SnapshotError, MatchEngineError, OSError) as e:
+                logger.error(f"Instantánea {snapshot_path} no utilizable ({e}); se carga desde la BD.")
+        self.load_from_db()
+
+    def add(self, fingerprint_id, user_id, finger_position, template):
+        """Añade una plantilla recién enrolada, en bytes o Base64 (solo si la galería ya está cargada).
+        Idempotente: si el id ya está (p.ej. /enroll local y después su NOTIFY) no hace nada."""
+        if not self._loaded:
+            return False
+        with self._lock:
+            if fingerprint_id in self._by_id:
+                return True
+            if self.uses_engine:
+                template_bytes = sdk_wrapper.template_to_bytes(template)
+                if template_bytes is None or not self.engine.add(fingerprint_id, template_bytes):
+                    return False
+                buffer = None
+            else:
+                buffer = sdk_wrapper.decode_template(template)
+                if buffer is None:
+                    return False
+            entry = GalleryEntry(fingerprint_id, user_id, finger_position, buffer)
+            self._entries = self._entries + (entry,)
+            self._by_id[fingerprint_id] = entry
+        return True
+
+    def add_many(self, items):
+        """Como add() para muchas plantillas a la vez (enrolamiento masivo): una sola copia de la tupla.
+        items: iterable de (fingerprint_id, user_id, finger_position, plantilla). Devuelve cuántas se añadieron."""
+        if not self._loaded:
+            return 0
+        with self._lock:
+            new_entries = []
+            for fingerprint_id, user_id, finger_position, template in items:
+                if fingerprint_id in self._by_id:
+                    continue
+                if self.uses_engine:
+                    template_bytes = sdk_wrapper.template_to_bytes(template)
+                    if template_bytes is None or not self.engine.add(fingerprint_id, template_bytes):
+                        continue
+                    buffer = None
+                else:
+                    buffer = sdk_wrapper.decode_template(template)
+                    if buffer is None:
+                        continue
+                entry = GalleryEntry(fingerprint_id, user_id, finger_position, buffer)
+                new_entries.append(entry)
+                self._by_id[fingerprint_id] = entry
+            self._entries = self._entries + tuple(new_entries)
+        return len(new_entries)
+
+    def remove(self, fingerprint_id):
+        """Quita una huella borrada o modificada en la BD. Devuelve True si estaba."""
+        with self._lock:
+            if self._by_id.pop(fingerprint_id, None) is None:
+                return False
+            if self.uses_engine:
+                self.engine.remove(fingerprint_id)
+            self._entries = tuple(entry for entry in self._entries if entry.fingerprint_id != fingerprint_id)
+        return True
+
+    def identify(self, probe_b64, security_level=sdk_wrapper.SL_NORMAL):
+        """Busca la plantilla (Base64 o bytes) en la galería. Devuelve GalleryEntry, False (sin coincidencia) o None (error)."""
+        if self.uses_engine:
+            return self._identify_parallel(probe_b64, security_level)
+        entries = self._entries
+        matches = sdk_wrapper.identify_template(
+            probe_b64, ((entry, entry.buffer) for entry in entries), security_level, first_only=True
+        )
+        if matches is None:
+            return None
+        return matches[0] if matches else False
+
+    def search(self, probe, k=sdk_wrapper.DEFAULT_TOP_K, security_level=sdk_wrapper.SL_NORMAL,
+               stop_score=sdk_wrapper.DEFAULT_STOP_SCORE, time_budget=None):
+        """Los k candidatos con mayor puntuación (Base64 o bytes). Devuelve wrapper.SearchResult con
+        [(GalleryEntry, puntuación)] de mayor a menor, o None (error). Con time_budget (segundos)
+        la búsqueda puede quedarse a medias: comparar result.compared con len(gallery)."""
+        if self.uses_engine:
+            probe_bytes = sdk_wrapper.template_to_bytes(probe)
+            if probe_bytes is None:
+                return None
+            try:
+                result = self.engine.search(probe_bytes, k, sdk_wrapper.score_threshold(security_level), stop_score,
+                                            time_budget)
+            except MatchEngineError as e:
+                logger.error(f"Error en el motor de matching: {e}")
+                return None
+            if result is None:
+                return None
+            # Una huella borrada mientras tanto puede no estar ya en _by_id
+            candidates = [(self._by_id[fp_id], score) for fp_id, score in result.candidates if fp_id in self._by_id]
+            return result._replace(candidates=candidates)
+        entries = self._entries
+        return sdk_wrapper.search_templates(probe, entries, (entry.buffer for entry in entries),
+                                            k, security_level, stop_score, time_budget)
+
+    def _identify_parallel(self, probe, security_level):
+        probe_bytes = sdk_wrapper.template_to_bytes(probe)
+        if probe_bytes is None:
+            return None
+        try:
+            fingerprint_id = self.engine.identify(probe_bytes, security_level)
+        except MatchEngineError as e:
+            logger.error(f"Error en el motor de matching: {e}")
+            return None
+        if not fingerprint_id: # False (sin coincidencia) o None (error)
+            return fingerprint_id
+        logger.info(f"Identificación paralela: {self.engine.last_compared} comparaciones en {self.engine.workers} workers.")
+        return self._by_id.get(fingerprint_id, False)
+
+
+# Instancia compartida por las rutas
+gallery = TemplateGallery()
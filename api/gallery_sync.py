@@ -0,0 +1,196 @@
+# secugen_api/api/gallery_sync.py
+
+"""
+Sincronización incremental de la galería con LISTEN/NOTIFY de Postgres.
+
+El trigger de migrations/002_fingerprint_changes_notify.sql anota cada INSERT,
+UPDATE o DELETE de 'fingerprints' en 'fingerprint_changes' (seq creciente) y
+hace NOTIFY en el canal 'fingerprint_changes'. Cada instancia escucha en una
+conexión propia; la notificación solo la despierta: los cambios se leen siempre
+de la tabla a partir de la última seq aplicada (watermark), así que una
+desconexión o una notificación perdida se recuperan en la siguiente lectura.
+"""
+
+import json
+import logging
+import os
+import select
+import threading
+import time
+
+from .user_templates import user_templates
+
+logger = logging.getLogger(__name__)
+
+NOTIFY_CHANNEL = 'fingerprint_changes'
+# Sin notificaciones, se consulta la tabla igualmente cada POLL_SECONDS (red de seguridad)
+POLL_SECONDS = 30.0
+RECONNECT_DELAY_SECONDS = 1.0
+MAX_RECONNECT_DELAY_SECONDS = 30.0
+CHANGES_BATCH = 1000
+
+
+def latest_change_seq():
+    """Seq más alta de fingerprint_changes. Requiere app context. None si no se puede leer
+    (p.ej. falta la migración 002)."""
+    from . import db
+    try:
+        return db.session.execute(db.text('SELECT COALESCE(MAX(seq), 0) FROM fingerprint_changes')).scalar()
+    except Exception as e:
+        db.session.rollback()
+        logger.warning(f"No se pudo leer fingerprint_changes: {e}")
+        return None
+
+
+def changed_since(seq):
+    """Ids de huellas modificadas o borradas después de 'seq'. Requiere app context. None si no se puede leer."""
+    from . import db
+    try:
+        return set(db.session.execute(db.text(
+            "SELECT DISTINCT fingerprint_id FROM fingerprint_changes WHERE seq > :seq AND op IN ('U', 'D')"
+        ), {"seq": seq}).scalars())
+    except Exception as e:
+        db.session.rollback()
+        logger.warning(f"No se pudo leer fingerprint_changes: {e}")
+        return None
+
+
+def sync_enabled():
+    """GALLERY_SYNC=true activa la sincronización (requiere la migración 002)."""
+    return os.getenv('GALLERY_SYNC', 'false').lower() in ('true', '1', 't')
+
+
+class GallerySync:
+    """Hilo que aplica a la galería en memoria los cambios de 'fingerprints' de cualquier instancia."""
+
+    def __init__(self):
+        self.watermark = 0 # Última seq de fingerprint_changes aplicada
+        self.connected = False
+        self.applied = 0
+        self.last_applied_at = None
+        self.error = None
+        self._gallery = None
+        self._dsn = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def current_watermark():
+        """Seq más alta ya registrada. Se lee ANTES de cargar la galería: lo que cambie durante la carga
+        se vuelve a aplicar (las operaciones son idempotentes). Requiere app context.
+        Devuelve None si no se puede leer (p.ej. falta la migración 002): la galería funciona sin sincronizar."""
+        watermark = latest_change_seq()
+        if watermark is None:
+            logger.error("Sin fingerprint_changes: sincronización de galería desactivada.")
+        return watermark
+
+    def start(self, gallery, dsn, watermark):
+        """Lanza el hilo de escucha a partir de 'watermark'. Devuelve False si ya estaba en marcha."""
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return False
+            self._gallery = gallery
+            self._dsn = dsn
+            self.watermark = watermark
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='gallery-sync', daemon=True)
+            self._thread.start()
+        logger.info(f"Sincronización de galería iniciada desde seq {watermark}.")
+        return True
+
+    def stop(self):
+        self._stop.set()
+
+    def _connect(self):
+        import psycopg2 # Ya es dependencia (driver de SQLAlchemy); LISTEN necesita una conexión dedicada
+        conn = psycopg2.connect(self._dsn)
+        conn.autocommit = True # Las notificaciones solo llegan fuera de transacción
+        with conn.cursor() as cur:
+            cur.execute(f'LISTEN {NOTIFY_CHANNEL}')
+        return conn
+
+    def _run(self):
+        delay = RECONNECT_DELAY_SECONDS
+        while not self._stop.is_set():
+            conn = None
+            try:
+                conn = self._connect()
+                self.connected = True
+                self.error = None
+                delay = RECONNECT_DELAY_SECONDS
+                self._catch_up(conn) # Lo ocurrido mientras estábamos desconectados
+                while not self._stop.is_set():
+                    if select.select([conn], [], [], POLL_SECONDS) == ([], [], []):
+                        self._catch_up(conn) # Timeout: comprobación periódica
+                        continue
+                    conn.poll()
+                    if conn.notifies:
+                        latest = max(self._notified_seq(n.payload) for n in conn.notifies)
+                        conn.notifies.clear()
+                        if latest > self.watermark:
+                            self._catch_up(conn) # Una sola consulta para toda la ráfaga
+            except Exception as e:
+                self.error = str(e)
+                logger.error(f"Sincronización de galería interrumpida: {e}; reintentando en {delay:.0f} s.")
+            finally:
+                self.connected = False
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+            self._stop.wait(delay)
+            delay = min(delay * 2, MAX_RECONNECT_DELAY_SECONDS)
+
+    @staticmethod
+    def _notified_seq(payload):
+        try:
+            return int(json.loads(payload)['seq'])
+        except (ValueError, KeyError, TypeError):
+            return float('inf') # Payload desconocido: leer la tabla por si acaso
+
+    def _catch_up(self, conn):
+        """Aplica en orden los cambios con seq > watermark."""
+        while True:
+            with conn.cursor() as cur:
+                cur.execute('SELECT seq, op, fingerprint_id FROM fingerprint_changes '
+                            'WHERE seq > %s ORDER BY seq LIMIT %s', (self.watermark, CHANGES_BATCH))
+                changes = cur.fetchall()
+            if not changes:
+                return
+            self._apply(conn, changes)
+            if len(changes) < CHANGES_BATCH:
+                return
+
+    def _apply(self, conn, changes):
+        # El estado final de cada fila se lee una vez (si se borró después, no aparece)
+        upserted_ids = list({fp_id for _, op, fp_id in changes if op in ('I', 'U')})
+        rows = {}
+        if upserted_ids:
+            with conn.cursor() as cur:
+                cur.execute('SELECT id, user_id, finger_position, template_blob, template_data '
+                            'FROM fingerprints WHERE id = ANY(%s)', (upserted_ids,))
+                rows = {row[0]: row for row in cur.fetchall()}
+        gallery = self._gallery
+        for seq, op, fp_id in changes:
+            if op in ('U', 'D'):
+                gallery.remove(fp_id)
+                user_templates.invalidate_fingerprint(fp_id)
+            if op in ('I', 'U') and fp_id in rows:
+                _, user_id, finger_position, template_blob, template_b64 = rows[fp_id]
+                user_templates.invalidate(user_id)
+                template = bytes(template_blob) if template_blob is not None else template_b64
+                gallery.add(fp_id, user_id, finger_position, template)
+            self.watermark = seq
+        self.applied += len(changes)
+        self.last_applied_at = time.time()
+        logger.info(f"Galería sincronizada: {len(changes)} cambios aplicados (seq {self.watermark}).")
+
+    def status(self):
+        return {"enabled": self._thread is not None, "connected": self.connected, "watermark": self.watermark,
+                "applied": self.applied, "last_applied_at": self.last_applied_at, "error": self.error}
+
+
+# Instancia compartida (la arranca la galería al cargarse)
+gallery_sync = GallerySync()
@@ -0,0 +1,88 @@
+# secugen_api/api/image_encoding.py
+
+"""
+Codificación en streaming de las imágenes del lector (8 bits de gris, fila a fila).
+
+- raw:  los píxeles tal cual (application/octet-stream); la geometría va en cabeceras
+- PNG:  escala de grises de 8 bits (image/png), legible por cualquier visor
+- gzip: los mismos píxeles que raw comprimidos con gzip (application/gzip)
+
+Solo se usa la biblioteca estándar (zlib). PNG y gzip se generan por trozos: el
+compresor recibe memoryview de cada fila de la imagen (sin concatenar ni copiar)
+y cada trozo comprimido se envía en cuanto sale, sin esperar a tener el archivo
+entero. Una imagen de 260x300 (78 KB) suele quedar en la mitad o menos.
+"""
+
+import os
+import struct
+import zlib
+
+OCTET_STREAM = 'application/octet-stream'
+IMAGE_PNG = 'image/png'
+GZIP = 'application/gzip'
+
+# Orden de preferencia si el cliente acepta cualquiera (Accept: */* o sin Accept)
+IMAGE_MIMETYPES = (IMAGE_PNG, GZIP, OCTET_STREAM)
+
+# Nivel de zlib (1 rápido .. 9 más compacto) y bytes comprimidos mínimos por trozo enviado
+COMPRESSION_LEVEL = int(os.getenv('IMAGE_COMPRESSION_LEVEL', 6))
+CHUNK_BYTES = 16 * 1024
+
+_PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+_PNG_FILTER_NONE = b'\x00' # Tipo de filtro al inicio de cada fila
+_GZIP_WBITS = 16 + zlib.MAX_WBITS # Cabecera y CRC de gzip en lugar de las de zlib
+
+
+def _png_chunk(chunk_type, data=b''):
+    """Trozo PNG: longitud, tipo, datos y CRC-32 de tipo+datos."""
+    crc = zlib.crc32(data, zlib.crc32(chunk_type))
+    return struct.pack('>I', len(data)) + chunk_type + data + struct.pack('>I', crc)
+
+
+def _compressed_pieces(pieces, wbits):
+    """Comprime los trozos (bytes/memoryview) y genera la salida en bloques de al menos CHUNK_BYTES."""
+    compressor = zlib.compressobj(COMPRESSION_LEVEL, zlib.DEFLATED, wbits)
+    pending = []
+    pending_bytes = 0
+    for piece in pieces:
+        out = compressor.compress(piece)
+        if out:
+            pending.append(out)
+            pending_bytes += len(out)
+            if pending_bytes >= CHUNK_BYTES:
+                yield b''.join(pending)
+                pending, pending_bytes = [], 0
+    pending.append(compressor.flush())
+    yield b''.join(pending)
+
+
+def _rows(image, width, height):
+    view = memoryview(image)
+    for row in range(height):
+        yield view[row * width:(row + 1) * width]
+
+
+def encode_png(image, width, height):
+    """Genera el PNG (bytes por trozos) de una imagen de 8 bits en gris."""
+    def scanlines():
+        for row in _rows(image, width, height):
+            yield _PNG_FILTER_NONE
+            yield row
+
+    yield _PNG_SIGNATURE + _png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 0, 0, 0, 0))
+    for data in _compressed_pieces(scanlines(), zlib.MAX_WBITS):
+        if data:
+            yield _png_chunk(b'IDAT', data) # Varios IDAT seguidos forman un único flujo zlib
+    yield _png_chunk(b'IEND')
+
+
+def encode_gzip(image, width, height):
+    """Genera los píxeles en bruto comprimidos con gzip (bytes por trozos)."""
+    return _compressed_pieces(_rows(image, width, height), _GZIP_WBITS)
+
+
+# Codificadores por tipo MIME (raw se envía tal cual, sin codificador)
+ENCODERS = {
+    IMAGE_PNG: encode_png,
+    GZIP: encode_gzip,
+}
@@ -0,0 +1,351 @@
+# secugen_api/api/match_engine.py
+
+"""
+Motor de matching 1:N en paralelo con procesos.
+
+SGFPM_MatchTemplate bloquea y trabaja sobre un único handle, así que en un proceso
+la identificación usa un solo núcleo. Aquí la galería se reparte entre N procesos
+worker; cada uno tiene su propio handle SGFPM (solo Create/Init, sin lector) y su
+porción de plantillas ya decodificadas. Una búsqueda se envía a todos a la vez
+(scatter-gather) y el primer worker que encuentra coincidencia lo publica en un
+valor compartido para que el resto corte su recorrido. Las búsquedas top-k con
+puntuación (SGFPM_GetMatchingScore) se reparten igual: cada worker devuelve sus k
+mejores y el proceso principal los mezcla.
+"""
+
+import ctypes
+import heapq
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from multiprocessing.connection import wait as wait_connections
+
+from .sdk_interface import wrapper as sdk_wrapper
+
+logger = logging.getLogger(__name__)
+
+# Cada cuántas comparaciones consulta un worker si otro ya encontró la coincidencia
+EARLY_EXIT_CHECK_EVERY = 64
+# Tiempo máximo para que un worker arranque (importar la app y crear su handle)
+WORKER_START_TIMEOUT = 30.0
+WORKER_NAME_PREFIX = 'match-worker'
+
+
+class MatchEngineError(Exception):
+    """Un worker falló o dejó de responder."""
+
+
+def configured_workers():
+    """MATCH_WORKERS: número de procesos, 'auto' = núcleos de la máquina, 0 (por defecto) = desactivado."""
+    value = os.getenv('MATCH_WORKERS', '0').strip().lower()
+    if value == 'auto':
+        return os.cpu_count() or 1
+    return max(0, int(value))
+
+
+def is_worker_process():
+    """True dentro de un worker (spawn vuelve a importar el módulo principal, p.ej. run.py)."""
+    return multiprocessing.current_process().name.startswith(WORKER_NAME_PREFIX)
+
+
+def _worker_main(conn, found, backend_factory):
+    """Bucle de un proceso worker: su handle SGFPM y su porción de la galería."""
+    # Sin instrumentación por llamada: el worker no exporta /metrics y son millones de comparaciones
+    os.environ['SDK_METRICS'] = 'false'
+    if backend_factory is not None:
+        sdk_wrapper.set_backend(backend_factory())
+    session = sdk_wrapper.DeviceSession(device_id=None)
+    ok = sdk_wrapper._load_library() and sdk_wrapper._define_signatures() and session.open(open_device=False)
+    conn.send(('ready', bool(ok)))
+    if not ok:
+        return
+
+    keys = []
+    buffers = []
+    match_result = ctypes.c_bool(False)
+    match_result_ref = ctypes.byref(match_result)
+    try:
+        while True:
+            command = conn.recv()
+            op = command[0]
+            if op == 'identify':
+                _, seq, probe, security_level = command
+                conn.send(_identify_shard(seq, probe, security_level, keys, buffers, session.handle,
+                                          match_result, match_result_ref, found))
+            elif op == 'search':
+                _, seq, probe, k, min_score, stop_score, time_budget = command
+                conn.send(_search_shard(seq, probe, k, min_score, stop_score, time_budget,
+                                        keys, buffers, session.handle, found))
+            elif op == 'load':
+                keys, buffers = [], []
+                for key, template in command[1]:
+                    buffer = sdk_wrapper.decode_template(template)
+                    if buffer is not None:
+                        keys.append(key)
+                        buffers.append(buffer)
+                conn.send(('loaded', len(keys)))
+            elif op == 'snapshot':
+                # Porción por turnos (posición % n == índice), leída del mapeo compartido sin copiar
+                from .snapshot import GallerySnapshot
+                _, path, worker_index, worker_count = command
+                snapshot = GallerySnapshot(path, verify=False) # Ya verificada por el proceso principal
+                keys, buffers = [], []
+                for position, fp_id, _, _, _ in snapshot.index(worker_index, worker_count):
+                    keys.append(fp_id)
+                    buffers.append(snapshot.template_buffer(position))
+                conn.send(('loaded', len(keys)))
+            elif op == 'add':
+                buffer = sdk_wrapper.decode_template(command[2])
+                if buffer is not None:
+                    keys.append(command[1])
+                    buffers.append(buffer)
+                conn.send(('added', buffer is not None))
+            elif op == 'remove':
+                removed = command[1] in keys
+                if removed:
+                    position = keys.index(command[1])
+                    del keys[position]
+                    del buffers[position]
+                conn.send(('removed', removed))
+            elif op == 'stop':
+                break
+    except (EOFError, KeyboardInterrupt):
+        pass
+    finally:
+        session.close()
+
+
+def _identify_shard(seq, probe, security_level, keys, buffers, handle, match_result, match_result_ref, found):
+    """Recorre la porción del worker. Devuelve ('result', seq, clave|None, comparaciones, error|None)."""
+    probe_buffer = sdk_wrapper.decode_template(probe)
+    if probe_buffer is None:
+        return ('result', seq, None, 0, "Plantilla de búsqueda inválida.")
+    match_fn = sdk_wrapper.sgfplib.SGFPM_MatchTemplate
+    compared = 0
+    for position, candidate_buffer in enumerate(buffers):
+        if position % EARLY_EXIT_CHECK_EVERY == 0 and found.value == seq:
+            break # Otro worker ya encontró la coincidencia
+        compared += 1
+        error_code = match_fn(handle, probe_buffer, candidate_buffer, security_level, match_result_ref)
+        if error_code != sdk_wrapper.SGFDX_ERROR_NONE:
+            return ('result', seq, None, compared, f"SGFPM_MatchTemplate devolvió {error_code}.")
+        if match_result.value:
+            found.value = seq
+            return ('result', seq, keys[position], compared, None)
+    return ('result', seq, None, compared, None)
+
+
+def _search_shard(seq, probe, k, min_score, stop_score, time_budget, keys, buffers, handle, found):
+    """Top-k de la porción del worker (cortando al agotar time_budget, si hay).
+    Devuelve ('scored', seq, [(clave, puntuación)], comparaciones, corte, error|None)."""
+    probe_buffer = sdk_wrapper.decode_template(probe)
+    if probe_buffer is None:
+        return ('scored', seq, [], 0, False, "Plantilla de búsqueda inválida.")
+    deadline = time.monotonic() + time_budget if time_budget else None
+    def should_stop():
+        return found.value == seq or (deadline is not None and time.monotonic() >= deadline)
+    result, error_code = sdk_wrapper.top_k_scores(handle, probe_buffer, keys, buffers, k, min_score, stop_score,
+                                                  should_stop=should_stop)
+    if error_code is not None:
+        return ('scored', seq, [], result.compared, False, f"SGFPM_GetMatchingScore devolvió {error_code}.")
+    if result.early_exit:
+        found.value = seq # El resto de workers corta su recorrido
+    return ('scored', seq, result.candidates, result.compared, result.early_exit, None)
+
+
+class ParallelMatchEngine:
+    """Reparte la galería entre procesos worker y busca en todos a la vez.
+
+    Las búsquedas se serializan entre sí (cada una ya usa todos los workers).
+    backend_factory: callable serializable que devuelve la librería SDK del worker
+    (p.ej. functools.partial(SimulatedSGFPLib, ...)); por defecto la de SECUGEN_SDK_BACKEND.
+    """
+
+    def __init__(self, workers=None, backend_factory=None):
+        self.workers = workers if workers is not None else (configured_workers() or os.cpu_count() or 1)
+        self.backend_factory = backend_factory
+        self._context = multiprocessing.get_context('spawn') # Sin fork: el proceso web tiene hilos y handles abiertos
+        self._lock = threading.Lock()
+        self._processes = []
+        self._connections = []
+        self._shard_sizes = []
+        self._found = None
+        self._seq = 0
+        self.last_compared = 0
+
+    @property
+    def started(self):
+        return bool(self._processes)
+
+    def start(self):
+        """Lanza los workers y espera a que cada uno tenga su handle. Devuelve True/False."""
+        with self._lock:
+            if self._processes:
+                return True
+            self._found = self._context.RawValue('q', 0)
+            for index in range(self.workers):
+                parent_conn, child_conn = self._context.Pipe()
+                process = self._context.Process(target=_worker_main, name=f'{WORKER_NAME_PREFIX}-{index}',
+                                                args=(child_conn, self._found, self.backend_factory),
+                                                daemon=True)
+                process.start()
+                child_conn.close()
+                self._processes.append(process)
+                self._connections.append(parent_conn)
+                self._shard_sizes.append(0)
+            try:
+                for conn in self._connections:
+                    if not conn.poll(WORKER_START_TIMEOUT) or conn.recv() != ('ready', True):
+                        raise MatchEngineError("Un worker no pudo inicializar su handle SGFPM.")
+            except (MatchEngineError, EOFError, OSError) as e:
+                logger.error(f"Fallo al arrancar el motor de matching: {e}")
+                self._stop_locked()
+                return False
+        logger.info(f"Motor de matching iniciado con {self.workers} workers.")
+        return True
+
+    def stop(self):
+        with self._lock:
+            self._stop_locked()
+
+    def _stop_locked(self):
+        for conn in self._connections:
+            try:
+                conn.send(('stop',))
+            except (OSError, ValueError):
+                pass
+        for process in self._processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        for conn in self._connections:
+            conn.close()
+        self._processes, self._connections, self._shard_sizes = [], [], []
+
+    def _request_all(self, messages):
+        """Envía un mensaje a cada worker y devuelve sus respuestas (en orden de worker)."""
+        for conn, message in zip(self._connections, messages):
+            conn.send(message)
+        return [conn.recv() for conn in self._connections]
+
+    def load(self, items):
+        """Reemplaza la galería. items: lista de (clave, bytes_plantilla), repartida por turnos. Devuelve cuántas cargaron."""
+        shards = [[] for _ in range(self.workers)]
+        for position, item in enumerate(items):
+            shards[position % self.workers].append(item)
+        with self._lock:
+            try:
+                replies = self._request_all([('load', shard) for shard in shards])
+            except (EOFError, OSError) as e:
+                raise MatchEngineError(f"Worker caído durante la carga: {e}") from e
+            self._shard_sizes = [count for _, count in replies]
+        loaded = sum(self._shard_sizes)
+        logger.info(f"Motor de matching: {loaded} plantillas en {self.workers} workers.")
+        return loaded
+
+    def load_snapshot(self, path):
+        """Reemplaza la galería por la de una instantánea (api/snapshot.py): cada worker mapea el archivo
+        y toma su porción, sin pasar plantillas por los pipes. Devuelve cuántas cargaron."""
+        with self._lock:
+            try:
+                replies = self._request_all([('snapshot', path, index, self.workers) for index in range(self.workers)])
+            except (EOFError, OSError) as e:
+                raise MatchEngineError(f"Worker caído durante la carga de la instantánea: {e}") from e
+            self._shard_sizes = [count for _, count in replies]
+        loaded = sum(self._shard_sizes)
+        logger.info(f"Motor de matching: {loaded} plantillas de {path} en {self.workers} workers.")
+        return loaded
+
+    def add(self, key, template_bytes):
+        """Añade una plantilla al worker con menos carga. Devuelve True si se decodificó."""
+        with self._lock:
+            index = min(range(self.workers), key=lambda i: self._shard_sizes[i])
+            try:
+                self._connections[index].send(('add', key, template_bytes))
+                _, added = self._connections[index].recv()
+            except (EOFError, OSError) as e:
+                raise MatchEngineError(f"Worker caído al añadir plantilla: {e}") from e
+            if added:
+                self._shard_sizes[index] += 1
+            return added
+
+    def remove(self, key):
+        """Quita una plantilla de los workers (la tenga el que la tenga). Devuelve True si estaba."""
+        with self._lock:
+            try:
+                replies = self._request_all([('remove', key)] * self.workers)
+            except (EOFError, OSError) as e:
+                raise MatchEngineError(f"Worker caído al quitar plantilla: {e}") from e
+            removed = False
+            for index, (_, worker_removed) in enumerate(replies):
+                if worker_removed:
+                    self._shard_sizes[index] -= 1
+                    removed = True
+            return removed
+
+    def identify(self, probe_bytes, security_level=sdk_wrapper.SL_NORMAL):
+        """Busca en todos los workers a la vez. Devuelve la clave encontrada, False (sin coincidencia) o None (error)."""
+        with self._lock:
+            self._seq += 1
+            seq = self._seq
+            try:
+                for conn in self._connections:
+                    conn.send(('identify', seq, probe_bytes, security_level))
+                # Gather: hay que leer todas las respuestas para dejar los pipes en orden,
+                # pero tras la primera coincidencia el resto corta en <= EARLY_EXIT_CHECK_EVERY comparaciones
+                pending = list(self._connections)
+                match_key = None
+                error = None
+                compared = 0
+                while pending:
+                    for conn in wait_connections(pending):
+                        _, _, key, worker_compared, worker_error = conn.recv()
+                        pending.remove(conn)
+                        compared += worker_compared
+                        if worker_error:
+                            error = worker_error
+                        elif key is not None and match_key is None:
+                            match_key = key
+            except (EOFError, OSError) as e:
+                logger.error(f"Worker de matching caído durante la búsqueda: {e}")
+                return None
+            self.last_compared = compared
+        if match_key is not None:
+            return match_key
+        if error:
+            logger.error(f"Error en la búsqueda paralela: {error}")
+            return None
+        return False
+
+    def search(self, probe_bytes, k, min_score, stop_score=0, time_budget=None):
+        """Top-k en todos los workers a la vez (cada uno el suyo; aquí se mezclan). Con time_budget
+        (segundos) cada worker deja de recorrer al agotarlo. Devuelve wrapper.SearchResult o None (error)."""
+        with self._lock:
+            self._seq += 1
+            seq = self._seq
+            try:
+                for conn in self._connections:
+                    conn.send(('search', seq, probe_bytes, k, min_score, stop_score, time_budget))
+                replies = [conn.recv() for conn in self._connections]
+            except (EOFError, OSError) as e:
+                logger.error(f"Worker de matching caído durante la búsqueda top-k: {e}")
+                return None
+        candidates = []
+        compared = 0
+        early_exit = False
+        for _, _, worker_candidates, worker_compared, worker_early_exit, worker_error in replies:
+            if worker_error:
+                logger.error(f"Error en la búsqueda top-k paralela: {worker_error}")
+                return None
+            candidates.extend(worker_candidates)
+            compared += worker_compared
+            early_exit = early_exit or worker_early_exit
+        self.last_compared = compared
+        ranked = heapq.nlargest(k, candidates, key=lambda item: item[1])
+        return sdk_wrapper.SearchResult(ranked, compared, early_exit)
+
+    def stats(self):
+        return {"workers": self.workers, "started": self.started, "templates": sum(self._shard_sizes),
+                "shard_sizes": list(self._shard_sizes)}
@@ -1,5 +1,6 @@
 # api/models.py
 from . import db # Importar la instancia db de __init__.py
+import base64
 import datetime
 
 class User(db.Model):
@@ -17,13 +18,27 @@ class User(db.Model):
 
 class Fingerprint(db.Model):
     __tablename__ = 'fingerprints' # Nombre de la tabla
+    # Un registro por usuario y dedo (migrations/003_fingerprints_user_finger_unique.sql); lo usa /enroll/bulk
+    __table_args__ = (
+        db.Index('uq_fingerprints_user_finger', 'user_id', 'finger_position', unique=True),
+    )
     id = db.Column(db.Integer, primary_key=True)
-    # Clave foránea a la tabla users
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    # Clave foránea a la tabla users (indexada: verificación por usuario, migrations/004_fingerprints_user_id_index.sql)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
     finger_position = db.Column(db.String(50), nullable=False) # ej: "Pulgar Derecho"
     template_format = db.Column(db.String(20), nullable=False, default='SG400')
-    template_data = db.Column(db.Text, nullable=False) # Para guardar Base64
+    template_data = db.Column(db.Text, nullable=True) # Base64 (legado, ver migrations/001_fingerprint_template_blob.sql)
+    template_blob = db.Column(db.LargeBinary, nullable=True) # Plantilla binaria (bytea) con su tamaño exacto
     created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
 
+    @property
+    def template_bytes(self):
+        """Bytes de la plantilla: columna binaria o, para filas no migradas, el Base64 legado."""
+        if self.template_blob is not None:
+            return bytes(self.template_blob)
+        if self.template_data:
+            return base64.b64decode(self.template_data)
+        return None
+
     def __repr__(self):
         return f'<Fingerprint {self.id} User:{self.user_id} Finger:{self.finger_position}>'
\ No newline at end of file
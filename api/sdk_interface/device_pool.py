@@ -0,0 +1,157 @@
+# secugen_api/sdk_interface/device_pool.py
+
+import logging
+import threading
+
+from . import wrapper as sdk_wrapper
+from .scheduler import DeviceScheduler, device_scheduler, PRIORITY_CONTROL, PRIORITY_CAPTURE, TIMEOUT_CAPTURE
+
+logger = logging.getLogger(__name__)
+
+
+class DeviceNotAvailable(Exception):
+    """El lector pedido no existe o no está abierto."""
+
+
+class DevicePool:
+    """Reparte capturas entre todos los lectores abiertos, cada uno con su propio hilo (DeviceScheduler).
+
+    El lector principal usa el scheduler global (device_scheduler), que también
+    atiende el matching; el resto tiene un scheduler propio creado bajo demanda.
+    Cada lector se abre, se usa y se cierra siempre desde su hilo (open_devices/close_devices).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._schedulers = {} # device_id -> DeviceScheduler (lectores secundarios)
+        self._in_flight = {} # device_id -> comandos encolados o en ejecución
+
+    def scheduler_for(self, device_id):
+        """Scheduler propietario del lector device_id."""
+        primary = sdk_wrapper.get_session()
+        if primary is not None and primary.device_id == device_id:
+            return device_scheduler
+        with self._lock:
+            scheduler = self._schedulers.get(device_id)
+            if scheduler is None:
+                scheduler = self._schedulers[device_id] = DeviceScheduler(name=f'sdk-device-{device_id}')
+            return scheduler
+
+    def select(self, device_id=None):
+        """Devuelve la sesión del lector pedido o, si no se indica, la del más libre."""
+        sessions = {sid: session for sid, session in sdk_wrapper.get_sessions().items() if session.ready}
+        if device_id is not None:
+            session = sessions.get(device_id)
+            if session is None:
+                raise DeviceNotAvailable(f"Lector {device_id} no encontrado o no abierto.")
+            return session
+        if not sessions:
+            raise DeviceNotAvailable("No hay lectores abiertos.")
+        with self._lock:
+            # Menos comandos pendientes; a igualdad, el de menor id
+            best_id = min(sessions, key=lambda sid: (self._in_flight.get(sid, 0), sid))
+        return sessions[best_id]
+
+    def submit(self, fn, *args, device_id=None, priority=PRIORITY_CAPTURE, timeout=TIMEOUT_CAPTURE, **kwargs):
+        """Encola fn(*args, session=<sesión elegida>) en el hilo de ese lector. Devuelve (device_id, Future)."""
+        session = self.select(device_id)
+        scheduler = self.scheduler_for(session.device_id)
+        with self._lock:
+            self._in_flight[session.device_id] = self._in_flight.get(session.device_id, 0) + 1
+        future = scheduler.submit(fn, *args, session=session, priority=priority, timeout=timeout, **kwargs)
+        future.add_done_callback(lambda _: self._release(session.device_id))
+        return session.device_id, future
+
+    def call(self, fn, *args, device_id=None, priority=PRIORITY_CAPTURE, timeout=TIMEOUT_CAPTURE, **kwargs):
+        """Como submit, pero espera el resultado. Devuelve (device_id, resultado)."""
+        selected_id, future = self.submit(fn, *args, device_id=device_id, priority=priority, timeout=timeout, **kwargs)
+        return selected_id, DeviceScheduler.wait(future, timeout)
+
+    def _release(self, device_id):
+        with self._lock:
+            self._in_flight[device_id] = max(0, self._in_flight.get(device_id, 0) - 1)
+
+    def status(self):
+        """Estado de cada lector abierto (sin llamadas al SDK)."""
+        devices = []
+        for device_id, session in sdk_wrapper.get_sessions().items():
+            scheduler = self.scheduler_for(device_id)
+            with self._lock:
+                in_flight = self._in_flight.get(device_id, 0)
+            devices.append({
+                "device_id": device_id,
+                "ready": session.ready,
+                "primary": session is sdk_wrapper.get_session(),
+                "image_width": session.image_width,
+                "image_height": session.image_height,
+                "busy": scheduler.current_command is not None,
+                "current_command": scheduler.current_command,
+                "queue_depth": scheduler.queue_depth,
+                "in_flight": in_flight,
+            })
+        return devices
+
+    def open_devices(self, device_ids=None, blink=True):
+        """Inicializa el SDK abriendo cada lector en su hilo. Llamar desde device_scheduler: ahí se
+        abre el principal (el primero que abra); los secundarios, a la vez en sus schedulers.
+        Devuelve True/False como wrapper.initialize_sdk."""
+        if sdk_wrapper.is_matching_only():
+            return sdk_wrapper.initialize_matcher()
+        if sdk_wrapper.is_ready():
+            logger.info("SDK ya inicializado y dispositivo abierto.")
+            return True
+        if not sdk_wrapper.load_sdk():
+            return False
+
+        pending = list(sdk_wrapper.configured_device_ids() if device_ids is None else device_ids)
+        while pending and sdk_wrapper.get_session() is None:
+            sdk_wrapper.open_device(pending.pop(0), blink)
+        primary = sdk_wrapper.get_session()
+        if primary is None:
+            return False
+        futures = {device_id: self.scheduler_for(device_id).submit(sdk_wrapper.open_device, device_id, blink,
+                                                                   priority=PRIORITY_CONTROL, timeout=TIMEOUT_CAPTURE)
+                   for device_id in pending}
+        for device_id, future in futures.items():
+            try:
+                DeviceScheduler.wait(future, TIMEOUT_CAPTURE)
+            except Exception as e:
+                logger.error(f"No se pudo abrir el lector {device_id} en su hilo: {e}")
+        logger.info(f"Lectores abiertos: {list(sdk_wrapper.get_sessions())} (principal: {primary.device_id}).")
+        return True
+
+    def close_devices(self):
+        """Cierra cada lector secundario en su hilo (tras el comando en curso, p.ej. un GetImage
+        esperando el dedo; lo que siga en cola se cancela), detiene esos hilos y termina el SDK
+        desde el que llama, que debe ser device_scheduler. Devuelve True si todo se cerró bien."""
+        closed_properly = True
+        with self._lock:
+            schedulers = dict(self._schedulers)
+        futures = {}
+        for device_id, scheduler in schedulers.items():
+            scheduler.cancel_pending()
+            if sdk_wrapper.get_session(device_id) is not None:
+                futures[device_id] = scheduler.submit(sdk_wrapper.close_device, device_id,
+                                                      priority=PRIORITY_CONTROL, timeout=TIMEOUT_CAPTURE)
+        for device_id, future in futures.items():
+            try:
+                closed_properly = DeviceScheduler.wait(future, TIMEOUT_CAPTURE) and closed_properly
+            except Exception as e:
+                # Lo que quede abierto lo cierra terminate_sdk desde este hilo
+                logger.error(f"No se pudo cerrar el lector {device_id} en su hilo: {e}")
+                closed_properly = False
+        self.stop_secondary()
+        return sdk_wrapper.terminate_sdk() and closed_properly
+
+    def stop_secondary(self):
+        """Detiene los hilos de los lectores secundarios (ya cerrados: ver close_devices)."""
+        with self._lock:
+            schedulers = list(self._schedulers.values())
+            self._schedulers.clear()
+            self._in_flight.clear()
+        for scheduler in schedulers:
+            scheduler.stop()
+
+
+# Pool compartido por las rutas
+device_pool = DevicePool()
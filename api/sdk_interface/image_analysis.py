@@ -0,0 +1,84 @@
+# secugen_api/sdk_interface/image_analysis.py
+
+"""
+Análisis previo a la extracción de la imagen de SGFPM_GetImage (requiere NumPy, opcional).
+
+La imagen se lee como un ndarray (alto x ancho, uint8) creado con np.frombuffer
+sobre el buffer ctypes de la sesión: no se copia nada y la vista se crea una sola
+vez al abrir el lector. Antes de llamar a SGFPM_CreateTemplate se estima, sobre una
+versión submuestreada de la vista (slicing, tampoco copia):
+
+- presencia: el sensor vacío es casi uniforme (blanco); una comprobación de rango
+  sobre 1 de cada 64 píxeles descarta esas imágenes en microsegundos
+- cobertura: fracción de bloques con contraste local (crestas/valles) suficiente
+- contraste: desviación típica media de esos bloques
+- ROI: rectángulo que contiene los bloques con huella
+
+Sin NumPy (o con IMAGE_ANALYSIS=false) no se analiza nada y todo sigue como antes.
+"""
+
+import os
+from collections import namedtuple
+
+try:
+    import numpy as np
+except ImportError: # Dependencia opcional
+    np = None
+
+# Paso del submuestreo del análisis y lado (en píxeles submuestreados) de cada bloque
+SAMPLE_STEP = 3
+BLOCK_SIZE = 6 # 18x18 píxeles de la imagen: unas dos crestas a 500 dpi
+# Paso de la comprobación rápida de sensor vacío y rango mínimo de grises para seguir
+BLANK_CHECK_STEP = 8
+BLANK_MIN_RANGE = 24
+# Desviación típica mínima de un bloque con huella y cobertura mínima para aceptar la imagen
+BLOCK_MIN_STD = 12.0
+MIN_COVERAGE = 0.25
+
+# Resultado del análisis. roi: (x0, y0, x1, y1) en píxeles de la imagen completa, o None
+FrameAnalysis = namedtuple('FrameAnalysis', ['present', 'coverage', 'contrast', 'roi'])
+
+_BLANK = FrameAnalysis(False, 0.0, 0.0, None)
+
+
+def analysis_enabled():
+    """True si NumPy está instalado y no se ha desactivado con IMAGE_ANALYSIS=false."""
+    return np is not None and os.getenv('IMAGE_ANALYSIS', 'true').lower() in ('true', '1', 't')
+
+
+def image_view(buffer, width, height):
+    """Vista ndarray (height, width) uint8 sobre un buffer ctypes, sin copiar. None sin NumPy."""
+    if np is None or buffer is None:
+        return None
+    return np.frombuffer(buffer, dtype=np.uint8, count=width * height).reshape(height, width)
+
+
+def analyze_frame(view, min_coverage=MIN_COVERAGE):
+    """Analiza la imagen (vista de image_view). Devuelve FrameAnalysis."""
+    # 1. Sensor vacío: casi todos los píxeles iguales (unas 1200 muestras en 260x300)
+    probe = view[::BLANK_CHECK_STEP, ::BLANK_CHECK_STEP]
+    if int(probe.max()) - int(probe.min()) < BLANK_MIN_RANGE:
+        return _BLANK
+
+    # 2. Contraste por bloques sobre la imagen submuestreada (recortada a múltiplo del bloque)
+    sample = view[::SAMPLE_STEP, ::SAMPLE_STEP]
+    rows = sample.shape[0] // BLOCK_SIZE
+    cols = sample.shape[1] // BLOCK_SIZE
+    blocks = sample[:rows * BLOCK_SIZE, :cols * BLOCK_SIZE].astype(np.float32).reshape(rows, BLOCK_SIZE, cols, BLOCK_SIZE)
+    # Varianza como E[x²] - E[x]² (más rápido que std() sobre los ejes del bloque)
+    block_mean = blocks.mean(axis=(1, 3))
+    block_std = np.sqrt(np.maximum((blocks * blocks).mean(axis=(1, 3)) - block_mean * block_mean, 0.0))
+    foreground = block_std >= BLOCK_MIN_STD
+    coverage = float(foreground.mean())
+    if not foreground.any():
+        return FrameAnalysis(False, 0.0, 0.0, None)
+
+    # 3. ROI: filas/columnas de bloques con huella, en coordenadas de la imagen completa
+    block_pixels = BLOCK_SIZE * SAMPLE_STEP
+    row_hits = np.flatnonzero(foreground.any(axis=1))
+    col_hits = np.flatnonzero(foreground.any(axis=0))
+    roi = (int(col_hits[0]) * block_pixels, int(row_hits[0]) * block_pixels,
+           min(int(col_hits[-1] + 1) * block_pixels, view.shape[1]),
+           min(int(row_hits[-1] + 1) * block_pixels, view.shape[0]))
+    contrast = float(block_std[foreground].mean())
+    return FrameAnalysis(coverage >= min_coverage, round(coverage, 3), round(contrast, 1), roi)
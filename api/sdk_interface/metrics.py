@@ -0,0 +1,227 @@
+# secugen_api/sdk_interface/metrics.py
+
+"""
+Métricas en formato de texto Prometheus (sin dependencias externas).
+
+Incluye un registro mínimo (Counter, Gauge, Histogram) y un proxy que instrumenta
+todas las llamadas SGFPM_* de sgfplib: histograma de latencia, contador por código
+de error y gauge de llamadas en curso (y un span por llamada si hay traza activa).
+"""
+
+import bisect
+import os
+import threading
+import time
+
+from . import tracing
+
+# Buckets (segundos) pensados para el SDK: desde MatchTemplate (~µs) hasta GetImage (segundos)
+SDK_LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_labels(label_names, label_values, extra=None):
+    pairs = list(zip(label_names, label_values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape_label(value)}"' for name, value in pairs) + '}'
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    metric_type = 'untyped'
+
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+        self._values = {}
+        self._function = None
+
+    def set_function(self, function):
+        """function() -> {tupla_de_labels: valor}, evaluada en cada exportación (valores de otros módulos)."""
+        self._function = function
+
+    def _header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.metric_type}"]
+
+    def _items(self):
+        if self._function is not None:
+            return sorted(self._function().items())
+        with self._lock:
+            return sorted(self._values.items())
+
+    def render(self):
+        lines = self._header()
+        for label_values, value in self._items():
+            lines.append(f"{self.name}{_format_labels(self.label_names, label_values)} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    metric_type = 'counter'
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+
+class Gauge(_Metric):
+    metric_type = 'gauge'
+
+    def set(self, *label_values, value):
+        with self._lock:
+            self._values[label_values] = value
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def dec(self, *label_values, amount=1):
+        self.inc(*label_values, amount=-amount)
+
+
+class Histogram(_Metric):
+    metric_type = 'histogram'
+
+    def __init__(self, name, documentation, label_names=(), buckets=SDK_LATENCY_BUCKETS):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, *label_values, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(label_values)
+            if state is None:
+                state = self._values[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1 # Conteo no acumulado; se acumula al exportar
+            state[1] += value
+            state[2] += 1
+
+    def render(self):
+        lines = self._header()
+        with self._lock:
+            items = sorted((labels, ([*state[0]], state[1], state[2])) for labels, state in self._values.items())
+        for label_values, (bucket_counts, total, count) in items:
+            cumulative = 0
+            for upper, bucket_count in zip(self.buckets + (float('inf'),), bucket_counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.label_names, label_values, ('le', _format_value(upper)))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.label_names, label_values)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing # Idempotente (p.ej. create_app llamado varias veces)
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, documentation, label_names=()):
+        return self._register(Counter(name, documentation, label_names))
+
+    def gauge(self, name, documentation, label_names=()):
+        return self._register(Gauge(name, documentation, label_names))
+
+    def histogram(self, name, documentation, label_names=(), buckets=SDK_LATENCY_BUCKETS):
+        return self._register(Histogram(name, documentation, label_names, buckets))
+
+    def render(self):
+        """Texto de exposición Prometheus (version 0.0.4)."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+# Registro compartido
+registry = MetricsRegistry()
+
+sdk_call_duration = registry.histogram(
+    'secugen_sdk_call_duration_seconds', 'Latencia de cada llamada SGFPM_* a la librería SDK.', ('function',))
+sdk_calls_total = registry.counter(
+    'secugen_sdk_calls_total', 'Llamadas SGFPM_* por función y código devuelto (0 = sin error).', ('function', 'code'))
+sdk_calls_in_flight = registry.gauge(
+    'secugen_sdk_calls_in_flight', 'Llamadas SGFPM_* en curso.', ('function',))
+
+
+class _InstrumentedFunction:
+    """Envuelve una función SGFPM_* midiendo latencia, código devuelto y concurrencia."""
+
+    def __init__(self, name, fn):
+        object.__setattr__(self, '_name', name)
+        object.__setattr__(self, '_fn', fn)
+
+    def __call__(self, *args):
+        name = self._name
+        sdk_calls_in_flight.inc(name)
+        start = time.perf_counter()
+        result = 'exception'
+        try:
+            result = self._fn(*args)
+            return result
+        finally:
+            end = time.perf_counter()
+            sdk_call_duration.observe(name, value=end - start)
+            sdk_calls_in_flight.dec(name)
+            sdk_calls_total.inc(name, str(result))
+            tracing.record(name, start, end, code=result) # Span de la etapa si hay traza activa
+
+    # argtypes/restype (y cualquier otro atributo) se leen/escriben en la función real
+    def __getattr__(self, attribute):
+        return getattr(self._fn, attribute)
+
+    def __setattr__(self, attribute, value):
+        setattr(self._fn, attribute, value)
+
+
+class InstrumentedLibrary:
+    """Proxy de sgfplib: las funciones SGFPM_* quedan instrumentadas; el resto de atributos pasa tal cual."""
+
+    def __init__(self, library):
+        object.__setattr__(self, '_library', library)
+        object.__setattr__(self, '_functions', {})
+
+    def __getattr__(self, attribute):
+        if not attribute.startswith('SGFPM_'):
+            return getattr(self._library, attribute)
+        function = self._functions.get(attribute)
+        if function is None:
+            function = _InstrumentedFunction(attribute, getattr(self._library, attribute)) # AttributeError si no existe
+            self._functions[attribute] = function
+        return function
+
+    def __setattr__(self, attribute, value):
+        setattr(self._library, attribute, value)
+
+
+def instrument_library(library):
+    """Devuelve sgfplib instrumentada, salvo con SDK_METRICS=false o si ya lo estaba."""
+    if library is None or isinstance(library, InstrumentedLibrary):
+        return library
+    if os.getenv('SDK_METRICS', 'true').lower() not in ('true', '1', 't'):
+        return library
+    return InstrumentedLibrary(library)
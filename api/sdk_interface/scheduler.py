@@ -0,0 +1,164 @@
+# secugen_api/sdk_interface/scheduler.py
+
+import itertools
+import logging
+import queue
+import threading
+import contextvars
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+from . import tracing
+
+logger = logging.getLogger(__name__)
+
+# Prioridades (menor = antes). Las operaciones rápidas adelantan a las capturas en cola.
+PRIORITY_CONTROL = 0 # initialize/terminate, status, LED
+PRIORITY_MATCH = 10 # verify, verify/batch, identify
+PRIORITY_CAPTURE = 20 # capture, enroll (bloquean hasta que se coloca el dedo)
+PRIORITY_BACKGROUND = 30 # tareas cosméticas (parpadeo de LED al arrancar)
+
+# Timeouts por defecto (segundos) según tipo de comando
+TIMEOUT_CONTROL = 5.0
+TIMEOUT_MATCH = 30.0
+TIMEOUT_CAPTURE = 60.0
+
+
+class CommandTimeout(Exception):
+    """El comando no terminó dentro de su timeout (si seguía en cola, se cancela)."""
+
+
+class CommandCancelled(Exception):
+    """El comando se canceló antes de ejecutarse."""
+
+
+class _Command:
+    __slots__ = ('priority', 'seq', 'name', 'fn', 'args', 'kwargs', 'future', 'deadline', 'context', 'enqueued_at')
+
+    def __init__(self, priority, seq, name, fn, args, kwargs, deadline):
+        self.priority = priority
+        self.seq = seq
+        self.name = name
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.future = Future()
+        self.deadline = deadline
+        # Contexto de quien encola (traza de la petición) para ejecutarlo en el hilo del lector
+        self.context = contextvars.copy_context()
+        self.enqueued_at = time.perf_counter()
+
+    def __lt__(self, other):
+        # FIFO dentro de la misma prioridad
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class DeviceScheduler:
+    """Hilo único propietario del handle SGFPM; el resto de hilos le envían comandos por una cola con prioridad.
+
+    Así las llamadas al SDK nunca se intercalan sobre el mismo handle. Un comando que
+    sigue en cola puede cancelarse (Future.cancel) o caducar por timeout; uno que ya
+    se está ejecutando (p.ej. SGFPM_GetImage esperando el dedo) no puede interrumpirse.
+    """
+
+    def __init__(self, name='sdk-device'):
+        self.name = name
+        self._queue = queue.PriorityQueue()
+        self._seq = itertools.count()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self.current_command = None # Nombre del comando en ejecución (o None)
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def _ensure_started(self):
+        if self._thread and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+            logger.info(f"Hilo del dispositivo '{self.name}' iniciado.")
+
+    def submit(self, fn, *args, priority=PRIORITY_MATCH, timeout=None, name=None, **kwargs):
+        """Encola fn(*args, **kwargs) en el hilo del dispositivo. Devuelve un Future.
+
+        timeout: segundos máximos en cola; si vence antes de empezar, el Future falla con CommandTimeout.
+        """
+        self._ensure_started()
+        deadline = time.monotonic() + timeout if timeout else None
+        command = _Command(priority, next(self._seq), name or getattr(fn, '__name__', 'comando'),
+                           fn, args, kwargs, deadline)
+        self._queue.put(command)
+        return command.future
+
+    def call(self, fn, *args, priority=PRIORITY_MATCH, timeout=None, name=None, **kwargs):
+        """Como submit, pero espera el resultado. Lanza CommandTimeout o CommandCancelled."""
+        if threading.current_thread() is self._thread:
+            return fn(*args, **kwargs) # Llamada anidada desde el propio hilo del dispositivo
+        future = self.submit(fn, *args, priority=priority, timeout=timeout, name=name, **kwargs)
+        return self.wait(future, timeout)
+
+    @staticmethod
+    def wait(future, timeout=None):
+        """Espera un Future del scheduler traduciendo timeouts/cancelaciones."""
+        try:
+            return future.result(timeout)
+        except FutureTimeoutError:
+            if future.cancel():
+                raise CommandTimeout("El comando no llegó a ejecutarse antes del timeout.")
+            raise CommandTimeout("El comando sigue ejecutándose tras el timeout.")
+        except Exception as e:
+            if future.cancelled():
+                raise CommandCancelled("Comando cancelado.") from e
+            raise
+
+    def cancel_pending(self):
+        """Cancela los comandos que siguen en cola (el que está en ejecución termina)."""
+        while True:
+            try:
+                command = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            command.future.cancel()
+
+    def stop(self):
+        """Detiene el hilo tras vaciar la cola (los comandos pendientes se cancelan)."""
+        self.cancel_pending()
+        if self._thread and self._thread.is_alive():
+            self._queue.put(_Command(-1, -1, '__stop__', None, (), {}, None))
+            self._thread.join(timeout=TIMEOUT_CAPTURE)
+
+    def _run(self):
+        while True:
+            command = self._queue.get()
+            if command.fn is None: # Centinela de parada
+                return
+            if not command.future.set_running_or_notify_cancel():
+                continue # Cancelado mientras estaba en cola
+            if command.deadline is not None and time.monotonic() > command.deadline:
+                logger.warning(f"Comando '{command.name}' caducó en cola.")
+                command.future.set_exception(CommandTimeout("El comando caducó en la cola del dispositivo."))
+                continue
+            self.current_command = command.name
+            try:
+                command.future.set_result(command.context.run(self._execute, command))
+            except BaseException as e:
+                logger.error(f"Excepción en comando '{command.name}': {e}", exc_info=True)
+                command.future.set_exception(e)
+            finally:
+                self.current_command = None
+
+    @staticmethod
+    def _execute(command):
+        # Dentro del contexto copiado: espera en cola y ejecución quedan en la traza de la petición
+        tracing.record(f"queue_wait.{command.name}", command.enqueued_at, time.perf_counter())
+        with tracing.span(f"device.{command.name}"):
+            return command.fn(*command.args, **command.kwargs)
+
+
+# Scheduler del lector principal
+device_scheduler = DeviceScheduler()
@@ -0,0 +1,251 @@
+# secugen_api/sdk_interface/simulated.py
+
+"""
+Backend simulado de libpysgfplib.so.
+
+Implementa los mismos puntos de entrada SGFPM_* que usa wrapper.py, sin hardware:
+plantillas deterministas, latencias configurables para GetImage/CreateTemplate/Match
+y códigos de error inyectables. Se activa con SECUGEN_SDK_BACKEND=simulated o con
+wrapper.set_backend(SimulatedSGFPLib(...)).
+"""
+
+import collections
+import ctypes
+import hashlib
+import threading
+import time
+
+SGFDX_ERROR_NONE = 0
+SGFDX_ERROR_FUNCTION_FAILED = 2
+SGFDX_ERROR_INVALID_PARAM = 3
+SGFDX_ERROR_DEVICE_NOT_FOUND = 55
+
+# Cabecera de las plantillas simuladas (identifica el origen en logs/volcados)
+SIM_TEMPLATE_MAGIC = b'SGSIM'
+# Bytes de la plantilla que identifican al dedo (magic + digest)
+SIM_IDENTITY_LEN = len(SIM_TEMPLATE_MAGIC) + 16
+# Puntuaciones simuladas (escala 0-199 de SGFPM_GetMatchingScore): mismo dedo y dedos distintos
+SIM_MATCH_SCORE = 180
+SIM_MAX_NON_MATCH_SCORE = 60
+
+
+def _handle_value(handle):
+    return getattr(handle, 'value', handle)
+
+
+def _deref(arg):
+    """Obtiene el objeto ctypes detrás de byref()/pointer()."""
+    if hasattr(arg, '_obj'):
+        return arg._obj
+    if hasattr(arg, 'contents'):
+        return arg.contents
+    return arg
+
+
+class _EntryPoint:
+    """Callable que imita una función de ctypes.CDLL (admite argtypes/restype)."""
+
+    def __init__(self, name, fn):
+        self.__name__ = name
+        self._fn = fn
+        self.argtypes = None
+        self.restype = None
+
+    def __call__(self, *args):
+        return self._fn(*args)
+
+
+class SimulatedSGFPLib:
+    """Sustituto en memoria de sgfplib con comportamiento determinista."""
+
+    def __init__(self, image_width=260, image_height=300, template_size=400,
+                 get_image_latency=0.0, create_template_latency=0.0, match_latency=0.0,
+                 image_quality=80, led_supported=True, device_count=1):
+        self.image_width = image_width
+        self.image_height = image_height
+        self.template_size = template_size
+        self.get_image_latency = get_image_latency
+        self.create_template_latency = create_template_latency
+        self.match_latency = match_latency
+        self.image_quality = image_quality
+        self.led_supported = led_supported
+        self.device_count = device_count
+        self.finger_id = 0 # Dedo "presente" en el lector para la próxima captura
+        self.calls = collections.Counter()
+
+        self._lock = threading.Lock()
+        self._errors = collections.defaultdict(collections.deque)
+        self._images = {}
+        self._next_handle = 1
+        self._last_quality = 0
+        self._opened = {} # valor del handle -> device_id abierto
+        self._device_list = None # Array devuelto por EnumerateDevice (debe seguir vivo)
+
+        for name in ('SGFPM_Create', 'SGFPM_Init', 'SGFPM_Terminate',
+                     'SGFPM_EnumerateDevice', 'SGFPM_OpenDevice', 'SGFPM_CloseDevice', 'SGFPM_GetDeviceInfo',
+                     'SGFPM_SetLedOn', 'SGFPM_GetImage', 'SGFPM_CreateTemplate',
+                     'SGFPM_GetLastImageQuality', 'SGFPM_GetTemplateSize', 'SGFPM_MatchTemplate',
+                     'SGFPM_GetMatchingScore'):
+            setattr(self, name, _EntryPoint(name, self._instrument(name, getattr(self, '_' + name[6:]))))
+
+    # --- Control de la simulación ---
+
+    def inject_error(self, function_name, error_code, times=1):
+        """Hace que las próximas 'times' llamadas a function_name devuelvan error_code."""
+        with self._lock:
+            self._errors[function_name].extend([error_code] * times)
+
+    def clear_errors(self):
+        with self._lock:
+            self._errors.clear()
+
+    def present_finger(self, finger_id):
+        """Selecciona el dedo que 'verá' la próxima captura (None = lector vacío)."""
+        self.finger_id = finger_id
+
+    def lift_finger(self):
+        """Retira el dedo: las capturas devuelven una imagen en blanco con calidad 0."""
+        self.finger_id = None
+
+    def make_template(self, finger_id):
+        """Devuelve los bytes de la plantilla que produciría finger_id."""
+        return self._template_from_image(self._image_for(finger_id))
+
+    # --- Internos ---
+
+    def _instrument(self, name, fn):
+        def call(*args):
+            self.calls[name] += 1
+            with self._lock:
+                pending = self._errors.get(name)
+                error_code = pending.popleft() if pending else None
+            if error_code is not None:
+                return error_code
+            return fn(*args)
+        return call
+
+    def _image_for(self, finger_id):
+        image = self._images.get(finger_id)
+        if image is None:
+            size = self.image_width * self.image_height
+            digest = hashlib.sha256(f"finger-{finger_id}".encode('ascii')).digest()
+            image = (digest * (size // len(digest) + 1))[:size]
+            self._images[finger_id] = image
+        return image
+
+    def _template_from_image(self, image_bytes):
+        identity = SIM_TEMPLATE_MAGIC + hashlib.md5(image_bytes).digest()
+        filler = hashlib.sha256(identity).digest()
+        body = (filler * (self.template_size // len(filler) + 1))
+        return (identity + body)[:self.template_size]
+
+    # --- Puntos de entrada SGFPM_* ---
+
+    def _Create(self, handle_ref):
+        with self._lock:
+            _deref(handle_ref).value = self._next_handle
+            self._next_handle += 1
+        return SGFDX_ERROR_NONE
+
+    def _Init(self, hFPM, dev_name):
+        return SGFDX_ERROR_NONE
+
+    def _Terminate(self, hFPM):
+        return SGFDX_ERROR_NONE
+
+    def _EnumerateDevice(self, hFPM, ndevs_ref, dev_list_ref):
+        dev_list = _deref(dev_list_ref) # POINTER(SGDeviceList)
+        entries = (type(dev_list)._type_ * max(self.device_count, 1))()
+        for device_id in range(self.device_count):
+            entries[device_id].DevID = device_id
+            entries[device_id].DevName = 0x07
+            for i, byte in enumerate(f"SIM{device_id + 1:012d}".encode('ascii')):
+                entries[device_id].DevSN[i] = byte
+        self._device_list = entries
+        dev_list.contents = entries[0]
+        _deref(ndevs_ref).value = self.device_count
+        return SGFDX_ERROR_NONE
+
+    def _OpenDevice(self, hFPM, device_id):
+        if device_id >= self.device_count:
+            return SGFDX_ERROR_DEVICE_NOT_FOUND
+        self._opened[_handle_value(hFPM)] = device_id
+        return SGFDX_ERROR_NONE
+
+    def _CloseDevice(self, hFPM):
+        self._opened.pop(_handle_value(hFPM), None)
+        return SGFDX_ERROR_NONE
+
+    def _GetDeviceInfo(self, hFPM, info_ref):
+        info = _deref(info_ref)
+        device_id = self._opened.get(_handle_value(hFPM), 0)
+        info.DeviceID = device_id
+        serial = f"SIM{device_id + 1:012d}".encode('ascii')
+        for i, byte in enumerate(serial[:len(info.DeviceSN) - 1]):
+            info.DeviceSN[i] = byte
+        info.ImageWidth = self.image_width
+        info.ImageHeight = self.image_height
+        info.ImageDPI = 500
+        info.FWVersion = 0x0100
+        return SGFDX_ERROR_NONE
+
+    def _SetLedOn(self, hFPM, on):
+        return SGFDX_ERROR_NONE if self.led_supported else SGFDX_ERROR_FUNCTION_FAILED
+
+    def _GetImage(self, hFPM, image_buffer):
+        if self.get_image_latency:
+            time.sleep(self.get_image_latency)
+        finger_id = self.finger_id
+        if finger_id is None:
+            # Sin dedo: sensor en blanco, calidad 0
+            ctypes.memset(image_buffer, 0xFF, self.image_width * self.image_height)
+            self._last_quality = 0
+            return SGFDX_ERROR_NONE
+        image = self._image_for(finger_id)
+        ctypes.memmove(image_buffer, image, len(image))
+        self._last_quality = self.image_quality
+        return SGFDX_ERROR_NONE
+
+    def _GetLastImageQuality(self, hFPM, quality_ref):
+        _deref(quality_ref).value = self._last_quality
+        return SGFDX_ERROR_NONE
+
+    def _CreateTemplate(self, hFPM, finger_info_ref, image_buffer, template_buffer):
+        if self.create_template_latency:
+            time.sleep(self.create_template_latency)
+        image = ctypes.string_at(image_buffer, self.image_width * self.image_height)
+        template = self._template_from_image(image)
+        ctypes.memmove(template_buffer, template, len(template))
+        return SGFDX_ERROR_NONE
+
+    def _GetTemplateSize(self, hFPM, template_buffer, size_ref):
+        if not ctypes.string_at(template_buffer, len(SIM_TEMPLATE_MAGIC)) == SIM_TEMPLATE_MAGIC:
+            return SGFDX_ERROR_INVALID_PARAM
+        _deref(size_ref).value = self.template_size
+        return SGFDX_ERROR_NONE
+
+    def _MatchTemplate(self, hFPM, template1, template2, security_level, result_ref):
+        if self.match_latency:
+            time.sleep(self.match_latency)
+        identity1 = ctypes.string_at(template1, SIM_IDENTITY_LEN)
+        identity2 = ctypes.string_at(template2, SIM_IDENTITY_LEN)
+        if not identity1.startswith(SIM_TEMPLATE_MAGIC) or not identity2.startswith(SIM_TEMPLATE_MAGIC):
+            return SGFDX_ERROR_INVALID_PARAM
+        _deref(result_ref).value = identity1 == identity2
+        return SGFDX_ERROR_NONE
+
+    def _GetMatchingScore(self, hFPM, template1, template2, score_ref):
+        if self.match_latency:
+            time.sleep(self.match_latency)
+        identity1 = ctypes.string_at(template1, SIM_IDENTITY_LEN)
+        identity2 = ctypes.string_at(template2, SIM_IDENTITY_LEN)
+        if not identity1.startswith(SIM_TEMPLATE_MAGIC) or not identity2.startswith(SIM_TEMPLATE_MAGIC):
+            return SGFDX_ERROR_INVALID_PARAM
+        if identity1 == identity2:
+            score = SIM_MATCH_SCORE
+        else:
+            # Dedos distintos: puntuación baja, determinista y simétrica
+            pair = b''.join(sorted((identity1, identity2)))
+            score = hashlib.md5(pair).digest()[0] % (SIM_MAX_NON_MATCH_SCORE + 1)
+        _deref(score_ref).value = score
+        return SGFDX_ERROR_NONE
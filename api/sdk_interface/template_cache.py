@@ -0,0 +1,84 @@
+# secugen_api/sdk_interface/template_cache.py
+
+import collections
+import ctypes
+import hashlib
+import threading
+
+
+class TemplateBufferCache:
+    """Caché LRU acotada: digest de la plantilla (Base64) -> buffer ctypes listo para el SDK.
+
+    La clave se calcula sobre el texto Base64, de modo que un acierto evita tanto la
+    decodificación como la creación del buffer. Se limita por número de entradas y
+    por bytes totales; lleva contadores de aciertos, fallos y desalojos.
+    """
+
+    def __init__(self, max_entries=4096, max_bytes=16 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict() # digest -> buffer
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def digest(template):
+        """Digest de 16 bytes del contenido (str Base64 o bytes). El tipo forma parte de la clave:
+        unos bytes binarios iguales al texto de una plantilla Base64 no dan su buffer."""
+        if isinstance(template, str):
+            # Texto exacto (sin sustituir caracteres): uno no ASCII no debe coincidir con otra entrada
+            hasher = hashlib.blake2b(b's', digest_size=16)
+            hasher.update(template.encode('utf-8', errors='surrogatepass'))
+        else:
+            hasher = hashlib.blake2b(b'b', digest_size=16)
+            hasher.update(template) # TypeError si no es bytes-like
+        return hasher.digest()
+
+    def get_or_decode(self, template, decoder):
+        """Devuelve el buffer cacheado o lo crea con decoder(template). None si no decodifica."""
+        key = self.digest(template)
+        with self._lock:
+            buffer = self._entries.get(key)
+            if buffer is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return buffer
+            self.misses += 1
+
+        buffer = decoder(template) # Fuera del lock: la decodificación es la parte cara
+        if buffer is None:
+            return None # Las plantillas inválidas no se cachean
+
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = buffer
+                self._bytes += ctypes.sizeof(buffer)
+                self._evict_locked()
+        return buffer
+
+    def _evict_locked(self):
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= ctypes.sizeof(evicted)
+            self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
@@ -0,0 +1,181 @@
+# secugen_api/sdk_interface/tracing.py
+
+"""
+Trazas por etapas (spans) para perfilar capturas y enrolamientos lentos.
+
+Cada petición (o trabajo asíncrono) puede abrir una traza; dentro, span('nombre')
+mide una etapa. La traza viaja en un contextvar, y el DeviceScheduler copia el
+contexto al encolar, así que las etapas que corren en el hilo del lector se anotan
+en la traza de la petición que las pidió. Las llamadas SGFPM_* instrumentadas
+(ver metrics.py) se anotan solas.
+
+Al cerrar la traza se escribe un log JSON por span con campos al estilo
+OpenTelemetry (trace_id, span_id, parent_span_id, start/end en ns Unix) en el
+logger 'secugen.trace', y se puede resumir como cabecera Server-Timing.
+"""
+
+import json
+import logging
+import os
+import re
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+logger = logging.getLogger('secugen.trace')
+
+# Spans guardados por traza; el resto solo suma en los totales de Server-Timing
+MAX_SPANS_PER_TRACE = int(os.getenv('TRACE_MAX_SPANS', 500))
+
+_current_trace = ContextVar('secugen_trace', default=None)
+_current_span_id = ContextVar('secugen_span_id', default=None)
+
+
+def _new_id(nbytes):
+    return secrets.token_hex(nbytes)
+
+
+class Trace:
+    """Spans de una petición. Thread-safe: el hilo del lector añade spans a la vez que el de la petición."""
+
+    def __init__(self, name, attributes=None):
+        self.name = name
+        self.trace_id = _new_id(16)
+        self.root_span_id = _new_id(8)
+        self.attributes = dict(attributes or {})
+        self._epoch_ns = time.time_ns()
+        self._epoch_perf = time.perf_counter()
+        self.start = self._epoch_perf
+        self.end = None
+        self.spans = []
+        self.totals = {} # nombre -> [llamadas, segundos]
+        self.dropped = 0
+        self._lock = threading.Lock()
+
+    def _unix_ns(self, perf):
+        return self._epoch_ns + int((perf - self._epoch_perf) * 1e9)
+
+    def add(self, name, start, end, parent_span_id=None, attributes=None, span_id=None, error=None):
+        with self._lock:
+            total = self.totals.setdefault(name, [0, 0.0])
+            total[0] += 1
+            total[1] += end - start
+            if len(self.spans) >= MAX_SPANS_PER_TRACE:
+                self.dropped += 1
+                return span_id
+            span_id = span_id or _new_id(8)
+            self.spans.append({
+                "trace_id": self.trace_id,
+                "span_id": span_id,
+                "parent_span_id": parent_span_id or self.root_span_id,
+                "name": name,
+                "start_time_unix_nano": self._unix_ns(start),
+                "end_time_unix_nano": self._unix_ns(end),
+                "duration_ms": round((end - start) * 1000.0, 3),
+                "attributes": attributes or {},
+                "status": "ERROR" if error else "OK",
+                **({"error": error} if error else {}),
+            })
+        return span_id
+
+    def finish(self, **attributes):
+        self.end = time.perf_counter()
+        self.attributes.update(attributes)
+
+    def root_span(self):
+        end = self.end if self.end is not None else time.perf_counter()
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.root_span_id,
+            "parent_span_id": None,
+            "name": self.name,
+            "start_time_unix_nano": self._unix_ns(self.start),
+            "end_time_unix_nano": self._unix_ns(end),
+            "duration_ms": round((end - self.start) * 1000.0, 3),
+            "attributes": {**self.attributes, "dropped_spans": self.dropped},
+            "status": "OK",
+        }
+
+    def server_timing(self):
+        """Valor de la cabecera Server-Timing: una entrada por etapa (duración sumada, nº de llamadas)."""
+        with self._lock:
+            totals = list(self.totals.items())
+        entries = []
+        for name, (count, seconds) in totals:
+            token = re.sub(r'[^A-Za-z0-9_.\-]', '_', name)
+            entry = f"{token};dur={seconds * 1000.0:.3f}"
+            if count > 1:
+                entry += f';desc="x{count}"'
+            entries.append(entry)
+        if self.end is not None:
+            entries.append(f"total;dur={(self.end - self.start) * 1000.0:.3f}")
+        return ', '.join(entries)
+
+    def log(self):
+        """Escribe la traza como un log JSON por span (raíz primero)."""
+        if not logger.isEnabledFor(logging.INFO):
+            return
+        logger.info(json.dumps(self.root_span(), default=str))
+        with self._lock:
+            spans = list(self.spans)
+        for span_data in spans:
+            logger.info(json.dumps(span_data, default=str))
+
+
+def tracing_enabled():
+    """TRACE_REQUESTS=true traza todas las peticiones (si no, solo las que lo piden)."""
+    return os.getenv('TRACE_REQUESTS', 'false').lower() in ('true', '1', 't')
+
+
+def start_trace(name, **attributes):
+    """Abre una traza en el contexto actual. Devuelve (traza, tokens) para end_trace."""
+    trace = Trace(name, attributes)
+    return trace, (_current_trace.set(trace), _current_span_id.set(None))
+
+
+def end_trace(tokens, **attributes):
+    """Cierra la traza abierta con start_trace y restaura el contexto. Devuelve la traza."""
+    trace = _current_trace.get()
+    trace_token, span_token = tokens
+    _current_span_id.reset(span_token)
+    _current_trace.reset(trace_token)
+    if trace is not None:
+        if trace.end is None:
+            trace.finish()
+        trace.attributes.update(attributes)
+    return trace
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+@contextmanager
+def span(name, **attributes):
+    """Mide la etapa 'name' dentro de la traza actual (sin traza activa no hace nada)."""
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    parent = _current_span_id.get()
+    span_id = _new_id(8)
+    token = _current_span_id.set(span_id)
+    start = time.perf_counter()
+    error = None
+    try:
+        yield
+    except BaseException as e:
+        error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _current_span_id.reset(token)
+        trace.add(name, start, time.perf_counter(), parent, attributes, span_id=span_id, error=error)
+
+
+def record(name, start, end, **attributes):
+    """Anota una etapa ya medida (perf_counter) en la traza actual, si la hay."""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(name, start, end, _current_span_id.get(), attributes)
@@ -6,7 +6,13 @@ import time
 import logging
 import os
 import base64
-import binascii
+import heapq
+from collections import namedtuple
+
+from .template_cache import TemplateBufferCache
+from .metrics import instrument_library, registry
+from . import image_analysis
+from .tracing import span
 
 # Configurar logger
 logger = logging.getLogger(__name__)
@@ -23,7 +29,13 @@ SG_DEV_AUTO = 0xFF
 SG_DEV_FDU06 = 0x07 # UPx (Hamster Pro - PID 2201)
 
 # Security Levels
+SL_LOWEST = 1
 SL_NORMAL = 5
+SL_HIGHEST = 9
+
+# Puntuación mínima de SGFPM_GetMatchingScore (0-199) que equivale a cada nivel de seguridad
+# (tabla aproximada de SecuGen: SGFPM_MatchTemplate acepta a partir de ese valor)
+MATCH_SCORE_THRESHOLDS = {1: 30, 2: 40, 3: 50, 4: 60, 5: 70, 6: 80, 7: 90, 8: 100, 9: 120}
 
 # Template Formats (Default: SG400 = 0x0200)
 # TEMPLATE_FORMAT_SG400 = 0x0200
@@ -35,19 +47,30 @@ SG_IMPTYPE_LP = 0x00 # Live-scan Plain
 # Otros
 SGDEV_SN_LEN = 15
 DEFAULT_TEMPLATE_SIZE = 2000 # ¡Ajustar si se usa otro formato o se sabe el tamaño!
+SG400_TEMPLATE_SIZE = 400 # Tamaño de respaldo si SGFPM_GetTemplateSize falla
 DEFAULT_IMAGE_WIDTH = 260 # Para UPx/FDU06
 DEFAULT_IMAGE_HEIGHT = 300 # Para UPx/FDU06
 
 
 # --- Variables Globales de Estado ---
 sgfplib = None
-hFPM = None # Handle principal del SDK
-sdk_initialized = False
-device_opened = False
-# lock = threading.Lock() # Añadir si se necesita concurrencia
+_session = None # DeviceSession principal (primer lector abierto; la usa también el matching)
+_sessions = {} # device_id -> DeviceSession de cada lector abierto
+_matcher = None # DeviceSession sin lector (solo Create/Init) del modo solo matching
+# Caché compartida de plantillas decodificadas (verify, verify_batch, identify)
+template_cache = TemplateBufferCache(
+    max_entries=int(os.getenv('TEMPLATE_CACHE_MAX_ENTRIES', 4096)),
+    max_bytes=int(os.getenv('TEMPLATE_CACHE_MAX_BYTES', 16 * 1024 * 1024)))
+# Concurrencia: las llamadas al SDK se serializan en el hilo de DeviceScheduler (scheduler.py)
 
 # Nombre de la librería
 LIB_NAME_LINUX = "libpysgfplib.so"
+# Backend del SDK: "native" (libpysgfplib.so) o "simulated" (sin hardware, ver simulated.py)
+SDK_BACKEND = os.getenv('SECUGEN_SDK_BACKEND', 'native').lower()
+# Modo: "full" (abre los lectores) o "matching" (solo compara plantillas, sin lector USB)
+SDK_MODE_FULL = "full"
+SDK_MODE_MATCHING = "matching"
+_sdk_mode = os.getenv('SDK_MODE', SDK_MODE_FULL).lower()
 
 # --- Estructuras ctypes ---
 
@@ -64,6 +87,12 @@ class SGDeviceInfoParam(ctypes.Structure):
                 ("ImageDPI", ctypes.c_ulong),
                 ("FWVersion", ctypes.c_ulong)]
 
+class SGDeviceList(ctypes.Structure):
+    _fields_ = [("DevName", ctypes.c_ulong),
+                ("DevID", ctypes.c_ulong),
+                ("DevType", ctypes.c_uint16),
+                ("DevSN", ctypes.c_ubyte * (SGDEV_SN_LEN + 1))]
+
 class SGFingerInfo(ctypes.Structure):
      _fields_ = [("FingerNumber", ctypes.c_uint16),
                  ("ViewNumber", ctypes.c_uint16),
@@ -78,8 +107,13 @@ def _load_library():
     global sgfplib
     if sgfplib: return True
     try:
-        if platform.system() == "Linux":
-            sgfplib = ctypes.CDLL(LIB_NAME_LINUX)
+        if SDK_BACKEND == "simulated":
+            from .simulated import SimulatedSGFPLib
+            sgfplib = instrument_library(SimulatedSGFPLib())
+            logger.warning("Usando backend SDK SIMULADO (sin lector físico).")
+            return True
+        elif platform.system() == "Linux":
+            sgfplib = instrument_library(ctypes.CDLL(LIB_NAME_LINUX)) # Latencia/códigos por llamada para /metrics
             logger.info(f"Librería SDK '{LIB_NAME_LINUX}' cargada.")
             return True
         else:
@@ -110,8 +144,16 @@ def _define_signatures():
         sgfplib.SGFPM_GetImage.argtypes = [ctypes.c_void_p, ctypes.c_void_p]; sgfplib.SGFPM_GetImage.restype = ctypes.c_ulong
         sgfplib.SGFPM_CreateTemplate.argtypes = [ctypes.c_void_p, ctypes.POINTER(SGFingerInfo), ctypes.c_void_p, ctypes.c_void_p]; sgfplib.SGFPM_CreateTemplate.restype = ctypes.c_ulong
         sgfplib.SGFPM_GetLastImageQuality.argtypes = [ctypes.c_void_p, ctypes.POINTER(ctypes.c_ulong)]; sgfplib.SGFPM_GetLastImageQuality.restype = ctypes.c_ulong
+        sgfplib.SGFPM_GetTemplateSize.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.POINTER(ctypes.c_ulong)]; sgfplib.SGFPM_GetTemplateSize.restype = ctypes.c_ulong
         # Matching
         sgfplib.SGFPM_MatchTemplate.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_void_p, ctypes.c_ulong, ctypes.POINTER(ctypes.c_bool)]; sgfplib.SGFPM_MatchTemplate.restype = ctypes.c_ulong
+        # Puntuación (opcional: sin ella no hay búsqueda top-k, el resto funciona igual)
+        if hasattr(sgfplib, 'SGFPM_GetMatchingScore'):
+            sgfplib.SGFPM_GetMatchingScore.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_void_p, ctypes.POINTER(ctypes.c_ulong)]; sgfplib.SGFPM_GetMatchingScore.restype = ctypes.c_ulong
+
+        # Enumeración (opcional: si la librería no la exporta se abre solo el dispositivo 0)
+        if hasattr(sgfplib, 'SGFPM_EnumerateDevice'):
+            sgfplib.SGFPM_EnumerateDevice.argtypes = [ctypes.c_void_p, ctypes.POINTER(ctypes.c_ulong), ctypes.POINTER(ctypes.POINTER(SGDeviceList))]; sgfplib.SGFPM_EnumerateDevice.restype = ctypes.c_ulong
 
         logger.info("Firmas de funciones SDK definidas.")
         return True
@@ -126,127 +168,345 @@ def _check_error(error_code, function_name="Función SDK"):
     if error_code == SGFDX_ERROR_NONE: return True
     else: logger.error(f"{function_name}: Falló (Código={error_code})"); return False
 
-# --- Funciones Públicas del Wrapper ---
+# --- Sesión de Dispositivo ---
+
+class DeviceSession:
+    """Lector abierto: handle SGFPM, geometría leída una sola vez y buffers reutilizables.
+
+    La geometría se obtiene con SGFPM_GetDeviceInfo al abrir el dispositivo, y los
+    buffers de imagen/plantilla y el SGFingerInfo se reservan entonces, de modo que
+    cada captura no hace llamadas USB extra ni reservas de memoria.
+    """
+
+    def __init__(self, device_id=0):
+        self.device_id = device_id
+        self.handle = None # ctypes.c_void_p devuelto por SGFPM_Create
+        self.sdk_initialized = False
+        self.device_opened = False
+        self.image_width = 0
+        self.image_height = 0
+        self.image_buffer = None
+        self.image_view = None # ndarray sobre image_buffer (sin copia) si NumPy está instalado
+        self.best_image_buffer = None # Mejor imagen hasta ahora en una captura con varios intentos
+        self.template_buffer = None
+        self.finger_info = SGFingerInfo()
+        self.quality = ctypes.c_ulong(0)
+        self.template_size = ctypes.c_ulong(0)
+
+    @property
+    def ready(self):
+        """True si el SDK está inicializado y el dispositivo abierto."""
+        return bool(self.sdk_initialized and self.device_opened and self.handle and self.handle.value)
+
+    @property
+    def matcher_ready(self):
+        """True si el handle puede comparar plantillas (SGFPM_MatchTemplate no necesita lector)."""
+        return bool(self.sdk_initialized and self.handle and self.handle.value)
+
+    def open(self, open_device=True):
+        """Crea el handle, inicializa el SDK, abre el dispositivo y cachea geometría/buffers.
+        Con open_device=False se queda en Create/Init (sesión solo de matching)."""
+        if not self.handle:
+            temp_handle = ctypes.c_void_p()
+            error_code = sgfplib.SGFPM_Create(ctypes.byref(temp_handle))
+            if not _check_error(error_code, "SGFPM_Create") or not temp_handle.value:
+                logger.critical("Fallo CRÍTICO al crear objeto SDK.")
+                self.handle = None
+                return False
+            self.handle = temp_handle
+            logger.info(f"Objeto SDK creado con handle: {self.handle.value}")
+
+        if not self.sdk_initialized:
+            error_code = sgfplib.SGFPM_Init(self.handle, SG_DEV_FDU06) # Usar el tipo UPx
+            if not _check_error(error_code, "SGFPM_Init"):
+                self.close() # Intentar limpiar si Init falla
+                return False
+            self.sdk_initialized = True
+            logger.info("SDK inicializado.")
+
+        if open_device and not self.device_opened:
+            error_code = sgfplib.SGFPM_OpenDevice(self.handle, self.device_id)
+            if not _check_error(error_code, "SGFPM_OpenDevice"):
+                self.close() # Intentar limpiar si Open falla
+                return False
+            self.device_opened = True
+            logger.info(f"Dispositivo {self.device_id} abierto.")
+            if not self._load_geometry():
+                self.close()
+                return False
+        return True
 
-def initialize_sdk():
-    """Inicializa el SDK y abre el dispositivo. Devuelve True/False."""
-    # global lock # Descomentar si se usa
-    global sgfplib, hFPM, sdk_initialized, device_opened
-    # with lock: # Descomentar si se usa
-    if sdk_initialized and device_opened:
-        logger.info("SDK ya inicializado y dispositivo abierto.")
+    def _load_geometry(self):
+        """Lee ancho/alto una vez y reserva los buffers de captura."""
+        device_info = SGDeviceInfoParam()
+        error_code = sgfplib.SGFPM_GetDeviceInfo(self.handle, ctypes.byref(device_info))
+        if not _check_error(error_code, "SGFPM_GetDeviceInfo"):
+            return False
+        width, height = device_info.ImageWidth, device_info.ImageHeight
+        if width == 0 or height == 0:
+            logger.error("No se pudieron obtener dimensiones válidas del dispositivo.")
+            return False
+        self.image_width, self.image_height = width, height
+        self.image_buffer = ctypes.create_string_buffer(width * height)
+        self.image_view = image_analysis.image_view(self.image_buffer, width, height)
+        self.best_image_buffer = ctypes.create_string_buffer(width * height)
+        self.template_buffer = ctypes.create_string_buffer(DEFAULT_TEMPLATE_SIZE)
+        logger.info(f"Geometría del dispositivo cacheada: {width}x{height}.")
         return True
 
+    def close(self):
+        """Cierra el dispositivo y termina el SDK. Devuelve True si todo se cerró bien."""
+        closed_properly = True
+        if self.device_opened and self.handle and self.handle.value and sgfplib:
+            logger.info("Cerrando dispositivo...")
+            error_code = sgfplib.SGFPM_CloseDevice(self.handle)
+            if not _check_error(error_code, "SGFPM_CloseDevice"):
+                 closed_properly = False
+        self.device_opened = False # Marcar como cerrado incluso si falla
+
+        if self.handle and self.handle.value and sgfplib: # Terminar si el handle se creó
+            logger.info("Terminando SDK...")
+            error_code = sgfplib.SGFPM_Terminate(self.handle)
+            if not _check_error(error_code, "SGFPM_Terminate"):
+                closed_properly = False
+        self.sdk_initialized = False
+        self.handle = None
+        self.image_buffer = None
+        self.image_view = None
+        self.best_image_buffer = None
+        self.template_buffer = None
+        return closed_properly
+
+# --- Funciones Públicas del Wrapper ---
+
+def set_backend(library):
+    """Sustituye la librería SDK (p.ej. por SimulatedSGFPLib). Usar con el SDK terminado."""
+    global sgfplib
+    if _sessions or _matcher:
+        logger.error("No se puede cambiar el backend con el SDK inicializado.")
+        return False
+    sgfplib = instrument_library(library)
+    logger.info(f"Backend SDK reemplazado por {type(library).__name__}.")
+    return True
+
+def get_session(device_id=None):
+    """Devuelve la DeviceSession principal (o la del lector device_id), o None."""
+    if device_id is None:
+        return _session
+    return _sessions.get(device_id)
+
+def get_sessions():
+    """Devuelve {device_id: DeviceSession} de todos los lectores abiertos."""
+    return dict(_sessions)
+
+def enumerate_devices():
+    """Lista los lectores conectados con SGFPM_EnumerateDevice. Devuelve lista de dicts o None si no se puede."""
+    if not _load_library(): return None
+    if not _define_signatures(): return None
+    if not hasattr(sgfplib, 'SGFPM_EnumerateDevice'):
+        logger.warning("SGFPM_EnumerateDevice no disponible en la librería.")
+        return None
+
+    # Handle temporal: la enumeración necesita Create + Init, pero no abrir dispositivo
+    temp_handle = ctypes.c_void_p()
+    if not _check_error(sgfplib.SGFPM_Create(ctypes.byref(temp_handle)), "SGFPM_Create") or not temp_handle.value:
+        return None
+    try:
+        if not _check_error(sgfplib.SGFPM_Init(temp_handle, SG_DEV_FDU06), "SGFPM_Init"):
+            return None
+        ndevs = ctypes.c_ulong(0)
+        dev_list = ctypes.POINTER(SGDeviceList)()
+        error_code = sgfplib.SGFPM_EnumerateDevice(temp_handle, ctypes.byref(ndevs), ctypes.byref(dev_list))
+        if not _check_error(error_code, "SGFPM_EnumerateDevice"):
+            return None
+        devices = []
+        for i in range(ndevs.value):
+            entry = dev_list[i]
+            serial_number = bytes(entry.DevSN).partition(b'\0')[0].decode('ascii', errors='ignore')
+            devices.append({"device_id": entry.DevID, "device_name": entry.DevName, "serial_number": serial_number})
+        logger.info(f"Lectores encontrados: {len(devices)}.")
+        return devices
+    finally:
+        sgfplib.SGFPM_Terminate(temp_handle)
+
+def configured_device_ids():
+    """IDs a abrir: SECUGEN_DEVICE_IDS="0,1" si está definida; si no, los enumerados; si falla, [0]."""
+    env_ids = os.getenv('SECUGEN_DEVICE_IDS')
+    if env_ids:
+        return [int(device_id) for device_id in env_ids.split(',') if device_id.strip()]
+    devices = enumerate_devices()
+    return [device["device_id"] for device in devices] if devices else [0]
+
+def is_ready():
+    """True si el SDK está inicializado y el dispositivo abierto."""
+    return _session is not None and _session.ready
+
+def set_sdk_mode(mode):
+    """Cambia el modo (SDK_MODE_FULL o SDK_MODE_MATCHING). Usar con el SDK terminado."""
+    global _sdk_mode
+    mode = (mode or SDK_MODE_FULL).lower()
+    if mode not in (SDK_MODE_FULL, SDK_MODE_MATCHING):
+        logger.error(f"Modo SDK desconocido: '{mode}'.")
+        return False
+    if (_sessions or _matcher) and mode != _sdk_mode:
+        logger.error("No se puede cambiar el modo con el SDK inicializado.")
+        return False
+    _sdk_mode = mode
+    return True
+
+def get_sdk_mode():
+    return _sdk_mode
+
+def is_matching_only():
+    """True en el modo solo matching (servidor sin lector)."""
+    return _sdk_mode == SDK_MODE_MATCHING
+
+def get_matcher():
+    """Sesión con la que se comparan plantillas: la del lector principal o, sin lector, la de matching."""
+    if _session is not None and _session.matcher_ready:
+        return _session
+    if _matcher is not None and _matcher.matcher_ready:
+        return _matcher
+    return None
+
+def is_matcher_ready():
+    """True si se pueden comparar plantillas (con o sin lector abierto)."""
+    return get_matcher() is not None
+
+def is_serving():
+    """Listo para el modo configurado: lector abierto (full) o handle de matching (matching)."""
+    return is_matcher_ready() if is_matching_only() else is_ready()
+
+def initialize_matcher():
+    """Crea un handle SGFPM con Create/Init, sin abrir ningún lector. Devuelve True/False."""
+    global _matcher
+    if _matcher is not None and _matcher.matcher_ready:
+        logger.info("SDK de matching ya inicializado.")
+        return True
     if not _load_library(): return False
     if not _define_signatures(): return False
+    session = DeviceSession(device_id=None)
+    if not session.open(open_device=False):
+        logger.error("No se pudo inicializar el SDK en modo solo matching.")
+        return False
+    _matcher = session
+    logger.info("SDK inicializado en modo solo matching (sin lector).")
+    return True
+
+def blink_led(session=None, cycles=3):
+    """Parpadeo de LED al abrir el dispositivo (PUEDE FALLAR, no es crítico). Tarda ~0.5 s por ciclo."""
+    session = session or _session
+    logger.info(f"Intentando parpadeo de LED ({cycles} veces)...")
+    blink_attempts_ok = True # Flag para saber si hubo error *durante* el parpadeo
+    for i in range(cycles):
+        logger.debug(f"Parpadeo {i+1}/{cycles}: Encendiendo...")
+        # Encender (Usamos la función wrapper set_led que ya maneja el error 2)
+        if not set_led(True, session):
+            blink_attempts_ok = False
+            logger.warning(f"Parpadeo {i+1}/{cycles}: Fallo al ENCENDER LED.")
+        else:
+            time.sleep(0.2) # LED encendido por 0.2 segundos (solo si funcionó)
 
-    # Crear handle si no existe
-    if not hFPM:
-        temp_hFPM = ctypes.c_void_p()
-        error_code = sgfplib.SGFPM_Create(ctypes.byref(temp_hFPM))
-        if not _check_error(error_code, "SGFPM_Create") or not temp_hFPM.value:
-            logger.critical("Fallo CRÍTICO al crear objeto SDK.")
-            hFPM = None
-            return False
-        hFPM = temp_hFPM
-        logger.info(f"Objeto SDK creado con handle: {hFPM.value}")
-
-    # Inicializar SDK si no está inicializado
-    if not sdk_initialized:
-        error_code = sgfplib.SGFPM_Init(hFPM, SG_DEV_FDU06) # Usar el tipo UPx
-        if not _check_error(error_code, "SGFPM_Init"):
-            terminate_sdk() # Intentar limpiar si Init falla
-            return False
-        sdk_initialized = True
-        logger.info("SDK inicializado.")
-
-    # Abrir dispositivo si no está abierto
-    if not device_opened:
-        error_code = sgfplib.SGFPM_OpenDevice(hFPM, 0) # Abrir dispositivo ID 0
-        open_success = _check_error(error_code, "SGFPM_OpenDevice") # Guarda el resultado de la verificación
-        if not open_success:
-            terminate_sdk() # Intentar limpiar si Open falla
-            return False
-        # --- INICIO: Bloque de Parpadeo Añadido ---
-        else: # Si open_success es True
-            device_opened = True # Marcar como abierto AHORA
-            logger.info("Dispositivo abierto.")
-
-            # --- Intento de Parpadeo (PUEDE FALLAR) ---
-            logger.info("Intentando parpadeo de LED (3 veces)...")
-            blink_attempts_ok = True # Flag para saber si hubo error *durante* el parpadeo
-            for i in range(3): # Repetir 3 veces
-                logger.debug(f"Parpadeo {i+1}/3: Encendiendo...")
-                # Encender (Usamos la función wrapper set_led que ya maneja el error 2)
-                if not set_led(True):
-                    blink_attempts_ok = False
-                    # No es necesario 'break', podemos intentar apagar de todos modos
-                    # o simplemente registrar que falló el ON
-                    logger.warning(f"Parpadeo {i+1}/3: Fallo al ENCENDER LED.")
-                else:
-                    time.sleep(0.2) # LED encendido por 0.2 segundos (solo si funcionó)
-
-                logger.debug(f"Parpadeo {i+1}/3: Apagando...")
-                # Apagar
-                if not set_led(False):
-                    blink_attempts_ok = False
-                    logger.warning(f"Parpadeo {i+1}/3: Fallo al APAGAR LED.")
-                else:
-                     # Solo esperamos si el apagado funcionó, sino pasamos al siguiente ciclo
-                     time.sleep(0.2) # LED apagado por 0.2 segundos
-
-                # Pequeña pausa entre ciclos completos si ambos funcionaron
-                if blink_attempts_ok:
-                    time.sleep(0.1)
-
-
-            if blink_attempts_ok:
-                 logger.info("Secuencia de parpadeo completada (intentada sin errores fatales devueltos por set_led).")
-            else:
-                 logger.warning("La secuencia de parpadeo falló en algún punto (ver logs). La inicialización del SDK continúa.")
-            # -------------------------------------------
-         # --- FIN: Bloque de Parpadeo Añadido ---
+        logger.debug(f"Parpadeo {i+1}/{cycles}: Apagando...")
+        if not set_led(False, session):
+            blink_attempts_ok = False
+            logger.warning(f"Parpadeo {i+1}/{cycles}: Fallo al APAGAR LED.")
+        else:
+             # Solo esperamos si el apagado funcionó, sino pasamos al siguiente ciclo
+             time.sleep(0.2) # LED apagado por 0.2 segundos
+
+        # Pequeña pausa entre ciclos completos si ambos funcionaron
+        if blink_attempts_ok:
+            time.sleep(0.1)
+
+    if blink_attempts_ok:
+         logger.info("Secuencia de parpadeo completada (intentada sin errores fatales devueltos por set_led).")
+    else:
+         logger.warning("La secuencia de parpadeo falló en algún punto (ver logs). La inicialización del SDK continúa.")
+    return blink_attempts_ok
+
+def initialize_sdk(device_ids=None, blink=True):
+    """Inicializa el SDK y abre los lectores (todos los conectados por defecto). Devuelve True/False.
+
+    Basta con que se abra uno; el primero abierto pasa a ser la sesión principal.
+    Todos se abren en el hilo que llama: con varios lectores, cada uno con su hilo,
+    usar DevicePool.open_devices.
+    blink=False omite el parpadeo de LED (~1.5 s por lector) para que el llamador
+    lo programe fuera del camino crítico (ver api/warmup.py).
+    En modo solo matching (SDK_MODE=matching) no abre lectores: ver initialize_matcher.
+    """
+    if is_matching_only():
+        return initialize_matcher()
+    if is_ready():
+        logger.info("SDK ya inicializado y dispositivo abierto.")
+        return True
+    if not load_sdk():
+        return False
+
+    if device_ids is None:
+        device_ids = configured_device_ids()
+    for device_id in device_ids:
+        open_device(device_id, blink)
 
+    if _session is None:
+        return False
+    logger.info(f"Lectores abiertos: {list(_sessions)} (principal: {_session.device_id}).")
     # La inicialización general se considera exitosa si llegamos aquí
-    logger.info("Inicialización del SDK completada (incluyendo intento de parpadeo).")
+    logger.info(f"Inicialización del SDK completada ({'incluyendo' if blink else 'sin'} intento de parpadeo).")
     return True # Devolver True indica que Init y Open funcionaron
 
+def load_sdk():
+    """Carga la librería y define las firmas (sin abrir lectores). Devuelve True/False."""
+    return _load_library() and _define_signatures()
+
+def open_device(device_id, blink=True):
+    """Abre el lector device_id y lo registra; si no hay sesión principal, pasa a serlo.
+    Llamar desde el hilo que va a usar ese lector. Devuelve True/False."""
+    global _session
+    session = _sessions.get(device_id) or DeviceSession(device_id=device_id)
+    if not session.open():
+        logger.error(f"No se pudo abrir el lector {device_id}.")
+        _sessions.pop(device_id, None)
+        return False
+    _sessions[device_id] = session
+    if _session is None:
+        _session = session
+    if blink:
+        blink_led(session)
+    return True
+
+def close_device(device_id):
+    """Cierra el lector device_id (desde su hilo) y lo retira de las sesiones. Devuelve True si cerró bien."""
+    global _session
+    session = _sessions.pop(device_id, None)
+    if session is None:
+        return True
+    if session is _session:
+        _session = None
+    return session.close()
+
 def terminate_sdk():
-    """Cierra el dispositivo y termina el SDK."""
-    # global lock # Descomentar si se usa
-    global sgfplib, hFPM, sdk_initialized, device_opened
-    # with lock: # Descomentar si se usa
+    """Cierra los lectores que queden abiertos y termina el SDK, todo en el hilo que llama
+    (con lectores secundarios, usar DevicePool.close_devices). Devuelve True si todo se cerró correctamente."""
+    global _matcher
     closed_properly = True
-    if device_opened and hFPM and hFPM.value and sgfplib:
-        logger.info("Cerrando dispositivo...")
-        error_code = sgfplib.SGFPM_CloseDevice(hFPM)
-        if not _check_error(error_code, "SGFPM_CloseDevice"):
-             closed_properly = False
-        device_opened = False # Marcar como cerrado incluso si falla
-
-    if hFPM and hFPM.value and sgfplib: # Terminar si el handle se creó
-        logger.info("Terminando SDK...")
-        error_code = sgfplib.SGFPM_Terminate(hFPM)
-        if not _check_error(error_code, "SGFPM_Terminate"):
-            closed_properly = False
-        # Resetear estado global
-        sdk_initialized = False
-        device_opened = False
-        hFPM = None
-        # Podríamos poner sgfplib = None aquí también si quisiéramos permitir recarga
+    for device_id in list(_sessions):
+        closed_properly = close_device(device_id) and closed_properly
+    if _matcher is not None:
+        closed_properly = _matcher.close() and closed_properly
+        _matcher = None
     logger.info("Terminate SDK finalizado.")
     return closed_properly
 
-def get_device_info():
+def get_device_info(session=None):
     """Obtiene info del dispositivo. Devuelve dict o None."""
-    # global lock # Descomentar si se usa
-    # with lock: # Descomentar si se usa
-    if not (sdk_initialized and device_opened and hFPM and hFPM.value):
+    session = session or _session
+    if not (session and session.ready):
         logger.error("Intento de obtener info, pero SDK no listo/abierto.")
         return None
     try:
         device_info = SGDeviceInfoParam()
-        error_code = sgfplib.SGFPM_GetDeviceInfo(hFPM, ctypes.byref(device_info))
+        error_code = sgfplib.SGFPM_GetDeviceInfo(session.handle, ctypes.byref(device_info))
         if _check_error(error_code, "SGFPM_GetDeviceInfo"):
             serial_number_bytes = bytes(device_info.DeviceSN)
             serial_number = serial_number_bytes.partition(b'\0')[0].decode('ascii', errors='ignore')
@@ -264,16 +524,15 @@ def get_device_info():
         logger.error(f"Excepción en get_device_info: {e}", exc_info=True)
         return None
 
-def set_led(on: bool):
+def set_led(on: bool, session=None):
     """Intenta encender/apagar el LED. Devuelve True/False."""
-    # global lock # Descomentar si se usa
-    # with lock: # Descomentar si se usa
-    if not (sdk_initialized and device_opened and hFPM and hFPM.value):
+    session = session or _session
+    if not (session and session.ready):
         logger.error("Intento de controlar LED, pero SDK no listo/abierto.")
         return False
     try:
         logger.info(f"Intentando poner LED en {'ON' if on else 'OFF'}...")
-        error_code = sgfplib.SGFPM_SetLedOn(hFPM, on)
+        error_code = sgfplib.SGFPM_SetLedOn(session.handle, on)
         # Manejo especial del error 2 que vimos antes
         if error_code == SGFDX_ERROR_FUNCTION_FAILED:
              logger.warning("SGFPM_SetLedOn falló (Código 2) - Función podría no estar soportada.")
@@ -288,99 +547,454 @@ def set_led(on: bool):
         logger.error(f"Excepción en set_led: {e}", exc_info=True)
         return False
 
-def capture_template():
+def capture_template(session=None):
     """Captura imagen y extrae plantilla. Devuelve plantilla Base64 o None."""
-    # global lock # Descomentar si se usa
-    # with lock: # Descomentar si se usa
-    if not (sdk_initialized and device_opened and hFPM and hFPM.value):
+    template_bytes = capture_template_bytes(session)
+    if template_bytes is None:
+        return None
+    with span("encode.base64"):
+        template_b64 = base64.b64encode(template_bytes).decode('utf-8')
+    logger.info(f"Plantilla codificada (Base64 len: {len(template_b64)}).")
+    return template_b64
+
+def capture_template_bytes(session=None):
+    """Captura imagen y extrae plantilla (política por defecto). Devuelve los bytes exactos de la plantilla o None."""
+    result = capture_template_quality(session=session)
+    return result.template if result is not None else None
+
+# Resultado de una captura: plantilla (bytes), calidad de la imagen usada, intentos (imágenes tomadas)
+# y análisis previo de esa imagen (image_analysis.FrameAnalysis, None sin NumPy)
+CaptureResult = namedtuple('CaptureResult', ['template', 'quality', 'attempts', 'analysis'], defaults=(None,))
+# Imagen capturada sin extraer: píxeles (bytes, 8 bits por píxel, fila a fila), geometría y los mismos datos de captura
+CapturedImage = namedtuple('CapturedImage', ['image', 'width', 'height', 'quality', 'attempts', 'analysis'])
+
+frames_rejected = registry.counter(
+    'secugen_capture_frames_rejected_total', 'Imágenes sin huella según el análisis previo (solo se extraen si no hay otra mejor).')
+
+class CapturePolicy:
+    """Cuándo dar por buena una imagen: calidad mínima, número máximo de imágenes y tiempo máximo.
+
+    Las imágenes por debajo de min_quality no se extraen (CreateTemplate es lo caro).
+    Si se agotan los intentos o el tiempo sin llegar al mínimo se extrae la mejor
+    imagen vista. Por defecto (CAPTURE_MIN_QUALITY=0, CAPTURE_MAX_ATTEMPTS=1) se
+    comporta como una captura simple.
+    """
+
+    def __init__(self, min_quality=0, max_attempts=1, time_budget=None):
+        self.min_quality = min_quality
+        self.max_attempts = max(1, max_attempts)
+        self.time_budget = time_budget or None # Segundos; None = sin límite de tiempo
+
+    @classmethod
+    def from_env(cls):
+        return cls(min_quality=int(os.getenv('CAPTURE_MIN_QUALITY', 0)),
+                   max_attempts=int(os.getenv('CAPTURE_MAX_ATTEMPTS', 1)),
+                   time_budget=float(os.getenv('CAPTURE_TIME_BUDGET', 0)))
+
+    def to_dict(self):
+        return {"min_quality": self.min_quality, "max_attempts": self.max_attempts, "time_budget": self.time_budget}
+
+# Política de las capturas que no indican una propia
+default_capture_policy = CapturePolicy.from_env()
+
+def capture_template_quality(policy=None, session=None):
+    """Captura según la política (ver CapturePolicy). Devuelve CaptureResult o None si no se obtuvo plantilla."""
+    session = session or _session
+    policy = policy or default_capture_policy
+    if not (session and session.ready):
         logger.error("Intento de capturar, pero SDK no listo/abierto.")
         return None
 
     try:
-        # Obtener dimensiones (podrían cachearse si no cambian)
-        info = get_device_info() # Llama a la función wrapper
-        if not info or info["image_width"] == 0 or info["image_height"] == 0:
-             logger.error("No se pudieron obtener dimensiones válidas para capturar.")
-             return None
-        width = info["image_width"]
-        height = info["image_height"]
-
-        # Crear buffer de imagen
-        image_buffer = ctypes.create_string_buffer(width * height)
-        logger.info("Llamando a SGFPM_GetImage... Coloca el dedo.")
-        error_code_img = sgfplib.SGFPM_GetImage(hFPM, image_buffer)
-
-        if not _check_error(error_code_img, "SGFPM_GetImage"):
-            return None # Falló la captura
-        logger.info("Imagen capturada.")
-
-        # Obtener calidad (opcional, para SGFingerInfo)
-        quality = ctypes.c_ulong(0)
-        error_code_qual = sgfplib.SGFPM_GetLastImageQuality(hFPM, ctypes.byref(quality))
-        if not _check_error(error_code_qual, "SGFPM_GetLastImageQuality"):
-             logger.warning("No se pudo obtener calidad de imagen, usando 0.")
-             img_quality = 0
-        else:
-             img_quality = quality.value
-             logger.info(f"Calidad de imagen obtenida: {img_quality}")
+        frame = _capture_frame(session, policy)
+        if frame is None:
+            return None
+        image_buffer, img_quality, attempts, analysis = frame
+        logger.info("Llamando a SGFPM_CreateTemplate...")
+        template_bytes = _extract_template(session, img_quality, image_buffer)
+        if template_bytes is None:
+            return None # Falló la creación de plantilla
+        logger.info(f"Plantilla creada ({len(template_bytes)} bytes).")
+        return CaptureResult(template_bytes, img_quality, attempts, analysis)
 
-        # Preparar info para la plantilla
-        fp_info = SGFingerInfo()
-        fp_info.FingerNumber = SG_FINGPOS_UK # Dedo desconocido
-        fp_info.ViewNumber = 0 # Primera (y única) vista/muestra
-        fp_info.ImpressionType = SG_IMPTYPE_LP # Live scan plain
-        fp_info.ImageQuality = int(img_quality) if img_quality <= 65535 else 65535 # WORD max 65535
+    except Exception as e:
+        logger.error(f"Excepción en capture_template: {e}", exc_info=True)
+        return None
 
-        # Crear buffer para plantilla (usar tamaño por defecto)
-        template_buffer = ctypes.create_string_buffer(DEFAULT_TEMPLATE_SIZE)
+def capture_image(policy=None, session=None):
+    """Captura según la política pero sin extraer plantilla. Devuelve CapturedImage o None.
 
-        logger.info("Llamando a SGFPM_CreateTemplate...")
-        error_code_tmpl = sgfplib.SGFPM_CreateTemplate(hFPM, ctypes.byref(fp_info), image_buffer, template_buffer)
+    La imagen se copia una vez del buffer de la sesión (el siguiente GetImage lo
+    sobrescribe); codificarla y enviarla se hace fuera del hilo del lector."""
+    session = session or _session
+    policy = policy or default_capture_policy
+    if not (session and session.ready):
+        logger.error("Intento de capturar imagen, pero SDK no listo/abierto.")
+        return None
 
-        if not _check_error(error_code_tmpl, "SGFPM_CreateTemplate"):
-             return None # Falló la creación de plantilla
+    try:
+        frame = _capture_frame(session, policy)
+        if frame is None:
+            return None
+        image_buffer, img_quality, attempts, analysis = frame
+        return CapturedImage(image_buffer.raw, session.image_width, session.image_height,
+                             img_quality, attempts, analysis)
 
-        # Asumir tamaño fijo SG400 (400 bytes) si no se cambió formato
-        # ¡OJO! Si usas otros formatos, necesitas GetTemplateSize
-        actual_template_size = 400 # ¡Asunción! Solo para SG400
-        template_bytes = template_buffer.raw[:actual_template_size]
-        template_b64 = base64.b64encode(template_bytes).decode('utf-8')
-        logger.info(f"Plantilla creada (Base64 len: {len(template_b64)}).")
+    except Exception as e:
+        logger.error(f"Excepción en capture_image: {e}", exc_info=True)
+        return None
 
-        return template_b64
+def _capture_frame(session, policy):
+    """Toma imágenes hasta que una llega a policy.min_quality o se agotan intentos/tiempo.
+    Devuelve (buffer, calidad, intentos, análisis) de la imagen elegida (la mejor si ninguna
+    llegó al mínimo) o None si no hubo ninguna utilizable.
+
+    El análisis previo (NumPy) solo ordena las imágenes: una que no parece tener huella nunca
+    corta la búsqueda ni gana a una que sí, pero si todas las descarta se extrae igualmente la
+    mejor (como sin análisis; sus umbrales no son los del SDK)."""
+    # Buffers y geometría cacheados en la sesión al abrir el dispositivo
+    deadline = time.monotonic() + policy.time_budget if policy.time_budget else None
+    best_rank = None # (parece huella, calidad) de la imagen guardada en best_image_buffer
+    best_analysis = None
+    attempts = 0
+    logger.info("Llamando a SGFPM_GetImage... Coloca el dedo.")
+    while attempts < policy.max_attempts:
+        attempts += 1
+        img_quality = _grab_image(session)
+        if img_quality is not None:
+            analysis = _analyze_image(session)
+            present = analysis is None or analysis.present
+            if not present:
+                # Sensor vacío o mancha según el análisis: solo se usará si no hay nada mejor
+                frames_rejected.inc()
+                logger.info(f"Imagen sin huella según el análisis previo (cobertura {analysis.coverage}, "
+                            f"intento {attempts}/{policy.max_attempts}).")
+            else:
+                logger.info(f"Imagen capturada (calidad: {img_quality}, intento {attempts}/{policy.max_attempts}).")
+                if img_quality >= policy.min_quality:
+                    return session.image_buffer, img_quality, attempts, analysis
+            rank = (present, img_quality)
+            if best_rank is None or rank > best_rank:
+                # Se guarda la imagen: el siguiente GetImage sobrescribe image_buffer
+                ctypes.memmove(session.best_image_buffer, session.image_buffer, len(session.image_buffer))
+                best_rank = rank
+                best_analysis = analysis
+        if deadline is not None and time.monotonic() >= deadline:
+            break
+
+    if best_rank is None:
+        logger.warning(f"Ninguna imagen utilizable en {attempts} intentos (fallo de captura o sin dedo).")
+        return None
+    present, best_quality = best_rank
+    if not present:
+        logger.warning(f"El análisis previo no vio huella en {attempts} intentos; se extrae la mejor imagen "
+                       f"de todos modos (calidad {best_quality}).")
+    else:
+        logger.warning(f"Ninguna imagen llegó a calidad {policy.min_quality} en {attempts} intentos; "
+                       f"se usa la mejor ({best_quality}).")
+    return session.best_image_buffer, best_quality, attempts, best_analysis
+
+def _grab_image(session):
+    """SGFPM_GetImage en el buffer de la sesión + calidad de esa imagen. Devuelve la calidad (0 si no
+    se pudo leer) o None si falló la captura."""
+    error_code_img = sgfplib.SGFPM_GetImage(session.handle, session.image_buffer)
+    if not _check_error(error_code_img, "SGFPM_GetImage"):
+        return None
 
+    # Obtener calidad (opcional, para SGFingerInfo)
+    error_code_qual = sgfplib.SGFPM_GetLastImageQuality(session.handle, ctypes.byref(session.quality))
+    if not _check_error(error_code_qual, "SGFPM_GetLastImageQuality"):
+        logger.warning("No se pudo obtener calidad de imagen, usando 0.")
+        return 0
+    return session.quality.value
+
+def _analyze_image(session):
+    """Análisis previo (NumPy) de la imagen en el buffer de la sesión. None si no está disponible."""
+    if session.image_view is None or not image_analysis.analysis_enabled():
+        return None
+    return image_analysis.analyze_frame(session.image_view)
+
+def _extract_template(session, img_quality, image_buffer=None):
+    """Extrae la plantilla de la imagen (por defecto la del buffer de la sesión). Devuelve bytes o None."""
+    # Preparar info para la plantilla
+    fp_info = session.finger_info
+    fp_info.FingerNumber = SG_FINGPOS_UK # Dedo desconocido
+    fp_info.ViewNumber = 0 # Primera (y única) vista/muestra
+    fp_info.ImpressionType = SG_IMPTYPE_LP # Live scan plain
+    fp_info.ImageQuality = int(img_quality) if img_quality <= 65535 else 65535 # WORD max 65535
+
+    if image_buffer is None:
+        image_buffer = session.image_buffer
+    error_code_tmpl = sgfplib.SGFPM_CreateTemplate(session.handle, ctypes.byref(fp_info),
+                                                   image_buffer, session.template_buffer)
+    if not _check_error(error_code_tmpl, "SGFPM_CreateTemplate"):
+        return None # Falló la creación de plantilla
+
+    # Tamaño real de la plantilla según el SDK (respaldo: SG400)
+    error_code_size = sgfplib.SGFPM_GetTemplateSize(session.handle, session.template_buffer,
+                                                    ctypes.byref(session.template_size))
+    if _check_error(error_code_size, "SGFPM_GetTemplateSize") and 0 < session.template_size.value <= DEFAULT_TEMPLATE_SIZE:
+        actual_template_size = session.template_size.value
+    else:
+        logger.warning(f"No se pudo obtener el tamaño de plantilla, asumiendo SG400 ({SG400_TEMPLATE_SIZE} bytes).")
+        actual_template_size = SG400_TEMPLATE_SIZE
+    return ctypes.string_at(session.template_buffer, actual_template_size)
+
+def poll_finger(presence_quality, min_quality, previous_template=None, security_level=SL_NORMAL, session=None):
+    """Una vuelta de la captura continua: toma una imagen y solo extrae plantilla si hay dedo con calidad suficiente.
+
+    Devuelve None si falló el SDK, o un dict {"present", "quality", "template", "same_as_previous"}:
+    - present: calidad >= presence_quality (sin dedo la imagen es casi blanca y la calidad ~0) y,
+      con NumPy, el análisis previo ve huella (ver image_analysis.py)
+    - template: bytes de la plantilla si quality >= min_quality (si no, None: no se paga CreateTemplate)
+    - same_as_previous: la plantilla coincide con previous_template (bytes), comparada con el handle
+      de este lector (el del lector principal pertenece a otro hilo)
+    """
+    session = session or _session
+    if not (session and session.ready):
+        logger.error("Intento de sondear el lector, pero SDK no listo/abierto.")
+        return None
+    try:
+        quality = _grab_image(session)
+        if quality is None:
+            return None
+        analysis = _analyze_image(session)
+        present = quality >= presence_quality and (analysis is None or analysis.present)
+        result = {"present": present, "quality": quality, "template": None, "same_as_previous": False}
+        if not present or quality < min_quality:
+            return result
+        template_bytes = _extract_template(session, quality)
+        if template_bytes is None:
+            return None
+        result["template"] = template_bytes
+        if previous_template is not None:
+            previous_buffer = decode_template(previous_template)
+            current_buffer = decode_template(template_bytes)
+            match_result = ctypes.c_bool(False)
+            error_code = sgfplib.SGFPM_MatchTemplate(session.handle, previous_buffer, current_buffer,
+                                                     security_level, ctypes.byref(match_result))
+            result["same_as_previous"] = _check_error(error_code, "SGFPM_MatchTemplate") and match_result.value
+        return result
     except Exception as e:
-        logger.error(f"Excepción en capture_template: {e}", exc_info=True)
+        logger.error(f"Excepción en poll_finger: {e}", exc_info=True)
+        return None
+
+def template_to_bytes(template):
+    """Bytes de una plantilla recibida en Base64 (str) o ya en binario. Devuelve bytes o None."""
+    if isinstance(template, (bytes, bytearray, memoryview)):
+        template_bytes = bytes(template) # Ya viene en binario, sin Base64
+    else:
+        try:
+            template_bytes = base64.b64decode(template)
+        except (TypeError, ValueError) as decode_error: # binascii.Error es ValueError; str no ASCII también
+            logger.warning(f"Error decodificando plantilla Base64: {decode_error}")
+            return None
+    if not template_bytes:
+        logger.warning("Plantilla vacía.")
+        return None
+    return template_bytes
+
+def decode_template(template_b64):
+    """Convierte una plantilla (str Base64 o bytes binarios) en un buffer ctypes listo para el SDK. Devuelve buffer o None."""
+    template_bytes = template_to_bytes(template_b64)
+    if template_bytes is None:
+        return None
+    # Buffer de tamaño máximo (o fijo SG400). ¡OJO! Con formatos variables se necesita el tamaño real.
+    return ctypes.create_string_buffer(template_bytes, max(len(template_bytes), DEFAULT_TEMPLATE_SIZE))
+
+def get_template_buffer(template_b64):
+    """Como decode_template, pero a través de la caché LRU compartida."""
+    return template_cache.get_or_decode(template_b64, decode_template)
+
+def get_template_cache_stats():
+    """Contadores de la caché de plantillas (hits/misses/evictions, tamaño)."""
+    return template_cache.stats()
+
+def identify_template(probe_b64, candidates, security_level=SL_NORMAL, first_only=True):
+    """Compara una plantilla contra una galería 1:N.
+
+    candidates: iterable de pares (clave, buffer_ctypes) ya decodificados (ver decode_template).
+    Devuelve la lista de claves que coinciden (vacía si ninguna; solo la primera si
+    first_only) o None si hay error.
+    """
+    session = get_matcher()
+    if session is None:
+        logger.error("Intento de identificar, pero SDK no inicializado.")
+        return None
+
+    try:
+        probe_buffer = get_template_buffer(probe_b64)
+        if probe_buffer is None:
+            return None
+
+        match_result_val = ctypes.c_bool(False)
+        match_result_ref = ctypes.byref(match_result_val)
+        match_fn = sgfplib.SGFPM_MatchTemplate
+        handle = session.handle
+        matches = []
+        compared = 0
+        for key, candidate_buffer in candidates:
+            compared += 1
+            error_code = match_fn(handle, probe_buffer, candidate_buffer, security_level, match_result_ref)
+            if error_code != SGFDX_ERROR_NONE:
+                _check_error(error_code, "SGFPM_MatchTemplate")
+                return None
+            if match_result_val.value:
+                matches.append(key)
+                if first_only:
+                    break
+        logger.info(f"Identificación 1:N: {compared} comparaciones, {len(matches)} coincidencia(s).")
+        return matches
+
+    except Exception as e:
+        logger.error(f"Excepción en identify_template: {e}", exc_info=True)
+        return None
+
+# Resultado de una búsqueda top-k: [(clave, puntuación)] de mayor a menor, comparaciones hechas
+# y si se cortó al encontrar un candidato por encima de stop_score
+SearchResult = namedtuple('SearchResult', ['candidates', 'compared', 'early_exit'])
+
+# Candidatos devueltos por defecto y puntuación a partir de la que se deja de buscar (0 = recorrer todo)
+DEFAULT_TOP_K = 5
+DEFAULT_STOP_SCORE = int(os.getenv('MATCH_STOP_SCORE', 150))
+# Cada cuántas comparaciones se consulta should_stop (otro worker ya cortó, tiempo agotado)
+STOP_CHECK_EVERY = 64
+
+def score_threshold(security_level):
+    """Puntuación mínima para considerar coincidencia con ese nivel de seguridad."""
+    return MATCH_SCORE_THRESHOLDS.get(security_level, MATCH_SCORE_THRESHOLDS[SL_NORMAL])
+
+def matching_scores_supported():
+    """True si la librería cargada exporta SGFPM_GetMatchingScore."""
+    return sgfplib is not None and hasattr(sgfplib, 'SGFPM_GetMatchingScore')
+
+def top_k_scores(handle, probe_buffer, keys, buffers, k, min_score, stop_score=0, should_stop=None):
+    """Recorre los candidatos con SGFPM_GetMatchingScore guardando en un montículo de tamaño k
+    los mejores con puntuación >= min_score. Corta al llegar a stop_score (si > 0) o cuando
+    should_stop() lo indique (se consulta cada STOP_CHECK_EVERY comparaciones).
+    Devuelve (SearchResult, código_de_error_o_None)."""
+    score_fn = sgfplib.SGFPM_GetMatchingScore
+    score = ctypes.c_ulong(0)
+    score_ref = ctypes.byref(score)
+    heap = [] # (puntuación, posición): la posición desempata sin comparar claves
+    compared = 0
+    early_exit = False
+    for position, candidate_buffer in enumerate(buffers):
+        if should_stop is not None and position % STOP_CHECK_EVERY == 0 and should_stop():
+            break
+        compared += 1
+        error_code = score_fn(handle, probe_buffer, candidate_buffer, score_ref)
+        if error_code != SGFDX_ERROR_NONE:
+            return SearchResult([], compared, False), error_code
+        value = score.value
+        if value < min_score:
+            continue
+        if len(heap) < k:
+            heapq.heappush(heap, (value, position))
+        elif value > heap[0][0]:
+            heapq.heapreplace(heap, (value, position))
+        if stop_score and value >= stop_score:
+            early_exit = True
+            break
+    ranked = sorted(heap, key=lambda item: (-item[0], item[1]))
+    return SearchResult([(keys[position], value) for value, position in ranked], compared, early_exit), None
+
+def search_templates(probe_b64, keys, buffers, k=DEFAULT_TOP_K, security_level=SL_NORMAL, stop_score=DEFAULT_STOP_SCORE,
+                     time_budget=None):
+    """Búsqueda 1:N con puntuación: los k mejores candidatos que superan el umbral del nivel de
+    seguridad (ver top_k_scores). keys/buffers: listas paralelas de claves y buffers decodificados.
+    Con time_budget (segundos) deja de recorrer al agotarlo: result.compared dice hasta dónde llegó.
+    Devuelve SearchResult o None si hay error."""
+    session = get_matcher()
+    if session is None:
+        logger.error("Intento de buscar, pero SDK no inicializado.")
+        return None
+    if not matching_scores_supported():
+        logger.error("La librería SDK no exporta SGFPM_GetMatchingScore: búsqueda top-k no disponible.")
+        return None
+
+    try:
+        probe_buffer = get_template_buffer(probe_b64)
+        if probe_buffer is None:
+            return None
+
+        deadline = time.monotonic() + time_budget if time_budget else None
+        should_stop = (lambda: time.monotonic() >= deadline) if deadline is not None else None
+        result, error_code = top_k_scores(session.handle, probe_buffer, keys, buffers, k,
+                                          score_threshold(security_level), stop_score, should_stop)
+        if error_code is not None:
+            _check_error(error_code, "SGFPM_GetMatchingScore")
+            return None
+        logger.info(f"Búsqueda top-{k}: {result.compared} comparaciones, {len(result.candidates)} candidato(s)"
+                    f"{' (corte anticipado)' if result.early_exit else ''}.")
+        return result
+
+    except Exception as e:
+        logger.error(f"Excepción en search_templates: {e}", exc_info=True)
+        return None
+
+def verify_batch(pairs, security_level=SL_NORMAL):
+    """Compara una lista de pares (plantilla1_b64, plantilla2_b64) en una sola pasada.
+
+    Cada plantilla distinta se obtiene una única vez de la caché compartida y su buffer
+    se reutiliza en todas las llamadas a SGFPM_MatchTemplate. Devuelve una lista con True/False por par
+    (None en los pares con plantillas inválidas o error del SDK), o None si el SDK no está listo.
+    """
+    session = get_matcher()
+    if session is None:
+        logger.error("Intento de verificar lote, pero SDK no inicializado.")
+        return None
+
+    try:
+        buffers = {} # plantilla_b64 -> buffer ctypes (o None si no decodifica)
+        match_result_val = ctypes.c_bool(False)
+        match_result_ref = ctypes.byref(match_result_val)
+        match_fn = sgfplib.SGFPM_MatchTemplate
+        handle = session.handle
+        results = []
+        for template1_b64, template2_b64 in pairs:
+            t1_buffer = buffers.get(template1_b64)
+            if t1_buffer is None and template1_b64 not in buffers:
+                t1_buffer = buffers[template1_b64] = get_template_buffer(template1_b64)
+            t2_buffer = buffers.get(template2_b64)
+            if t2_buffer is None and template2_b64 not in buffers:
+                t2_buffer = buffers[template2_b64] = get_template_buffer(template2_b64)
+            if t1_buffer is None or t2_buffer is None:
+                results.append(None)
+                continue
+            error_code = match_fn(handle, t1_buffer, t2_buffer, security_level, match_result_ref)
+            if error_code != SGFDX_ERROR_NONE:
+                _check_error(error_code, "SGFPM_MatchTemplate")
+                results.append(None)
+                continue
+            results.append(match_result_val.value)
+        logger.info(f"Verificación por lote: {len(results)} pares, {len(buffers)} plantillas distintas decodificadas.")
+        return results
+
+    except Exception as e:
+        logger.error(f"Excepción en verify_batch: {e}", exc_info=True)
         return None
 
 def verify_templates(template1_b64, template2_b64, security_level=SL_NORMAL):
     """Compara dos plantillas Base64. Devuelve True/False o None si hay error."""
-    # global lock # Descomentar si se usa
-    # with lock: # Descomentar si se usa
-    if not (sdk_initialized and device_opened and hFPM and hFPM.value):
-        logger.error("Intento de verificar, pero SDK no listo/abierto.")
+    session = get_matcher()
+    if session is None: # Basta Create/Init: comparar no necesita el lector abierto
+        logger.error("Intento de verificar, pero SDK no inicializado.")
         return None
 
     try:
-        # Decodificar
-        try:
-            t1_bytes = base64.b64decode(template1_b64)
-            t2_bytes = base64.b64decode(template2_b64)
-        except (TypeError, binascii.Error) as decode_error:
-            logger.warning(f"Error decodificando plantillas Base64: {decode_error}")
+        # Decodificar (o reutilizar los buffers ya decodificados de la caché)
+        t1_buffer = get_template_buffer(template1_b64)
+        t2_buffer = get_template_buffer(template2_b64)
+        if t1_buffer is None or t2_buffer is None:
             return None
 
-        # Crear buffers (asumiendo tamaño máximo o fijo SG400)
-        # ¡OJO! Si usas formatos variables, necesitas el tamaño real.
-        t1_buffer = ctypes.create_string_buffer(t1_bytes, DEFAULT_TEMPLATE_SIZE)
-        t2_buffer = ctypes.create_string_buffer(t2_bytes, DEFAULT_TEMPLATE_SIZE)
-
         # Variable para resultado
         match_result_val = ctypes.c_bool(False)
         match_result_ptr = ctypes.pointer(match_result_val)
 
         logger.info(f"Llamando a SGFPM_MatchTemplate (Nivel Sec={security_level})...")
-        error_code = sgfplib.SGFPM_MatchTemplate(hFPM, t1_buffer, t2_buffer, security_level, match_result_ptr)
+        error_code = sgfplib.SGFPM_MatchTemplate(session.handle, t1_buffer, t2_buffer, security_level, match_result_ptr)
 
         if not _check_error(error_code, "SGFPM_MatchTemplate"):
             # El fallo en MatchTemplate no necesariamente invalida el resultado booleano,
@@ -398,4 +1012,4 @@ def verify_templates(template1_b64, template2_b64, security_level=SL_NORMAL):
 # --- Inicialización al cargar (Opcional) ---
 # Descomentar para intentar inicializar al importar el módulo
 # if not initialize_sdk():
-#    logger.error("FALLO AL AUTO-INICIALIZAR SDK WRAPPER AL IMPORTAR.")
\ No newline at end of file
+#    logger.error("FALLO AL AUTO-INICIALIZAR SDK WRAPPER AL IMPORTAR.")
@@ -0,0 +1,201 @@
+# secugen_api/api/snapshot.py
+
+"""
+Instantánea binaria de la galería para arrancar matchers sin leer toda la BD.
+
+Formato (little-endian), versión 2:
+
+    cabecera (72 bytes)   magic 'SGGALSNP', versión, stride, nº de registros, offsets, crc32,
+                          fecha y seq de fingerprint_changes al exportar (-1 si no se conoce)
+    registros             count * stride bytes: cada plantilla ocupa un hueco fijo (relleno con ceros)
+    relleno final         DEFAULT_TEMPLATE_SIZE bytes a cero (el SDK puede leer más allá de la plantilla)
+    índice                count * 24 bytes: fingerprint_id, user_id, longitud, código de dedo
+    tabla de dedos        JSON con los nombres de finger_position (el índice guarda su posición)
+
+El crc32 cubre todo lo que sigue a la cabecera. Al cargar, el archivo se mapea con
+mmap (ACCESS_COPY) y cada plantilla es un array ctypes creado con from_buffer sobre
+el mapeo: no se copia ningún registro y varios procesos del mismo nodo comparten
+las páginas de la page cache.
+
+La seq de fingerprint_changes (migrations/002) se lee antes de recorrer la tabla:
+al cargar, los cambios y borrados posteriores a ella se descartan de la
+instantánea y se releen de la BD (ver TemplateGallery.load_from_snapshot).
+
+Exportar / comprobar:
+    python -m api.snapshot export /var/lib/secugen/gallery.snap
+    python -m api.snapshot verify /var/lib/secugen/gallery.snap
+"""
+
+import argparse
+import ctypes
+import json
+import logging
+import mmap
+import os
+import struct
+import time
+import zlib
+
+from .sdk_interface.wrapper import DEFAULT_TEMPLATE_SIZE
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_MAGIC = b'SGGALSNP'
+SNAPSHOT_VERSION = 2
+# magic, versión, reservado, stride, count, records_offset, index_offset, positions_offset,
+# positions_length, crc32, created_at, change_seq (-1 = desconocida)
+_HEADER = struct.Struct('<8sHHIQQQQIIQq')
+_INDEX_ENTRY = struct.Struct('<qqII') # fingerprint_id, user_id, longitud de la plantilla, código de dedo
+STRIDE_ALIGNMENT = 16
+
+
+class SnapshotError(Exception):
+    """Archivo de instantánea inválido, de otra versión o corrupto."""
+
+
+def _align(value, alignment=STRIDE_ALIGNMENT):
+    return (value + alignment - 1) // alignment * alignment
+
+
+def export_snapshot(path, batch_size=1000):
+    """Vuelca la tabla 'fingerprints' a 'path' (escritura atómica). Requiere app context. Devuelve el nº de registros."""
+    from . import db
+    from .models import Fingerprint
+    from .gallery_sync import latest_change_seq
+    from .sdk_interface import wrapper as sdk_wrapper
+
+    # Antes de leer las filas: lo que cambie durante la exportación queda después de esta seq
+    change_seq = latest_change_seq()
+
+    # Hueco por registro: la plantilla más larga (Base64 legado: 3 bytes por cada 4 caracteres)
+    max_length = db.session.query(db.func.max(db.func.coalesce(
+        db.func.octet_length(Fingerprint.template_blob),
+        db.func.length(Fingerprint.template_data) * 3 / 4))).scalar() or 0
+    rows = Fingerprint.query.with_entities(
+        Fingerprint.id, Fingerprint.user_id, Fingerprint.finger_position,
+        Fingerprint.template_blob, Fingerprint.template_data
+    ).order_by(Fingerprint.id).yield_per(batch_size) # Por lotes: no se carga toda la tabla
+    records = ((fp_id, user_id, finger_position,
+                sdk_wrapper.template_to_bytes(template_blob if template_blob is not None else template_b64))
+               for fp_id, user_id, finger_position, template_blob, template_b64 in rows)
+    return write_snapshot(path, records, _align(max(int(max_length), 1)), change_seq)
+
+
+def write_snapshot(path, records, stride, change_seq=None):
+    """Escribe la instantánea. records: iterable de (fingerprint_id, user_id, finger_position, bytes_plantilla).
+    change_seq: seq de fingerprint_changes leída antes de obtener los registros (None si no hay registro de cambios).
+    Escribe a 'path.tmp' y lo renombra al terminar. Devuelve el nº de registros escritos."""
+    tmp_path = f"{path}.tmp"
+    count = 0
+    checksum = 0
+    index = bytearray()
+    positions = {} # finger_position -> código
+
+    with open(tmp_path, 'wb') as out:
+        out.write(b'\0' * _HEADER.size) # Se reescribe al final
+        for fp_id, user_id, finger_position, template_bytes in records:
+            if template_bytes is None or len(template_bytes) > stride:
+                logger.warning(f"Plantilla de fingerprint {fp_id} inválida o mayor que el hueco ({stride}), se omite.")
+                continue
+            record = template_bytes.ljust(stride, b'\0')
+            out.write(record)
+            checksum = zlib.crc32(record, checksum)
+            code = positions.setdefault(finger_position, len(positions))
+            index += _INDEX_ENTRY.pack(fp_id, user_id, len(template_bytes), code)
+            count += 1
+
+        tail = b'\0' * DEFAULT_TEMPLATE_SIZE
+        out.write(tail)
+        checksum = zlib.crc32(tail, checksum)
+        index_offset = _HEADER.size + count * stride + len(tail)
+        out.write(index)
+        checksum = zlib.crc32(index, checksum)
+        positions_blob = json.dumps(list(positions), ensure_ascii=False).encode('utf-8')
+        positions_offset = index_offset + len(index)
+        out.write(positions_blob)
+        checksum = zlib.crc32(positions_blob, checksum)
+
+        out.seek(0)
+        out.write(_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, 0, stride, count, _HEADER.size, index_offset,
+                               positions_offset, len(positions_blob), checksum, int(time.time()),
+                               -1 if change_seq is None else change_seq))
+        out.flush()
+        os.fsync(out.fileno())
+    os.replace(tmp_path, path)
+    logger.info(f"Instantánea de galería escrita en {path}: {count} plantillas, stride {stride} bytes.")
+    return count
+
+
+class GallerySnapshot:
+    """Instantánea mapeada en memoria. Las plantillas son arrays ctypes sobre el mapeo (sin copias)."""
+
+    def __init__(self, path, verify=True):
+        self.path = path
+        with open(path, 'rb') as f:
+            # ACCESS_COPY: mapeo privado copy-on-write (from_buffer necesita un buffer escribible);
+            # mientras nadie escriba, las páginas son las de la page cache, compartidas entre procesos
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+        if len(self._mm) < _HEADER.size:
+            raise SnapshotError(f"{path}: archivo demasiado corto.")
+        (magic, version, _, self.stride, self.count, self.records_offset, self.index_offset,
+         positions_offset, positions_length, self.checksum, self.created_at, change_seq) = _HEADER.unpack_from(self._mm, 0)
+        if magic != SNAPSHOT_MAGIC:
+            raise SnapshotError(f"{path}: no es una instantánea de galería.")
+        if version != SNAPSHOT_VERSION:
+            raise SnapshotError(f"{path}: versión {version} no soportada (se espera {SNAPSHOT_VERSION}).")
+        if positions_offset + positions_length != len(self._mm) \
+                or self.index_offset + self.count * _INDEX_ENTRY.size != positions_offset \
+                or self.records_offset + self.count * self.stride + DEFAULT_TEMPLATE_SIZE != self.index_offset:
+            raise SnapshotError(f"{path}: tamaños de sección inconsistentes (¿archivo truncado?).")
+        if verify and zlib.crc32(memoryview(self._mm)[_HEADER.size:]) != self.checksum:
+            raise SnapshotError(f"{path}: checksum incorrecto.")
+        # Seq de fingerprint_changes al exportar; None si no se conoce (no se pueden detectar cambios)
+        self.change_seq = change_seq if change_seq >= 0 else None
+        self.finger_positions = json.loads(bytes(self._mm[positions_offset:positions_offset + positions_length]))
+        self._record_type = ctypes.c_char * self.stride
+
+    def __len__(self):
+        return self.count
+
+    def index(self, start=0, step=1):
+        """Itera (posición, fingerprint_id, user_id, finger_position, longitud) del índice."""
+        finger_positions = self.finger_positions
+        for position in range(start, self.count, step):
+            fp_id, user_id, length, code = _INDEX_ENTRY.unpack_from(self._mm, self.index_offset + position * _INDEX_ENTRY.size)
+            yield position, fp_id, user_id, finger_positions[code], length
+
+    def template_buffer(self, position):
+        """Array ctypes que apunta al registro 'position' dentro del mapeo (sin copiar)."""
+        return self._record_type.from_buffer(self._mm, self.records_offset + position * self.stride)
+
+    def max_fingerprint_id(self):
+        """Mayor fingerprint_id incluido (las filas posteriores se cargan de la BD)."""
+        return max((fp_id for _, fp_id, _, _, _ in self.index()), default=0)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Instantánea binaria de la galería de huellas.")
+    parser.add_argument('command', choices=('export', 'verify'))
+    parser.add_argument('path')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    if args.command == 'verify':
+        snapshot = GallerySnapshot(args.path, verify=True)
+        print(f"OK: {len(snapshot)} plantillas, stride {snapshot.stride} bytes, "
+              f"creada {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(snapshot.created_at))}, "
+              f"seq de cambios {snapshot.change_seq if snapshot.change_seq is not None else 'desconocida'}")
+        return
+
+    os.environ['SDK_AUTO_INIT'] = 'false' # Exportar no necesita el lector
+    from dotenv import load_dotenv
+    load_dotenv()
+    from . import create_app
+    app = create_app()
+    with app.app_context():
+        count = export_snapshot(args.path)
+    print(f"Exportadas {count} plantillas a {args.path}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+# secugen_api/api/user_templates.py
+
+"""
+Caché por usuario de las plantillas ya decodificadas (verificación 1:pocos).
+
+Para "¿es este el usuario X?" basta comparar con las huellas de X: la primera
+vez se leen de la BD (una consulta por user_id, con el índice
+ix_fingerprints_user_id) y se decodifican; después se sirven de memoria. La caché
+es LRU y está acotada por número de usuarios; cada entrada caduca a los
+USER_CACHE_TTL segundos y se invalida al enrolar (/enroll, /enroll/bulk,
+/import) o cuando llega un cambio por GALLERY_SYNC.
+"""
+
+import collections
+import logging
+import os
+import threading
+import time
+
+from .sdk_interface import wrapper as sdk_wrapper
+
+logger = logging.getLogger(__name__)
+
+# Usuarios cacheados como máximo y segundos que vale cada entrada (0 = sin caducidad)
+USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', 1024))
+USER_CACHE_TTL = float(os.getenv('USER_CACHE_TTL', 300))
+
+# Huella de un usuario: clave para la respuesta + buffer ctypes listo para el SDK
+UserTemplate = collections.namedtuple('UserTemplate', ['fingerprint_id', 'finger_position', 'buffer'])
+
+
+class UserTemplateCache:
+    """LRU acotada: user_id -> tupla de UserTemplate (solo usuarios con huellas)."""
+
+    def __init__(self, max_users=USER_CACHE_SIZE, ttl=USER_CACHE_TTL):
+        self.max_users = max_users
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict() # user_id -> (cargada_en, tupla de UserTemplate)
+        self._owners = {} # fingerprint_id -> user_id de las entradas cacheadas
+        self._version = 0 # Cambia con cada invalidación (evita guardar lecturas ya obsoletas)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, user_id):
+        """Huellas decodificadas del usuario (tupla, vacía si no tiene). Requiere app context si no está en caché."""
+        with self._lock:
+            cached = self._entries.get(user_id)
+            if cached is not None and (not self.ttl or time.monotonic() - cached[0] < self.ttl):
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return cached[1]
+            self.misses += 1
+            version = self._version
+
+        templates = self._load(user_id) # Fuera del lock: consulta y decodificación
+        if not templates:
+            return templates # Sin huellas (o usuario inexistente): no se cachea
+
+        with self._lock:
+            if version == self._version: # Nadie invalidó mientras se leía la BD
+                self._remove_locked(user_id)
+                self._entries[user_id] = (time.monotonic(), templates)
+                for template in templates:
+                    self._owners[template.fingerprint_id] = user_id
+                while len(self._entries) > self.max_users:
+                    self._remove_locked(next(iter(self._entries)))
+                    self.evictions += 1
+        return templates
+
+    @staticmethod
+    def _load(user_id):
+        from .models import Fingerprint # Import diferido: models depende de db
+        rows = Fingerprint.query.with_entities(
+            Fingerprint.id, Fingerprint.finger_position, Fingerprint.template_blob, Fingerprint.template_data
+        ).filter(Fingerprint.user_id == user_id).order_by(Fingerprint.id).all()
+        templates = []
+        for fp_id, finger_position, template_blob, template_b64 in rows:
+            buffer = sdk_wrapper.decode_template(template_blob if template_blob is not None else template_b64)
+            if buffer is None:
+                logger.warning(f"Plantilla de fingerprint {fp_id} inválida, se omite de la verificación por usuario.")
+                continue
+            templates.append(UserTemplate(fp_id, finger_position, buffer))
+        return tuple(templates)
+
+    def _remove_locked(self, user_id):
+        cached = self._entries.pop(user_id, None)
+        if cached is not None:
+            for template in cached[1]:
+                self._owners.pop(template.fingerprint_id, None)
+
+    def invalidate(self, user_id):
+        """Olvida las huellas del usuario (se volverán a leer en la próxima verificación)."""
+        with self._lock:
+            self._version += 1
+            self._remove_locked(user_id)
+
+    def invalidate_fingerprint(self, fingerprint_id):
+        """Olvida al usuario que tenga esa huella cacheada (cambios y borrados sin user_id)."""
+        with self._lock:
+            self._version += 1
+            user_id = self._owners.get(fingerprint_id)
+            if user_id is not None:
+                self._remove_locked(user_id)
+
+    def clear(self):
+        with self._lock:
+            self._version += 1
+            self._entries.clear()
+            self._owners.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"users": len(self._entries), "max_users": self.max_users, "ttl": self.ttl,
+                    "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+
+# Instancia compartida por las rutas
+user_templates = UserTemplateCache()
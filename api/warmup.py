@@ -0,0 +1,109 @@
+# secugen_api/api/warmup.py
+
+import logging
+import os
+import threading
+import time
+
+from .sdk_interface import wrapper as sdk_wrapper
+from .sdk_interface.device_pool import device_pool
+from .sdk_interface.scheduler import device_scheduler, PRIORITY_BACKGROUND, PRIORITY_CONTROL, TIMEOUT_CAPTURE
+
+logger = logging.getLogger(__name__)
+
+# Estados del arranque del SDK
+WARMUP_IDLE = 'idle' # Auto-inicialización desactivada y aún sin /initialize
+WARMUP_STARTING = 'starting'
+WARMUP_READY = 'ready'
+WARMUP_FAILED = 'failed'
+
+
+def _env_flag(name, default):
+    return os.getenv(name, default).lower() in ('true', '1', 't')
+
+
+def schedule_startup_blink():
+    """Encola el parpadeo de LED de cada lector con la prioridad más baja (no retrasa capturas)."""
+    if not _env_flag('SDK_STARTUP_BLINK', 'true'):
+        return
+    for device_id, session in sdk_wrapper.get_sessions().items():
+        scheduler = device_pool.scheduler_for(device_id)
+        # Un comando por ciclo: una captura que llegue espera como mucho un ciclo (~0.5 s)
+        for _ in range(3):
+            scheduler.submit(sdk_wrapper.blink_led, session, cycles=1, priority=PRIORITY_BACKGROUND, name='blink_led')
+
+
+class SdkWarmup:
+    """Inicializa el SDK en segundo plano al arrancar la app, con reintentos, y expone su estado."""
+
+    def __init__(self):
+        self.state = WARMUP_IDLE
+        self.attempts = 0
+        self.error = None
+        self.started_at = None
+        self.ready_at = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self, retries=None, retry_delay=None):
+        """Lanza el hilo de arranque (no bloquea). Devuelve False si ya estaba en marcha."""
+        retries = int(os.getenv('SDK_WARMUP_RETRIES', 5)) if retries is None else retries
+        retry_delay = float(os.getenv('SDK_WARMUP_RETRY_DELAY', 2.0)) if retry_delay is None else retry_delay
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return False
+            self.state = WARMUP_STARTING
+            self.attempts = 0
+            self.error = None
+            self.started_at = time.time()
+            self._thread = threading.Thread(target=self._run, args=(retries, retry_delay),
+                                            name='sdk-warmup', daemon=True)
+            self._thread.start()
+        logger.info("Arranque del SDK en segundo plano iniciado.")
+        return True
+
+    def _run(self, retries, retry_delay):
+        for attempt in range(1, retries + 2): # Primer intento + reintentos
+            self.attempts = attempt
+            try:
+                ok = device_scheduler.call(device_pool.open_devices, blink=False,
+                                           priority=PRIORITY_CONTROL, timeout=TIMEOUT_CAPTURE)
+            except Exception as e:
+                logger.error(f"Excepción en el arranque del SDK (intento {attempt}): {e}", exc_info=True)
+                ok = False
+            if ok:
+                self.mark_ready()
+                schedule_startup_blink()
+                return
+            self.error = "Fallo al inicializar SDK o abrir dispositivo (ver logs del servidor)."
+            if attempt <= retries:
+                logger.warning(f"Arranque del SDK falló (intento {attempt}), reintentando en {retry_delay} s...")
+                time.sleep(retry_delay)
+        self.state = WARMUP_FAILED
+        logger.error(f"Arranque del SDK abandonado tras {self.attempts} intentos.")
+
+    def mark_ready(self):
+        """Marca el SDK como listo (también lo usa /initialize manual)."""
+        self.state = WARMUP_READY
+        self.error = None
+        self.ready_at = time.time()
+        if self.started_at:
+            logger.info(f"SDK listo en {self.ready_at - self.started_at:.3f} s desde el arranque.")
+
+    def mark_stopped(self):
+        """El SDK se terminó explícitamente (/terminate)."""
+        self.state = WARMUP_IDLE
+        self.ready_at = None
+
+    def status(self):
+        data = {"state": self.state, "mode": sdk_wrapper.get_sdk_mode(),
+                "sdk_ready": sdk_wrapper.is_serving(), "attempts": self.attempts}
+        if self.error and self.state != WARMUP_READY:
+            data["message"] = self.error
+        if self.started_at and self.ready_at:
+            data["warmup_seconds"] = round(self.ready_at - self.started_at, 3)
+        return data
+
+
+# Instancia compartida (create_app y rutas)
+sdk_warmup = SdkWarmup()
@@ -0,0 +1,100 @@
+# secugen_api/benchmarks/bench_match_engine.py
+
+"""
+Benchmark de identificación 1:N: handle único (identify_template) frente al motor
+paralelo por procesos (ParallelMatchEngine) con distintos números de workers.
+
+Uso:
+    python -m benchmarks.bench_match_engine [--gallery 20000] [--workers 1,2,4,8] [--match-latency 0.0]
+
+Con el backend simulado SGFPM_MatchTemplate es casi gratis; --match-latency añade
+el coste por comparación del SDK real para ver cómo escala el reparto. Se mide el
+peor caso (coincidencia en la última plantilla) y el caso sin coincidencia, que
+recorren toda la galería. La búsqueda top-k (SGFPM_GetMatchingScore) se mide
+recorriendo toda la galería y cortando en un candidato seguro a mitad de ella.
+"""
+
+import argparse
+import functools
+import logging
+import os
+import time
+
+from api.match_engine import ParallelMatchEngine
+from api.sdk_interface import wrapper as sdk_wrapper
+from api.sdk_interface.simulated import SimulatedSGFPLib
+from benchmarks.bench_wrapper import print_results, run_benchmark
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark de identificación 1:N (handle único vs procesos).")
+    parser.add_argument('--gallery', type=int, default=20000, help="Plantillas en la galería")
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--workers', default=f"1,2,4,{os.cpu_count() or 1}", help="Lista de workers a medir")
+    parser.add_argument('--match-latency', type=float, default=0.0, help="Segundos por SGFPM_MatchTemplate")
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.CRITICAL)
+    os.environ['SDK_METRICS'] = 'false' # Medir el matching, no la instrumentación
+
+    backend_factory = functools.partial(SimulatedSGFPLib, match_latency=args.match_latency)
+    sim = backend_factory()
+    templates = [sim.make_template(finger_id) for finger_id in range(1, args.gallery + 1)]
+    worst_probe = templates[-1]
+    missing_probe = sim.make_template(args.gallery + 1)
+
+    results = []
+
+    # Referencia: una llamada SGFPM_MatchTemplate tras otra sobre un solo handle
+    sdk_wrapper.terminate_sdk()
+    sdk_wrapper.set_backend(sim)
+    sdk_wrapper.set_sdk_mode(sdk_wrapper.SDK_MODE_MATCHING)
+    if not sdk_wrapper.initialize_sdk():
+        raise SystemExit("No se pudo inicializar el SDK simulado.")
+    try:
+        candidates = [(position, sdk_wrapper.decode_template(template)) for position, template in enumerate(templates)]
+        results.append(run_benchmark("handle único (peor caso)",
+                                     lambda: sdk_wrapper.identify_template(worst_probe, candidates),
+                                     args.iterations))
+        results.append(run_benchmark("handle único (sin match)",
+                                     lambda: sdk_wrapper.identify_template(missing_probe, candidates) == [],
+                                     args.iterations))
+        # Top-k con puntuación: recorrido completo frente a corte en el primer candidato seguro
+        keys = [key for key, _ in candidates]
+        buffers = [buffer for _, buffer in candidates]
+        middle_probe = templates[len(templates) // 2]
+        results.append(run_benchmark("top-5 (recorrido completo)",
+                                     lambda: sdk_wrapper.search_templates(middle_probe, keys, buffers, 5, stop_score=0),
+                                     args.iterations))
+        results.append(run_benchmark("top-5 (corte a mitad)",
+                                     lambda: sdk_wrapper.search_templates(middle_probe, keys, buffers, 5).early_exit,
+                                     args.iterations))
+    finally:
+        sdk_wrapper.terminate_sdk()
+
+    items = list(enumerate(templates))
+    for workers in sorted({int(w) for w in args.workers.split(',') if w.strip()}):
+        engine = ParallelMatchEngine(workers, backend_factory=backend_factory)
+        if not engine.start():
+            raise SystemExit(f"No se pudo arrancar el motor con {workers} workers.")
+        try:
+            t0 = time.perf_counter()
+            engine.load(items)
+            load_seconds = time.perf_counter() - t0
+            results.append(run_benchmark(f"{workers} workers (peor caso)",
+                                         lambda: engine.identify(worst_probe), args.iterations))
+            results.append(run_benchmark(f"{workers} workers (sin match)",
+                                         lambda: engine.identify(missing_probe) is False, args.iterations))
+            if args.verbose:
+                print(f"{workers} workers: carga de {len(items)} plantillas en {load_seconds:.2f} s")
+        finally:
+            engine.stop()
+
+    print(f"Galería: {args.gallery} plantillas, {os.cpu_count()} núcleos, latencia de match {args.match_latency} s")
+    print_results(results)
+    return results
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+# secugen_api/benchmarks/bench_wrapper.py
+
+"""
+Benchmarks del wrapper SDK sobre el backend simulado (no requiere lector).
+
+Uso:
+    python -m benchmarks.bench_wrapper [--iterations 2000] [--get-image-latency 0.0] ...
+
+Reporta ops/seg, p50 y p99 de capture_template, verify_templates y del ciclo
+initialize_sdk/terminate_sdk. Con --devices N > 1 mide además capturas concurrentes
+repartidas por el DevicePool entre N lectores simulados. Con NumPy instalado mide
+también el análisis previo de la imagen (sensor vacío y con dedo).
+"""
+
+import argparse
+import logging
+import time
+
+from api.sdk_interface import wrapper as sdk_wrapper
+from api.sdk_interface import image_analysis
+from api.sdk_interface.device_pool import device_pool
+from api.sdk_interface.simulated import SimulatedSGFPLib
+
+
+def _percentile(sorted_samples, pct):
+    if not sorted_samples:
+        return 0.0
+    index = min(len(sorted_samples) - 1, int(round(pct / 100.0 * (len(sorted_samples) - 1))))
+    return sorted_samples[index]
+
+
+def run_benchmark(name, fn, iterations):
+    """Ejecuta fn 'iterations' veces y devuelve un dict con ops/seg, p50 y p99 (ms)."""
+    samples = []
+    failures = 0
+    start = time.perf_counter()
+    for _ in range(iterations):
+        t0 = time.perf_counter()
+        result = fn()
+        samples.append(time.perf_counter() - t0)
+        if result is None or result is False:
+            failures += 1
+    total = time.perf_counter() - start
+    samples.sort()
+    return {
+        "name": name,
+        "iterations": iterations,
+        "failures": failures,
+        "ops_per_sec": iterations / total if total else float('inf'),
+        "p50_ms": _percentile(samples, 50) * 1000.0,
+        "p99_ms": _percentile(samples, 99) * 1000.0,
+    }
+
+
+def run_pool_benchmark(name, fn, iterations):
+    """Encola 'iterations' llamadas a fn en el DevicePool a la vez y mide hasta que terminan todas."""
+    start = time.perf_counter()
+    submitted = []
+    for _ in range(iterations):
+        t0 = time.perf_counter()
+        _, future = device_pool.submit(fn)
+        submitted.append((t0, future))
+    samples = []
+    failures = 0
+    for t0, future in submitted:
+        result = future.result()
+        samples.append(time.perf_counter() - t0)
+        if result is None:
+            failures += 1
+    total = time.perf_counter() - start
+    samples.sort()
+    return {
+        "name": name,
+        "iterations": iterations,
+        "failures": failures,
+        "ops_per_sec": iterations / total if total else float('inf'),
+        "p50_ms": _percentile(samples, 50) * 1000.0,
+        "p99_ms": _percentile(samples, 99) * 1000.0,
+    }
+
+
+def print_results(results):
+    print(f"{'benchmark':<28}{'iter':>8}{'fail':>6}{'ops/s':>12}{'p50 ms':>10}{'p99 ms':>10}")
+    for r in results:
+        print(f"{r['name']:<28}{r['iterations']:>8}{r['failures']:>6}"
+              f"{r['ops_per_sec']:>12.1f}{r['p50_ms']:>10.3f}{r['p99_ms']:>10.3f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks del wrapper SDK (backend simulado).")
+    parser.add_argument('--iterations', type=int, default=2000)
+    parser.add_argument('--init-iterations', type=int, default=5)
+    parser.add_argument('--get-image-latency', type=float, default=0.0, help="Segundos por SGFPM_GetImage")
+    parser.add_argument('--create-template-latency', type=float, default=0.0, help="Segundos por SGFPM_CreateTemplate")
+    parser.add_argument('--match-latency', type=float, default=0.0, help="Segundos por SGFPM_MatchTemplate")
+    parser.add_argument('--no-led', action='store_true', help="Simular lector sin soporte de LED")
+    parser.add_argument('--devices', type=int, default=1, help="Lectores simulados para el benchmark del pool")
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.CRITICAL)
+
+    sim = SimulatedSGFPLib(get_image_latency=args.get_image_latency,
+                           create_template_latency=args.create_template_latency,
+                           match_latency=args.match_latency,
+                           led_supported=not args.no_led,
+                           device_count=args.devices)
+    sdk_wrapper.terminate_sdk()
+    sdk_wrapper.set_backend(sim)
+
+    results = [run_benchmark("initialize/terminate", lambda: sdk_wrapper.initialize_sdk(blink=False) and sdk_wrapper.terminate_sdk(),
+                             args.init_iterations)]
+
+    # El hilo principal hace de hilo del lector principal; los demás se abren en sus schedulers
+    if not device_pool.open_devices(device_ids=list(range(args.devices))):
+        raise SystemExit("No se pudo inicializar el SDK simulado.")
+    try:
+        results.append(run_benchmark("capture_template", sdk_wrapper.capture_template, args.iterations))
+
+        template_b64 = sdk_wrapper.capture_template()
+        sim.present_finger(1)
+        other_b64 = sdk_wrapper.capture_template()
+        results.append(run_benchmark("verify_templates (match)",
+                                     lambda: sdk_wrapper.verify_templates(template_b64, template_b64), args.iterations))
+        # verify devuelve False si no coinciden; se contabiliza como fallo en la tabla
+        results.append(run_benchmark("verify_templates (no match)",
+                                     lambda: sdk_wrapper.verify_templates(template_b64, other_b64) is False, args.iterations))
+        session = sdk_wrapper.get_session()
+        if image_analysis.analysis_enabled() and session.image_view is not None:
+            # El análisis previo trabaja sobre la vista NumPy del buffer de la sesión
+            sdk_wrapper._grab_image(session)
+            results.append(run_benchmark("analyze_frame (dedo)",
+                                         lambda: image_analysis.analyze_frame(session.image_view).present,
+                                         args.iterations))
+            sim.lift_finger()
+            sdk_wrapper._grab_image(session)
+            # Sin dedo se descarta la imagen: 'fail' = todas (no se llega a CreateTemplate)
+            results.append(run_benchmark("analyze_frame (vacío)",
+                                         lambda: image_analysis.analyze_frame(session.image_view).present,
+                                         args.iterations))
+            results.append(run_benchmark("capture_template (vacío)", sdk_wrapper.capture_template, args.iterations))
+            sim.present_finger(1)
+        if args.devices > 1:
+            sim.present_finger(0)
+            results.append(run_pool_benchmark(f"pool capture ({args.devices} lectores)",
+                                              sdk_wrapper.capture_template_bytes, args.iterations))
+    finally:
+        device_pool.close_devices()
+
+    print_results(results)
+    return results
+
+
+if __name__ == '__main__':
+    main()
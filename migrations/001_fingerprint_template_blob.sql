@@ -0,0 +1,22 @@
+-- migrations/001_fingerprint_template_blob.sql
+-- Plantillas en binario (bytea) con su tamaño exacto en lugar de Base64 en Text.
+-- Idempotente: se puede ejecutar varias veces (psql -f ...).
+
+BEGIN;
+
+ALTER TABLE fingerprints ADD COLUMN IF NOT EXISTS template_blob BYTEA;
+
+-- Las filas nuevas solo escriben template_blob
+ALTER TABLE fingerprints ALTER COLUMN template_data DROP NOT NULL;
+
+-- Migrar filas existentes (decode() de Postgres ignora los saltos de línea del Base64)
+UPDATE fingerprints
+   SET template_blob = decode(template_data, 'base64')
+ WHERE template_blob IS NULL
+   AND template_data IS NOT NULL;
+
+COMMIT;
+
+-- Tras verificar la migración, se puede liberar el espacio del Base64 legado:
+--   UPDATE fingerprints SET template_data = NULL WHERE template_blob IS NOT NULL;
+--   VACUUM FULL fingerprints;
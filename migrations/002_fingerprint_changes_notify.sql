@@ -0,0 +1,39 @@
+-- migrations/002_fingerprint_changes_notify.sql
+-- Registro de cambios de 'fingerprints' + NOTIFY para sincronizar las galerías en memoria
+-- de todas las instancias (api/gallery_sync.py, GALLERY_SYNC=true).
+-- Idempotente: se puede ejecutar varias veces (psql -f ...).
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS fingerprint_changes (
+    seq            BIGSERIAL PRIMARY KEY,
+    op             CHAR(1) NOT NULL,       -- 'I' insert, 'U' update, 'D' delete
+    fingerprint_id INTEGER NOT NULL,
+    changed_at     TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+CREATE OR REPLACE FUNCTION fingerprints_notify_change() RETURNS trigger AS $$
+DECLARE
+    change_seq BIGINT;
+    change_op  CHAR(1) := left(TG_OP, 1);
+    change_id  INTEGER := CASE WHEN TG_OP = 'DELETE' THEN OLD.id ELSE NEW.id END;
+BEGIN
+    INSERT INTO fingerprint_changes (op, fingerprint_id)
+         VALUES (change_op, change_id)
+      RETURNING seq INTO change_seq;
+    -- Solo despierta a los oyentes; el cambio se lee de fingerprint_changes (se entrega al hacer COMMIT)
+    PERFORM pg_notify('fingerprint_changes',
+                      json_build_object('seq', change_seq, 'op', change_op, 'id', change_id)::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS fingerprints_notify_change ON fingerprints;
+CREATE TRIGGER fingerprints_notify_change
+    AFTER INSERT OR UPDATE OR DELETE ON fingerprints
+    FOR EACH ROW EXECUTE FUNCTION fingerprints_notify_change();
+
+COMMIT;
+
+-- Las instancias solo leen seq > su watermark; las filas antiguas se pueden purgar periódicamente:
+--   DELETE FROM fingerprint_changes WHERE changed_at < now() - interval '7 days';
@@ -0,0 +1,15 @@
+-- migrations/003_fingerprints_user_finger_unique.sql
+-- Índice único (user_id, finger_position): cierra la carrera entre la comprobación de
+-- duplicado y el insert de /enroll, y es el árbitro del ON CONFLICT de /enroll/bulk.
+-- Idempotente. Sin BEGIN/COMMIT: CREATE INDEX CONCURRENTLY no admite transacción y así
+-- no se bloquean las escrituras mientras se construye el índice en tablas grandes.
+
+-- Antes, comprobar que no haya duplicados (si los hay, el índice quedaría INVALID):
+--   SELECT user_id, finger_position, count(*) FROM fingerprints
+--    GROUP BY user_id, finger_position HAVING count(*) > 1;
+
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS uq_fingerprints_user_finger
+    ON fingerprints (user_id, finger_position);
+
+-- Si falló por duplicados, borrar el índice inválido, limpiar y repetir:
+--   DROP INDEX CONCURRENTLY IF EXISTS uq_fingerprints_user_finger;
@@ -0,0 +1,14 @@
+-- migrations/004_fingerprints_user_id_index.sql
+-- Índice sobre fingerprints.user_id: la verificación por usuario (/verify/user/<id>) lee
+-- todas las huellas de un usuario, y la FK no crea índice en PostgreSQL.
+-- Idempotente. Sin BEGIN/COMMIT: CREATE INDEX CONCURRENTLY no admite transacción y así
+-- no se bloquean las escrituras mientras se construye el índice.
+
+-- Nota: uq_fingerprints_user_finger (003) empieza también por user_id y sirve para la misma
+-- consulta; este índice es más pequeño y cubre las instalaciones sin la migración 003.
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_fingerprints_user_id
+    ON fingerprints (user_id);
+
+-- Si falló a medias (índice INVALID), borrarlo y repetir:
+--   DROP INDEX CONCURRENTLY IF EXISTS ix_fingerprints_user_id;
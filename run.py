@@ -8,6 +8,9 @@ from api import create_app
 
 # Carga variables de entorno desde un archivo .env (si existe)
 load_dotenv()
+# Debug activado por defecto al usar run.py; create_app lo necesita para no abrir
+# el lector en el proceso vigilante del reloader
+os.environ.setdefault('FLASK_DEBUG', 'True')
 
 # Llama a la función factoría definida en api/__init__.py para crear la app
 app = create_app()
@@ -0,0 +1,43 @@
+# secugen_api/tests/conftest.py
+
+"""
+Fixtures comunes: SDK simulado (sin lector ni DLL) en modo solo matching y la app Flask.
+
+Ejecutar desde la raíz del proyecto con: python -m pytest -q
+Las pruebas no necesitan PostgreSQL: solo ejercitan rutas que responden antes de tocar la BD.
+"""
+
+import os
+
+# Antes de importar la app: sin arranque en segundo plano, sin lector y sin métricas de proceso
+os.environ.setdefault('SDK_AUTO_INIT', 'false')
+os.environ.setdefault('SDK_MODE', 'matching')
+os.environ.setdefault('SDK_METRICS', 'false')
+
+import pytest
+
+from api import create_app
+from api.sdk_interface import wrapper as sdk_wrapper
+from api.sdk_interface.simulated import SimulatedSGFPLib
+
+API_PREFIX = '/api/v1/fingerprint'
+
+
+@pytest.fixture(scope='session')
+def app():
+    return create_app() # Fija el modo (SDK_MODE=matching) antes de inicializar el SDK
+
+
+@pytest.fixture(scope='session')
+def sim(app):
+    """Backend simulado con el handle de matching abierto durante toda la sesión de pruebas."""
+    library = SimulatedSGFPLib()
+    sdk_wrapper.set_backend(library)
+    assert sdk_wrapper.initialize_sdk()
+    yield library
+    sdk_wrapper.terminate_sdk()
+
+
+@pytest.fixture
+def client(app, sim):
+    return app.test_client()
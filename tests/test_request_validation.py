@@ -0,0 +1,68 @@
+# secugen_api/tests/test_request_validation.py
+
+"""Cuerpos mal formados: siempre 400 (nunca un 500 por un tipo inesperado)."""
+
+import base64
+import json
+
+import pytest
+
+from conftest import API_PREFIX
+
+
+@pytest.fixture(scope='module')
+def template_b64(sim):
+    return base64.b64encode(sim.make_template(1)).decode('ascii')
+
+
+def post_json(client, path, body):
+    # json.dumps a mano: test_client(json=None) no enviaría cuerpo
+    return client.post(f'{API_PREFIX}{path}', data=json.dumps(body), content_type='application/json')
+
+
+@pytest.mark.parametrize('body', [
+    [1, 2],
+    None,
+    "texto",
+    {"template1": 123, "template2": "QUJD"},
+    {"template1": ["QUJD"], "template2": "QUJD"},
+    {"template1": "QUéJD", "template2": "QUJD"}, # Base64 con caracteres no ASCII
+    {"template1": "QUJD", "template2": "QUJD", "security_level": True},
+    {"template1": "QUJD", "template2": "QUJD", "security_level": 50},
+])
+def test_verify(client, body):
+    assert post_json(client, '/verify', body).status_code == 400
+
+
+@pytest.mark.parametrize('body', [
+    [1, 2],
+    {"probe": "QUJD", "candidates": [{}]},
+    {"probe": ["QUJD"], "candidates": ["QUJD"]},
+    {"pairs": [[{"a": 1}, "QUJD"]]},
+    {"pairs": [{"template1": "QUJD", "template2": [1]}]},
+    {"pairs": "QUJD"},
+])
+def test_verify_batch(client, body):
+    assert post_json(client, '/verify/batch', body).status_code == 400
+
+
+def test_verify_batch_marks_invalid_pairs(client, template_b64):
+    response = post_json(client, '/verify/batch', {"probe": template_b64, "candidates": [template_b64, "QUéJD"]})
+    assert response.status_code == 200
+    assert response.get_json()["results"] == [True, None]
+
+
+@pytest.mark.parametrize('path', ['/identify', '/identify/top', '/verify/user/1'])
+@pytest.mark.parametrize('body', [[1, 2], {"template": 123}, {"template": {"a": 1}}, {"template": ["QUJD"]}])
+def test_probe_template(client, path, body):
+    assert post_json(client, path, body).status_code == 400
+
+
+@pytest.mark.parametrize('body', [{"k": True}, {"k": 0}, {"stop_score": False}, {"stop_score": -1}])
+def test_identify_top_settings(client, body):
+    assert post_json(client, '/identify/top', body).status_code == 400
+
+
+@pytest.mark.parametrize('body', [[1, 2], None, {"records": 3}, {"records": []}])
+def test_enroll_bulk(client, body):
+    assert post_json(client, '/enroll/bulk', body).status_code == 400
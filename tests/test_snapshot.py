@@ -0,0 +1,47 @@
+# secugen_api/tests/test_snapshot.py
+
+import pytest
+
+from api.snapshot import GallerySnapshot, SnapshotError, write_snapshot
+
+
+@pytest.fixture
+def records(sim):
+    return [(10, 1, 'Pulgar', sim.make_template(1)), (11, 1, 'Índice', sim.make_template(2)),
+            (12, 2, 'Pulgar', sim.make_template(3))]
+
+
+def test_round_trip(tmp_path, records):
+    path = tmp_path / 'gallery.snap'
+    assert write_snapshot(str(path), records, stride=400, change_seq=42) == 3
+    snapshot = GallerySnapshot(str(path))
+    assert len(snapshot) == 3
+    assert snapshot.change_seq == 42
+    assert snapshot.max_fingerprint_id() == 12
+    for (position, fp_id, user_id, finger_position, length), record in zip(snapshot.index(), records):
+        assert (fp_id, user_id, finger_position) == record[:3]
+        assert bytes(snapshot.template_buffer(position))[:length] == record[3]
+
+
+def test_unknown_change_seq(tmp_path, records):
+    path = tmp_path / 'gallery.snap'
+    write_snapshot(str(path), records, stride=400)
+    assert GallerySnapshot(str(path)).change_seq is None
+
+
+def test_oversized_templates_are_skipped(tmp_path, records):
+    path = tmp_path / 'gallery.snap'
+    assert write_snapshot(str(path), records + [(13, 3, 'Pulgar', b'x' * 401)], stride=400) == 3
+
+
+def test_corruption_is_detected(tmp_path, records):
+    path = tmp_path / 'gallery.snap'
+    write_snapshot(str(path), records, stride=400)
+    data = bytearray(path.read_bytes())
+    data[-1] ^= 0xFF
+    path.write_bytes(bytes(data))
+    with pytest.raises(SnapshotError):
+        GallerySnapshot(str(path))
+    path.write_bytes(bytes(data[:100]))
+    with pytest.raises(SnapshotError):
+        GallerySnapshot(str(path))
@@ -0,0 +1,60 @@
+# secugen_api/tests/test_template_cache.py
+
+import base64
+import struct
+
+import pytest
+
+from api.sdk_interface import wrapper as sdk_wrapper
+from api.sdk_interface.template_cache import TemplateBufferCache
+
+from conftest import API_PREFIX
+
+
+def test_str_and_bytes_have_different_keys():
+    # Bytes binarios iguales al texto de una plantilla Base64 no comparten entrada con ella
+    assert TemplateBufferCache.digest('QUJD') != TemplateBufferCache.digest(b'QUJD')
+    assert TemplateBufferCache.digest(b'QUJD') == TemplateBufferCache.digest(memoryview(b'QUJD'))
+
+
+def test_binary_template_does_not_get_base64_buffer():
+    cache = TemplateBufferCache()
+    assert cache.get_or_decode('QUJD', sdk_wrapper.decode_template).raw.startswith(b'ABC')
+    buffer = cache.get_or_decode(b'QUJD', sdk_wrapper.decode_template)
+    assert buffer.raw.startswith(b'QUJD')
+    assert cache.stats()["hits"] == 0
+
+
+def test_non_ascii_text_is_not_served_from_cache():
+    # '?' se ignora al decodificar; 'é' hace la plantilla inválida: no pueden compartir entrada
+    cache = TemplateBufferCache()
+    assert cache.get_or_decode('QU?JD', sdk_wrapper.decode_template) is not None
+    assert sdk_wrapper.decode_template('QUéJD') is None
+    assert cache.get_or_decode('QUéJD', sdk_wrapper.decode_template) is None
+
+
+def test_digest_rejects_non_template_values():
+    with pytest.raises(TypeError):
+        TemplateBufferCache.digest(123)
+
+
+def test_cache_hits_and_eviction():
+    cache = TemplateBufferCache(max_entries=2)
+    for template in ('QUJD', 'REVG', 'QUJD', 'R0hJ'):
+        cache.get_or_decode(template, sdk_wrapper.decode_template)
+    stats = cache.stats()
+    assert (stats["entries"], stats["hits"], stats["misses"], stats["evictions"]) == (2, 1, 3, 1)
+
+
+def test_octet_stream_verify_does_not_reuse_base64_entry(client, sim):
+    template = sim.make_template(1)
+    template_b64 = base64.b64encode(template).decode('ascii')
+    response = client.post(f'{API_PREFIX}/verify', json={"template1": template_b64, "template2": template_b64})
+    assert response.get_json()["match"] is True
+
+    # Plantilla binaria cuyos bytes son el texto Base64 ya cacheado: no es la misma plantilla
+    fake = template_b64.encode('ascii')
+    body = struct.pack('>I', len(fake)) + fake + struct.pack('>I', len(template)) + template
+    response = client.post(f'{API_PREFIX}/verify', data=body, content_type='application/octet-stream')
+    # El simulador rechaza esos bytes como plantilla; con la clave compartida daba "match": true
+    assert response.get_json().get("match") is not True